@@ -0,0 +1,101 @@
+import time
+import logging
+from config import SCAN_CONCURRENCY, SCAN_MAX_SIGNALS
+from scanner import scan_pairs
+from subscriptions import subscription_store, DIRECTIONS
+from send_queue import send_queue
+from analysis import fetch_pair_klines, evaluate_batch, format_snapshot_signals
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+
+class AlertEngine:
+    """Оповещения подписчиков после закрытия свечи.
+
+    Вызывается со свежим снимком фонового сканера. Сигнал считается один раз
+    на тему, а готовый текст рассылается всем чатам темы через очередь
+    отправки, поэтому стоимость расчета зависит от числа разных символов, а
+    не от числа подписчиков. Оповещение уходит, только когда сигнал по теме
+    появился или изменился; первый проход после запуска лишь запоминает
+    текущее состояние, чтобы перезапуск не повторял старые оповещения.
+    """
+
+    def __init__(self, store, sender, fetch, evaluate_batch, format_direction,
+                 concurrency=SCAN_CONCURRENCY, max_signals=SCAN_MAX_SIGNALS):
+        self.store = store
+        self.sender = sender
+        self.fetch = fetch
+        self.evaluate_batch = evaluate_batch
+        self.format_direction = format_direction
+        self.concurrency = concurrency
+        self.max_signals = max_signals
+        # Последнее разосланное состояние по каждой теме
+        self._last_state = {}
+        self._seeded = False
+
+    async def on_snapshot(self, snapshot):
+        """Обрабатывает новый снимок сканера: направления и подписанные символы"""
+        started = time.monotonic()
+        notifications = self._direction_alerts(snapshot)
+        notifications += await self._symbol_alerts()
+
+        if not self._seeded:
+            self._seeded = True
+            logger.info(f"Alert engine seeded with {len(self._last_state)} topics")
+            return
+
+        delivered = 0
+        for topic, text in notifications:
+            for chat_id in self.store.subscribers(topic):
+                self.sender.send(chat_id, text, parse_mode='Markdown')
+                delivered += 1
+        logger.info(
+            f"Alerts: {len(notifications)} topics changed, {delivered} messages queued "
+            f"in {time.monotonic() - started:.2f}s"
+        )
+
+    def _changed(self, topic, state):
+        """Запоминает состояние темы и сообщает, изменилось ли оно"""
+        previous = self._last_state.get(topic)
+        self._last_state[topic] = state
+        return state is not None and state != previous
+
+    def _direction_alerts(self, snapshot):
+        notifications = []
+        for direction in DIRECTIONS:
+            best = snapshot.best(direction, self.max_signals)
+            if any(result['stale'] for result in best):
+                # По сохраненным свечам не оповещаем: дождемся свежих данных
+                continue
+            state = tuple(result['symbol'] for result in best) or None
+            if self._changed(direction, state) and self.store.subscribers(direction):
+                title = "📈 Лучшее в лонг" if direction == 'long' else "📉 Лучшее в шорт"
+                text = f"🔔 *Обновился список: {title}*\n" + self.format_direction(snapshot, direction)
+                notifications.append((direction, text))
+        return notifications
+
+    async def _symbol_alerts(self):
+        symbols = self.store.symbols()
+        if not symbols:
+            return []
+
+        # Свечи пар из топа уже лежат в кэше после сканирования
+        loaded, _ = await scan_pairs(symbols, self.fetch, concurrency=self.concurrency)
+        results = {result['symbol']: result for result in self.evaluate_batch(loaded)}
+        stale = {item[0] for item in loaded if any(data.stale for data in item[1:])}
+
+        notifications = []
+        for symbol in symbols:
+            if symbol in stale:
+                # По сохраненным свечам не оповещаем: дождемся свежих данных
+                continue
+            result = results.get(symbol)
+            state = result['direction'] if result is not None else None
+            if self._changed(symbol, state):
+                notifications.append((symbol, f"🔔 *Новый сигнал по подписке {symbol}*\n" + result['signal']))
+        return notifications
+
+
+# Оповещения по подпискам пользователей
+alert_engine = AlertEngine(subscription_store, send_queue, fetch_pair_klines, evaluate_batch, format_snapshot_signals)
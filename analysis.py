@@ -1,72 +1,67 @@
-import requests
 import asyncio
 import random
 import logging
-from config import BYBIT_API_URL, COINGECKO_API_URL, ALTERNATIVE_API_URL
+import numpy as np
+from config import (
+    COINGECKO_API_URL, ALTERNATIVE_API_URL, SCAN_CONCURRENCY, SCAN_MAX_PAIRS, SCAN_MAX_SIGNALS,
+    SNAPSHOT_INTERVAL, SNAPSHOT_DELAY, SNAPSHOT_MAX_AGE, SNAPSHOT_MAX_PAIRS, MARKET_DATA_MODE,
+    SIGNAL_ENTRY_FACTOR, SIGNAL_STOP_FACTOR, SIGNAL_MIN_RISK_REWARD,
+    PREFILTER_MIN_TURNOVER, PREFILTER_MAX_SPREAD, PREFILTER_MIN_SCORE
+)
+from bybit_client import bybit_client
+from scanner import scan_pairs, MarketScanner, TopK
+from singleflight import SingleFlight
+from scheduler import job_scheduler, PRIORITY_TICKER, PRIORITY_SCAN, SchedulerBusy, DuplicateJob
+from progress import ProgressReporter
+from tracing import span
+from metrics import ANALYSIS_STAGE, HANDLER_LATENCY, SCAN_DURATION, SCAN_PAIRS, PREFILTER_PAIRS
+from kline_cache import kline_cache, INTERVAL_MS, BYBIT_INTERVALS
+from candles import candle_store, CandleSeries
+from instruments import instrument_registry
+from bybit_stream import BybitStream
+import indicators
+from indicators import as_ohlcv
 from utils import calculate_risk_reward, format_signal
+from analysis_workers import PairBatch, evaluate_pairs, make_signal_result, analysis_pool, BARS_4H
 from datetime import datetime, timedelta
 import time
 
 # Настраиваем логгер
 logger = logging.getLogger(__name__)
 
-# Улучшенные заголовки для обхода блокировки
-HEADERS = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-    'Accept': 'application/json, text/plain, */*',
-    'Accept-Language': 'en-US,en;q=0.9',
-    'Accept-Encoding': 'gzip, deflate, br',
-    'Connection': 'keep-alive',
-    'Sec-Fetch-Dest': 'empty',
-    'Sec-Fetch-Mode': 'cors',
-    'Sec-Fetch-Site': 'same-origin'
-}
+# Максимальное число свечей в одном ответе /v5/market/kline
+BYBIT_KLINE_MAX_LIMIT = 1000
+
+# Сколько свечей каждого интервала нужно для анализа
+KLINE_LIMITS = {'1d': 200, '4h': 100, '1h': 50}
+
+# Поля снимка тикеров для предварительного отбора пар
+TICKER_FIELDS = ('lastPrice', 'highPrice24h', 'lowPrice24h', 'turnover24h', 'bid1Price', 'ask1Price', 'volume24h')
+# Уровни считаются по BARS_4H свечам 4h - окно в сутках, на которое растягивается 24-часовой диапазон
+LEVELS_HORIZON_DAYS = BARS_4H * INTERVAL_MS['4h'] / INTERVAL_MS['1d']
+# Наименьшее отношение сопротивление/поддержка для риск/прибыль >= SIGNAL_MIN_RISK_REWARD
+PREFILTER_REQUIRED_RANGE = indicators.required_range(SIGNAL_ENTRY_FACTOR, SIGNAL_STOP_FACTOR, SIGNAL_MIN_RISK_REWARD)
+
+# Общие вычисления для одновременных одинаковых запросов пользователей
+analysis_flights = SingleFlight()
 
 async def sleep_random():
     """Случайная задержка от 0.5 до 1 секунды"""
     await asyncio.sleep(random.uniform(0.5, 1.0))
 
-def make_request_with_retry(url, params=None, max_retries=3):
-    """Делает запрос с повторными попытками"""
-    
-    for attempt in range(max_retries):
-        try:
-            # Добавляем случайную задержку между запросами
-            time.sleep(random.uniform(0.3, 0.8))
-            
-            response = requests.get(
-                url, 
-                params=params, 
-                headers=HEADERS, 
-                timeout=15
-            )
-            
-            if response.status_code == 200:
-                return response
-            elif response.status_code == 429:
-                logger.warning(f"Rate limit hit, waiting longer...")
-                time.sleep(random.uniform(2, 4))
-                continue
-            else:
-                response.raise_for_status()
-                
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"Request failed on attempt {attempt + 1}: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(random.uniform(1, 2))
-    
-    return None
-
-def validate_ticker(ticker):
+async def validate_ticker(ticker):
     """Проверяет, существует ли торговая пара на Bybit."""
+    # Обычно хватает реестра инструментов в памяти
+    if instrument_registry.is_loaded:
+        return f"{ticker}USDT" in instrument_registry
+
     try:
-        url = f"{BYBIT_API_URL}/v5/market/instruments-info"
         params = {
             'category': 'spot',
             'symbol': f"{ticker}USDT"
         }
         
-        response = make_request_with_retry(url, params)
+        response = await bybit_client.get('/v5/market/instruments-info', params)
         if response is None:
             logger.error(f"Failed to validate ticker {ticker} after all retries")
             return False
@@ -77,29 +72,129 @@ def validate_ticker(ticker):
         logger.error(f"Error validating ticker {ticker}: {e}")
         return False
 
-def get_klines(symbol, interval, limit=200):
-    """Получает исторические данные с Bybit API"""
+async def get_klines(symbol, interval, limit=200):
+    """Получает исторические данные, используя кэш до закрытия текущей свечи"""
+    with span('get_klines', symbol=symbol, interval=interval, limit=limit) as fetch_span:
+        # Ряд, который обновляется WebSocket-потоком, не требует запросов к REST
+        if market_stream.is_live(symbol, interval):
+            series = candle_store.get(symbol, interval)
+            if series.has_history(limit):
+                fetch_span.set('source', 'stream')
+                return series.tail(limit)
+
+        klines = kline_cache.get(symbol, interval, limit)
+        if klines is not None:
+            fetch_span.set('source', 'cache')
+            return klines
+
+        fetch_span.set('source', 'rest')
+        # Закрытые свечи записи еще действительны - догружаем только незакрытую
+        history = kline_cache.get_history(symbol, interval, limit)
+        if history is not None:
+            fetch_span.set('source', 'open_candle')
+            klines = await refresh_open_candle(history)
+        else:
+            klines = await refresh_klines(symbol, interval, limit)
+        if klines:
+            kline_cache.put(symbol, interval, limit, klines)
+            return klines
+
+        # Bybit недоступно или автомат разомкнут - отдаем последние сохраненные свечи с пометкой
+        stale = kline_cache.get_stale(symbol, interval, limit)
+        if stale is None:
+            series = candle_store.get(symbol, interval)
+            stale = series if len(series) else None
+        if stale is None:
+            return klines
+        fetch_span.set('source', 'stale')
+        logger.warning(f"Serving stale {symbol} {interval} candles")
+        stale = stale.tail(limit)
+        stale.stale = True
+        return stale
+
+async def refresh_klines(symbol, interval, limit=200):
+    """Обновляет ряд свечей в хранилище, догружая только недостающие свечи"""
+    series = candle_store.get(symbol, interval)
+
+    if len(series) and interval in INTERVAL_MS:
+        now_ms = int(time.time() * 1000)
+        # Последняя свеча могла быть незакрытой, поэтому запрашиваем и ее
+        missing = (now_ms - series.last_timestamp) // INTERVAL_MS[interval] + 2
+        # Ряду, восстановленному с диска, может не хватать как раз последних свечей
+        if missing <= BYBIT_KLINE_MAX_LIMIT and series.has_history(limit - missing + 1):
+            rows = await fetch_klines(symbol, interval, missing, start=series.last_timestamp)
+            if rows is None:
+                return None
+            if series.merge(rows):
+                return series.tail(limit)
+            logger.warning(f"Gap in {symbol} {interval} candles, reloading full history")
+
+    rows = await fetch_kline_history(symbol, interval, limit)
+    if rows is None:
+        return None
+    series.replace(rows, limit)
+    return series.tail(limit)
+
+async def refresh_open_candle(klines):
+    """Копия закэшированных свечей с заново загруженной последней (незакрытой) свечой"""
+    rows = await fetch_klines(klines.symbol, klines.interval, 1, start=klines.last_timestamp)
+    if not rows:
+        return None
+    updated = klines.tail(len(klines))
+    if not updated.merge(rows):
+        return None
+    return updated
+
+async def backfill_klines(symbol, interval):
+    """Догружает ряд свечей для WebSocket-потока через REST"""
+    # +1 свеча: состояние тренда потока считается только по закрытым свечам
+    return await refresh_klines(symbol, interval, KLINE_LIMITS.get(interval, 200) + 1)
+
+# Потоковое обновление свечей (используется при MARKET_DATA_MODE=stream)
+market_stream = BybitStream(backfill_klines)
+
+async def fetch_kline_history(symbol, interval, limit):
+    """Загружает limit последних свечей, при необходимости постранично"""
+    rows = []
+    end = None
+    while len(rows) < limit:
+        page_limit = min(limit - len(rows), BYBIT_KLINE_MAX_LIMIT)
+        page = await fetch_kline_rows(symbol, interval, page_limit, end=end)
+        if page is None:
+            return None
+        # Страницы идут от новых свечей к старым, как и строки внутри страницы
+        rows.extend(page)
+        if len(page) < page_limit:
+            break
+        end = int(page[-1][0]) - 1
+    return CandleSeries.from_bybit(symbol, interval, rows)
+
+async def fetch_klines(symbol, interval, limit=200, start=None, end=None):
+    """Получает исторические данные с Bybit API в виде CandleSeries"""
+    rows = await fetch_kline_rows(symbol, interval, limit, start, end)
+    if rows is None:
+        return None
+    return CandleSeries.from_bybit(symbol, interval, rows)
+
+async def fetch_kline_rows(symbol, interval, limit=200, start=None, end=None):
+    """Получает сырые свечи Bybit [start, open, high, low, close, volume, turnover] от новых к старым"""
     try:
-        # Преобразуем интервалы в формат Bybit
-        bybit_intervals = {
-            '1h': '60',
-            '4h': '240', 
-            '1d': 'D'
-        }
-        
-        if interval not in bybit_intervals:
+        if interval not in BYBIT_INTERVALS:
             logger.error(f"Unsupported interval: {interval}")
             return None
             
-        url = f"{BYBIT_API_URL}/v5/market/kline"
         params = {
             'category': 'spot',
             'symbol': symbol,
-            'interval': bybit_intervals[interval],
+            'interval': BYBIT_INTERVALS[interval],
             'limit': limit
         }
+        if start is not None:
+            params['start'] = start
+        if end is not None:
+            params['end'] = end
         
-        response = make_request_with_retry(url, params)
+        response = await bybit_client.get('/v5/market/kline', params)
         if response is None:
             logger.error(f"Failed to get klines for {symbol} after all retries")
             return None
@@ -109,43 +204,42 @@ def get_klines(symbol, interval, limit=200):
             logger.error(f"Bybit API error for {symbol}: {data.get('retMsg')}")
             return None
             
-        # Преобразуем формат данных Bybit в формат Binance для совместимости
-        klines = data.get('result', {}).get('list', [])
-        
-        # Bybit возвращает данные в обратном порядке, исправляем это
-        klines.reverse()
-        
-        # Преобразуем формат: Bybit [timestamp, open, high, low, close, volume, turnover]
-        # в формат Binance [timestamp, open, high, low, close, volume, ...]
-        converted_klines = []
-        for kline in klines:
-            converted_klines.append([
-                int(kline[0]),  # timestamp
-                kline[1],       # open
-                kline[2],       # high
-                kline[3],       # low
-                kline[4],       # close
-                kline[5],       # volume
-                0,              # close_time (не используется)
-                0,              # quote_asset_volume (не используется)
-                0,              # number_of_trades (не используется)
-                0,              # taker_buy_base_asset_volume (не используется)
-                0,              # taker_buy_quote_asset_volume (не используется)
-                0               # ignore (не используется)
-            ])
-        
-        return converted_klines
+        return data.get('result', {}).get('list', [])
     except Exception as e:
         logger.error(f"Error getting klines for {symbol}: {e}")
         return None
 
-def get_top_pairs():
-    """Получает топ торговые пары с Bybit"""
+def prefilter_tickers(items):
+    """Маска пар, которые могут дать сигнал: ликвидные и с достаточным размахом цены.
+
+    Считается одним проходом по снимку тикеров: оборот за 24ч не меньше
+    PREFILTER_MIN_TURNOVER, спред не шире PREFILTER_MAX_SPREAD, а
+    24-часовой диапазон, растянутый на окно уровней, не меньше
+    PREFILTER_MIN_SCORE от нужного для риск/прибыли. Неизвестные значения
+    (нет полей в ответе) пару не отсеивают. Возвращает (маска, оборот).
+    """
+    table = np.array(
+        [[float(item.get(field) or 'nan') for field in TICKER_FIELDS] for item in items], dtype=np.float64
+    ).reshape(-1, len(TICKER_FIELDS))
+    last, high, low, turnover, bid, ask, volume = table.T
+    turnover = np.where(np.isnan(turnover), volume * last, turnover)
+
+    with np.errstate(all='ignore'):
+        spread = (ask - bid) / ((ask + bid) / 2)
+    score = indicators.range_score(high, low, PREFILTER_REQUIRED_RANGE, LEVELS_HORIZON_DAYS)
+    mask = ~(turnover < PREFILTER_MIN_TURNOVER) & ~(spread > PREFILTER_MAX_SPREAD) & ~(score < PREFILTER_MIN_SCORE)
+    return mask, turnover
+
+async def get_top_pairs(limit=50, prefilter=True):
+    """Получает топ торговые пары с Bybit.
+
+    limit=None - все пары. prefilter=False - без отсева по ликвидности и
+    размаху цены (только сортировка по обороту).
+    """
     try:
-        url = f"{BYBIT_API_URL}/v5/market/tickers"
         params = {'category': 'spot'}
         
-        response = make_request_with_retry(url, params)
+        response = await bybit_client.get('/v5/market/tickers', params)
         if response is None:
             logger.error("Failed to get top pairs after all retries, using fallback")
             return get_fallback_pairs()
@@ -155,19 +249,24 @@ def get_top_pairs():
             logger.error(f"Bybit API error: {data.get('retMsg')}")
             return get_fallback_pairs()
             
-        # Фильтруем только USDT пары и преобразуем в формат Binance
-        pairs = []
-        for item in data.get('result', {}).get('list', []):
-            if item['symbol'].endswith('USDT'):
-                pairs.append({
-                    'symbol': item['symbol'],
-                    'volume': item['volume24h'],
-                    'lastPrice': item['lastPrice']
-                })
-        
-        # Сортируем по объему торгов
-        sorted_pairs = sorted(pairs, key=lambda x: float(x['volume']) * float(x['lastPrice']), reverse=True)[:50]
-        logger.info(f"Retrieved {len(sorted_pairs)} top pairs from Bybit")
+        # Фильтруем только USDT пары и отсеиваем те, что не пройдут правила сигнала
+        items = [item for item in data.get('result', {}).get('list', []) if item['symbol'].endswith('USDT')]
+        if not items:
+            return []
+        mask, turnover = prefilter_tickers(items)
+        if not prefilter:
+            mask[:] = True
+        PREFILTER_PAIRS.labels('kept').inc(int(mask.sum()))
+        PREFILTER_PAIRS.labels('dropped').inc(int(len(mask) - mask.sum()))
+
+        # Сортируем по обороту торгов
+        order = [i for i in np.argsort(-turnover, kind='stable') if mask[i]][:limit]
+        sorted_pairs = [{
+            'symbol': items[i]['symbol'],
+            'volume': items[i]['volume24h'],
+            'lastPrice': items[i]['lastPrice']
+        } for i in order]
+        logger.info(f"Retrieved {len(sorted_pairs)} top pairs from Bybit ({int(mask.sum())}/{len(items)} passed prefilter)")
         return sorted_pairs
     except Exception as e:
         logger.error(f"Error getting top pairs: {e}")
@@ -198,47 +297,26 @@ def get_fallback_pairs():
 def calculate_sma(data, period):
     if not data or len(data) < period:
         return None
-    closes = [float(candle[4]) for candle in data]
-    return sum(closes[-period:]) / period
+    return indicators.sma(as_ohlcv(data).close, period)
 
 def calculate_rsi(data, period=14):
-    if not data or len(data) < period:
+    if not data or len(data) <= period:
         return None
-    closes = [float(candle[4]) for candle in data]
-    gains = losses = 0
-    for i in range(1, period):
-        diff = closes[i] - closes[i-1]
-        if diff > 0:
-            gains += diff
-        else:
-            losses -= diff
-    avg_gain = gains / period
-    avg_loss = losses / period
-    rs = avg_gain / avg_loss if avg_loss != 0 else 0
-    return 100 - (100 / (1 + rs))
+    return indicators.rsi(as_ohlcv(data).close, period)
 
 def get_support_resistance_levels(data_4h, data_1h):
-    """Улучшенный расчет уровней поддержки и сопротивления"""
+    """Улучшенный расчет уровней поддержки и сопротивления.
+
+    Уровни с 4h (последние 30 свечей) более значимые, с 1h (последние 20
+    свечей) - для точности входа. Берем самые низкие минимумы и самые
+    высокие максимумы.
+    """
     if not data_4h or not data_1h:
         return None, None
 
-    # Берем больше данных для более точного определения уровней
-    recent_4h = data_4h[-30:]  # Последние 30 свечей 4h
-    recent_1h = data_1h[-50:]  # Последние 50 свечей 1h
-
-    # Уровни с 4h таймфрейма (более значимые)
-    lows_4h = [float(candle[3]) for candle in recent_4h]
-    highs_4h = [float(candle[2]) for candle in recent_4h]
-
-    # Уровни с 1h таймфрейма (для точности входа)
-    lows_1h = [float(candle[3]) for candle in recent_1h]
-    highs_1h = [float(candle[2]) for candle in recent_1h]
-
-    # Комбинированный подход: берем самые низкие минимумы и самые высокие максимумы
-    support = min(min(lows_4h), min(lows_1h[-20:]))  # Последние 20 свечей 1h
-    resistance = max(max(highs_4h), max(highs_1h[-20:]))
-
-    return support, resistance
+    columns_4h = as_ohlcv(data_4h)
+    columns_1h = as_ohlcv(data_1h)
+    return indicators.support_resistance(columns_4h.low, columns_4h.high, columns_1h.low, columns_1h.high)
 
 def format_progress_bars(current_step, total_steps, square_type="🟦"):
     """Форматирует прогресс-бары с квадратами"""
@@ -257,9 +335,19 @@ def format_steps_list(steps, current_step):
             result.append(f"🔄 {step_text}")
     return result
 
-async def analyze_ticker(ticker, update):
+def format_progress(steps, current_step, square_type="🟦"):
+    """Текст сообщения с прогрессом: полоса и список этапов"""
+    progress_bars = format_progress_bars(current_step, len(steps), square_type)
+    steps_list = format_steps_list(steps, current_step)
+    return progress_bars + "\n" + "\n".join(steps_list)
+
+async def compute_ticker_analysis(ticker, emit):
+    """Рассчитывает сигнал по тикеру - одно вычисление на всех, кто ждет этот тикер.
+
+    emit(text) передает ожидающим текст прогресса по мере завершения этапов.
+    Возвращает (ok, text).
+    """
     symbol = f"{ticker}USDT"
-    logger.info(f"Starting analysis for {symbol}")
 
     # Этапы анализа тикера
     steps = [
@@ -271,120 +359,289 @@ async def analyze_ticker(ticker, update):
         "Сигнал готов!"
     ]
 
-    # Отправляем начальное сообщение с прогрессом
-    progress_message = await update.message.reply_text("🔄 Запуск анализа...")
-
-    if not validate_ticker(ticker):
-        error_msg = f"❌ Ошибка: тикер {ticker} не найден на Bybit. Попробуйте другой, например, BTC или ETH."
-        await progress_message.edit_text(error_msg)
+    await emit(format_progress(steps, 1))
+    with span('validate'), ANALYSIS_STAGE.labels('validate').time():
+        valid = await validate_ticker(ticker)
+    if not valid:
         logger.warning(f"Ticker {ticker} not found")
-        return error_msg
+        return False, f"❌ Ошибка: тикер {ticker} не найден на Bybit. Попробуйте другой, например, BTC или ETH."
+
+    # Подписываемся на поток только для существующих пар, иначе любой текст стал бы топиком
+    if MARKET_DATA_MODE == 'stream':
+        market_stream.track([symbol])
+
+    # Тикер найден - загружаем свечи
+    await emit(format_progress(steps, 2))
+
+    # Все три таймфрейма загружаем одновременно
+    with span('fetch_klines'), ANALYSIS_STAGE.labels('fetch').time():
+        data_1d, data_4h, data_1h = await asyncio.gather(
+            get_klines(symbol, '1d', 200),
+            get_klines(symbol, '4h', 100),
+            get_klines(symbol, '1h', 50)
+        )
+
+    if not (data_1d and data_4h and data_1h):
+        logger.error(f"No data available for {symbol}")
+        return False, f"❌ Ошибка: нет данных для {ticker}. Bybit API временно недоступно, попробуйте позже."
+
+    # Свечи загружены - считаем индикаторы
+    await emit(format_progress(steps, 3))
+
+    with span('indicators'), ANALYSIS_STAGE.labels('indicators').time():
+        # Разбираем свечи в колонки один раз
+        columns_1d = as_ohlcv(data_1d)
+        columns_4h = as_ohlcv(data_4h)
+        columns_1h = as_ohlcv(data_1h)
+
+        current_price = market_stream.last_price(symbol) or float(columns_1h.close[-1])
+        # Для живых рядов потока тренд и уровни уже посчитаны инкрементально
+        trend = market_stream.trend(symbol)
+        if trend is not None:
+            sma_50_1d, sma_200_1d = trend[:2]
+        else:
+            sma_50_1d = calculate_sma(columns_1d, 50)
+            sma_200_1d = calculate_sma(columns_1d, 200)
 
-    try:
-        # Этап 1 (17%) - подключение (быстро)
-        await asyncio.sleep(0.7)
-        progress_bars = format_progress_bars(1, 6, "🟦")
-        steps_list = format_steps_list(steps, 1)
-        progress_text = progress_bars + "\n" + "\n".join(steps_list)
-        await progress_message.edit_text(progress_text)
-
-        data_1d = get_klines(symbol, '1d', 200)
-        data_4h = get_klines(symbol, '4h', 100)
-        data_1h = get_klines(symbol, '1h', 50)
-
-        if not (data_1d and data_4h and data_1h):
-            error_msg = f"❌ Ошибка: нет данных для {ticker}. Bybit API временно недоступно, попробуйте позже."
-            await progress_message.edit_text(error_msg)
-            logger.error(f"No data available for {symbol}")
-            return error_msg
-
-        # Этап 2 (33%) - загрузка данных (медленно)
-        await asyncio.sleep(1.5)
-        progress_bars = format_progress_bars(2, 6, "🟦")
-        steps_list = format_steps_list(steps, 2)
-        progress_text = progress_bars + "\n" + "\n".join(steps_list)
-        await progress_message.edit_text(progress_text)
-
-        current_price = float(data_1h[-1][4])
-        sma_50_1d = calculate_sma(data_1d, 50)
-        sma_200_1d = calculate_sma(data_1d, 200)
-
-        if sma_50_1d is None or sma_200_1d is None:
-            error_msg = f"❌ Ошибка: недостаточно данных для расчета тренда для {ticker}."
-            await progress_message.edit_text(error_msg)
-            logger.error(f"Insufficient SMA data for {symbol}")
-            return error_msg
-
-        # Этап 3 (50%) - расчет SMA (средне)
-        await asyncio.sleep(1.2)
-        progress_bars = format_progress_bars(3, 6, "🟦")
-        steps_list = format_steps_list(steps, 3)
-        progress_text = progress_bars + "\n" + "\n".join(steps_list)
-        await progress_message.edit_text(progress_text)
-
-        direction = 'Long' if sma_50_1d > sma_200_1d else 'Short'
-        support, resistance = get_support_resistance_levels(data_4h, data_1h)
-
-        if support is None or resistance is None:
-            error_msg = f"❌ Ошибка: не удалось определить уровни для {ticker}."
-            await progress_message.edit_text(error_msg)
-            logger.error(f"Could not determine levels for {symbol}")
-            return error_msg
-
-        # Этап 4 (67%) - уровни входа (средне)
-        await asyncio.sleep(1.0)
-        progress_bars = format_progress_bars(4, 6, "🟦")
-        steps_list = format_steps_list(steps, 4)
-        progress_text = progress_bars + "\n" + "\n".join(steps_list)
-        await progress_message.edit_text(progress_text)
-
-        entry_price = support * 1.005 if direction == 'Long' else resistance * 0.995  # Небольшой отступ
-        stop_loss = support * 0.98 if direction == 'Long' else resistance * 1.02
+    if sma_50_1d is None or sma_200_1d is None:
+        logger.error(f"Insufficient SMA data for {symbol}")
+        return False, f"❌ Ошибка: недостаточно данных для расчета тренда для {ticker}."
+
+    # Тренд определен - ищем уровни
+    await emit(format_progress(steps, 4))
+
+    direction = 'Long' if sma_50_1d > sma_200_1d else 'Short'
+    with span('levels'), ANALYSIS_STAGE.labels('levels').time():
+        support, resistance = trend[2:] if trend is not None else get_support_resistance_levels(columns_4h, columns_1h)
+
+    if support is None or resistance is None:
+        logger.error(f"Could not determine levels for {symbol}")
+        return False, f"❌ Ошибка: не удалось определить уровни для {ticker}."
+
+    # Уровни найдены - считаем риск/прибыль
+    await emit(format_progress(steps, 5))
+
+    with span('format_signal'), ANALYSIS_STAGE.labels('format').time():
+        entry_price = support * SIGNAL_ENTRY_FACTOR if direction == 'Long' else resistance * (2 - SIGNAL_ENTRY_FACTOR)  # Небольшой отступ
+        stop_loss = support * SIGNAL_STOP_FACTOR if direction == 'Long' else resistance * (2 - SIGNAL_STOP_FACTOR)
         take_profit = resistance if direction == 'Long' else support
         risk_reward = calculate_risk_reward(entry_price, stop_loss, take_profit)
 
-        # Этап 5 (83%) - риск/прибыль (быстрее)
-        await asyncio.sleep(0.8)
-        progress_bars = format_progress_bars(5, 6, "🟦")
-        steps_list = format_steps_list(steps, 5)
-        progress_text = progress_bars + "\n" + "\n".join(steps_list)
-        await progress_message.edit_text(progress_text)
-
         stop_loss_pct = ((stop_loss - entry_price) / entry_price) * 100
         take_profit_pct = ((take_profit - entry_price) / entry_price) * 100
         cancel_price = support * 0.99 if direction == 'Long' else resistance * 1.01
 
-        explanation = f"{direction} на основе {'отскока от поддержки' if direction == 'Long' else 'отскока от сопротивления'} с подтверждением тренда."
-        warning = "⚠️ Рекомендуем пропустить сигнал из-за низкого соотношения риск/прибыль." if risk_reward < 2 else ""
+        warnings = []
+        if risk_reward < SIGNAL_MIN_RISK_REWARD:
+            warnings.append("⚠️ Рекомендуем пропустить сигнал из-за низкого соотношения риск/прибыль.")
+        if any(data.stale for data in (data_1d, data_4h, data_1h)):
+            warnings.append(stale_warning(data_1d, data_4h, data_1h))
+        warning = "\n".join(warnings)
 
-        # Этап 6 (100%) - готово (мгновенно)
-        await asyncio.sleep(0.3)
-        progress_bars = format_progress_bars(6, 6, "🟦")
-        steps_list = format_steps_list(steps, 6)
-        progress_text = progress_bars + "\n" + "\n".join(steps_list)
-        await progress_message.edit_text(progress_text)
+        signal = format_signal(symbol, current_price, direction, entry_price, stop_loss, take_profit, stop_loss_pct, take_profit_pct, risk_reward, cancel_price, warning, sma_50_1d, sma_200_1d, support, resistance)
+    logger.info(f"Analysis completed for {symbol}")
+    return True, signal
 
-        await asyncio.sleep(1)  # Пауза 1 сек
+async def schedule(update, key, priority, factory):
+    """Ставит вычисление в очередь планировщика от имени пользователя.
 
-        signal = format_signal(symbol, current_price, direction, entry_price, stop_loss, take_profit, stop_loss_pct, take_profit_pct, risk_reward, cancel_price, warning, sma_50_1d, sma_200_1d, support, resistance)
+    Очередь и защита от повторов - по пользователю, а не по чату: в группе
+    у каждого участника своя очередь. Присоединение к уже идущему общему
+    вычислению слот не занимает.
+    """
+    user = update.effective_user
+    user_id = user.id if user is not None else update.message.chat_id
+    return await job_scheduler.run(user_id, key, priority, factory, queue=key not in analysis_flights)
 
-        await progress_message.delete()  # Удаляем сообщение с прогрессом
-        logger.info(f"Analysis completed for {symbol}")
-        return signal
+async def analyze_ticker(ticker, update):
+    symbol = f"{ticker}USDT"
+    logger.info(f"Starting analysis for {symbol}")
 
+    started = time.perf_counter()
+    key = ('ticker', ticker)
+    source = 'shared' if key in analysis_flights else 'computed'
+
+    # Прогресс у каждого пользователя свой; появляется, только если анализ идет долго
+    reporter = ProgressReporter(update.message, "🔄 Запуск анализа...").start()
+    try:
+        # Одновременные запросы одного тикера разделяют одно вычисление
+        ok, text = await schedule(update, key, PRIORITY_TICKER, lambda: analysis_flights.do(
+            key,
+            lambda emit: compute_ticker_analysis(ticker, emit),
+            listener=reporter.update
+        ))
+    except (SchedulerBusy, DuplicateJob):
+        raise
     except Exception as e:
-        error_msg = f"❌ Произошла ошибка при анализе {ticker}. Bybit API временно недоступно, попробуйте позже."
-        await progress_message.edit_text(error_msg)
         logger.error(f"Error during analysis of {symbol}: {e}")
-        return error_msg
+        return f"❌ Произошла ошибка при анализе {ticker}. Bybit API временно недоступно, попробуйте позже."
+    finally:
+        await reporter.finish()
+        HANDLER_LATENCY.labels('analyze_ticker', source).observe(time.perf_counter() - started)
+
+    return text
+
+def stale_warning(*series):
+    """Пометка расчета по сохраненным свечам, когда Bybit недоступно"""
+    updated = datetime.utcfromtimestamp(max(data.last_timestamp for data in series) / 1000)
+    return f"Bybit API недоступно: расчет по сохраненным свечам (последняя от {updated:%d.%m %H:%M} UTC)."
+
+def mark_stale(results, loaded):
+    """Помечает сигналы пар, посчитанные по сохраненным, а не свежим свечам"""
+    stale = {item[0]: item[1:] for item in loaded if any(data.stale for data in item[1:])}
+    for result in results:
+        series = stale.get(result['symbol'])
+        if series is not None:
+            result['stale'] = True
+            result['signal'] += f"\n⚠️ {stale_warning(*series)}"
+    return results
+
+async def fetch_pair_klines(symbol):
+    """Загружает все три таймфрейма пары, возвращает (symbol, data_1d, data_4h, data_1h) или None"""
+    data_1d, data_4h, data_1h = await asyncio.gather(
+        get_klines(symbol, '1d', 200),
+        get_klines(symbol, '4h', 100),
+        get_klines(symbol, '1h', 50)
+    )
+
+    if not (data_1d and data_4h and data_1h):
+        logger.debug(f"Skipped {symbol} due to missing data")
+        return None
+    return symbol, data_1d, data_4h, data_1h
 
-async def get_best_signals(direction, update):
-    logger.info(f"Starting search for best {direction} signals")
-    
+async def evaluate_pair(symbol, direction=None):
+    """Оценивает одну пару для поиска лучших сигналов, возвращает сигнал или None.
+
+    Если direction не задан, принимается направление текущего тренда.
+    """
+    loaded = await fetch_pair_klines(symbol)
+    if loaded is None:
+        return None
+
+    # Разбираем свечи в колонки один раз на пару
+    _, data_1d, data_4h, data_1h = loaded
+    columns_1d = as_ohlcv(data_1d)
+    columns_4h = as_ohlcv(data_4h)
+    columns_1h = as_ohlcv(data_1h)
+
+    current_price = market_stream.last_price(symbol) or float(columns_1h.close[-1])
+    trend = market_stream.trend(symbol)
+    if trend is None:
+        trend = (
+            calculate_sma(columns_1d, 50), calculate_sma(columns_1d, 200),
+            *get_support_resistance_levels(columns_4h, columns_1h)
+        )
+    result = signal_from_trend(symbol, direction, current_price, *trend)
+    return mark_stale([result], [loaded])[0] if result is not None else None
+
+def signal_from_trend(symbol, direction, current_price, sma_50_1d, sma_200_1d, support, resistance):
+    """Применяет правила сигнала к тренду и уровням пары, возвращает сигнал или None"""
+    if sma_50_1d is None or sma_200_1d is None:
+        logger.debug(f"Skipped {symbol} due to missing SMA data")
+        return None
+
+    # Исправлено: используем английские значения
+    signal_direction = 'long' if sma_50_1d > sma_200_1d else 'short'
+
+    if direction is not None and signal_direction != direction:
+        return None
+    direction = signal_direction
+
+    if support is None or resistance is None:
+        logger.debug(f"Skipped {symbol} due to missing levels")
+        return None
+
+    # Более гибкие условия входа
+    entry_price = support * SIGNAL_ENTRY_FACTOR if direction == 'long' else resistance * (2 - SIGNAL_ENTRY_FACTOR)
+    stop_loss = support * SIGNAL_STOP_FACTOR if direction == 'long' else resistance * (2 - SIGNAL_STOP_FACTOR)
+    take_profit = resistance if direction == 'long' else support
+    risk_reward = calculate_risk_reward(entry_price, stop_loss, take_profit)
+
+    # Сохраняем условие риск/прибыль >= SIGNAL_MIN_RISK_REWARD
+    if risk_reward < SIGNAL_MIN_RISK_REWARD:
+        logger.debug(f"Skipped {symbol} due to low Risk/Reward ({risk_reward:.2f})")
+        return None
+
+    return make_signal_result(symbol, direction, current_price, entry_price, stop_loss, take_profit, risk_reward, sma_50_1d, sma_200_1d, support, resistance)
+
+def evaluate_batch(loaded):
+    """Оценивает сразу все пары матричными вычислениями в текущем процессе.
+
+    loaded - список (symbol, data_1d, data_4h, data_1h). Правила те же, что в
+    evaluate_pair. Возвращает сигналы в любом направлении.
+    """
+    return mark_stale(evaluate_pairs(PairBatch.pack(loaded, market_stream.last_price)), loaded)
+
+async def evaluate_universe(loaded):
+    """Как evaluate_batch, но результат ранжирован.
+
+    Пары с живыми рядами потока оцениваются по инкрементальному состоянию
+    тренда, остальные - матрицами, при большом списке в пуле процессов.
+    """
+    if not loaded:
+        return []
+    with span('evaluate_universe', pairs=len(loaded)):
+        results = []
+        remaining = []
+        for item in loaded:
+            symbol, _, _, data_1h = item
+            trend = market_stream.trend(symbol)
+            if trend is None:
+                remaining.append(item)
+                continue
+            current_price = market_stream.last_price(symbol) or float(data_1h.close[-1])
+            result = signal_from_trend(symbol, None, current_price, *trend)
+            if result is not None:
+                results.append(result)
+
+        results.extend(await analysis_pool.evaluate(PairBatch.pack(remaining, market_stream.last_price)))
+        mark_stale(results, loaded)
+        results.sort(key=lambda result: result['risk_reward'], reverse=True)
+        return results
+
+# Фоновый сканер рынка: кнопки отвечают из его последнего снимка
+market_scanner = MarketScanner(
+    get_top_pairs,
+    fetch_pair_klines,
+    evaluate_universe,
+    max_pairs=SNAPSHOT_MAX_PAIRS or None,
+    concurrency=SCAN_CONCURRENCY,
+    interval=SNAPSHOT_INTERVAL,
+    delay=SNAPSHOT_DELAY
+)
+
+def no_signals_message(direction):
+    opposite_direction = 'шорт' if direction == 'long' else 'лонг'
+    return f"❌ Подходящих пар не найдено на Bybit. Попробуйте через несколько минут или выберите 'Лучшее в {opposite_direction}'."
+
+def format_snapshot_signals(snapshot, direction):
+    """Формирует ответ из готового снимка фонового сканирования"""
+    best = snapshot.best(direction, SCAN_MAX_SIGNALS)
+    age_minutes = int(snapshot.age // 60)
+    age_text = f"\n🕒 Данные обновлены {age_minutes} мин назад ({snapshot.pairs_scanned} пар)"
+    if snapshot.stale_pairs:
+        age_text += f"\n⚠️ Bybit API было недоступно: {snapshot.stale_pairs} пар посчитаны по сохраненным свечам"
+
+    if not best:
+        return no_signals_message(direction) + age_text
+
+    return format_signals(result['signal'] for result in best) + age_text
+
+def format_signals(signals):
+    return "\n" + "="*50 + "\n".join(signals)
+
+async def scan_best_signals(direction, emit):
+    """Ищет лучшие сигналы - одно сканирование на всех, кто ждет это направление.
+
+    Оцениваются все пары, а SCAN_MAX_SIGNALS лучших по риск/прибыль
+    держатся в ограниченном рейтинге. emit(text) передает ожидающим
+    прогресс вместе с предварительным рейтингом: первый сигнал виден, как
+    только его пара оценена. Возвращает (ok, text) с итоговым рейтингом.
+    """
     # Этапы поиска лучших сигналов
     steps = [
-        "Сканирование топ-50 пар на Bybit...",
-        "Проанализировано: 0/8",
+        f"Сканирование топ-{SCAN_MAX_PAIRS} пар на Bybit...",
+        f"Проанализировано: 0/{SCAN_MAX_PAIRS}",
         "Найдено подходящих: 0", 
         "Отбор завершен!"
     ]
@@ -392,138 +649,86 @@ async def get_best_signals(direction, update):
     # Выбираем цвет квадратов
     square_type = "🟩" if direction == 'long' else "🟥"
 
-    # Отправляем начальное сообщение с прогрессом
-    progress_message = await update.message.reply_text("🔄 Запуск поиска...")
-
-    pairs = get_top_pairs()
+    await emit(format_progress(steps, 1, square_type))
+    pairs = await get_top_pairs(SCAN_MAX_PAIRS)
     if not pairs:
-        error_msg = "❌ Ошибка: Bybit API временно недоступно. Попробуйте позже."
-        await progress_message.edit_text(error_msg)
         logger.error("Could not get top pairs")
-        return error_msg
-
-    try:
-        # Этап 1 (25%) - сканирование (быстро)
-        await asyncio.sleep(0.8)
-        progress_bars = format_progress_bars(1, 4, square_type)
-        steps_list = format_steps_list(steps, 1)
-        progress_text = progress_bars + "\n" + "\n".join(steps_list)
-        await progress_message.edit_text(progress_text)
-
-        signals = []
-        processed_count = 0
-        found_signals = 0
-        max_to_process = 8  # Уменьшили для стабильности
-
-        # Выполняем весь анализ в фоне сначала
-        for pair in pairs:
-            if processed_count >= max_to_process:
-                break
-
-            symbol = pair['symbol']
-            processed_count += 1
-
-            try:
-                # Добавляем задержку между запросами
-                await asyncio.sleep(0.8)
-                
-                data_1d = get_klines(symbol, '1d', 200)
-                data_4h = get_klines(symbol, '4h', 100)
-                data_1h = get_klines(symbol, '1h', 50)
-
-                if not (data_1d and data_4h and data_1h):
-                    logger.debug(f"Skipped {symbol} due to missing data")
-                    continue
-
-                current_price = float(data_1h[-1][4])
-                sma_50_1d = calculate_sma(data_1d, 50)
-                sma_200_1d = calculate_sma(data_1d, 200)
-
-                if sma_50_1d is None or sma_200_1d is None:
-                    logger.debug(f"Skipped {symbol} due to missing SMA data")
-                    continue
-
-                # Исправлено: используем английские значения
-                signal_direction = 'long' if sma_50_1d > sma_200_1d else 'short'
-
-                if signal_direction != direction:
-                    continue
-
-                support, resistance = get_support_resistance_levels(data_4h, data_1h)
-
-                if support is None or resistance is None:
-                    logger.debug(f"Skipped {symbol} due to missing levels")
-                    continue
-
-                # Более гибкие условия входа
-                entry_price = support * 1.005 if direction == 'long' else resistance * 0.995
-                stop_loss = support * 0.98 if direction == 'long' else resistance * 1.02
-                take_profit = resistance if direction == 'long' else support
-                risk_reward = calculate_risk_reward(entry_price, stop_loss, take_profit)
-
-                # Сохраняем условие риск/прибыль >= 2.0
-                if risk_reward < 2:
-                    logger.debug(f"Skipped {symbol} due to low Risk/Reward ({risk_reward:.2f})")
-                    continue
-
-                found_signals += 1
-                stop_loss_pct = ((stop_loss - entry_price) / entry_price) * 100
-                take_profit_pct = ((take_profit - entry_price) / entry_price) * 100
-                cancel_price = support * 0.99 if direction == 'long' else resistance * 1.01
-
-                # Исправлено: используем заглавные буквы для отображения
-                display_direction = 'Long' if direction == 'long' else 'Short'
-
-                signals.append(format_signal(symbol, current_price, display_direction, entry_price, stop_loss, take_profit, stop_loss_pct, take_profit_pct, risk_reward, cancel_price, "", sma_50_1d, sma_200_1d, support, resistance))
-
-                if len(signals) >= 3:
-                    break
-                    
-            except Exception as e:
-                logger.error(f"Error processing pair {symbol}: {e}")
-                continue
-
-        # Этап 2 (50%) - анализ (самый долгий)
-        await asyncio.sleep(2.0)
-        progress_bars = format_progress_bars(2, 4, square_type)
-        steps[1] = f"Проанализировано: {processed_count}/8"
-        steps_list = format_steps_list(steps, 2)
-        progress_text = progress_bars + "\n" + "\n".join(steps_list)
-        await progress_message.edit_text(progress_text)
-
-        # Этап 3 (75%) - поиск сигналов (средне)
-        await asyncio.sleep(1.5)
-        progress_bars = format_progress_bars(3, 4, square_type)
-        steps[1] = f"Проанализировано: {processed_count}/8"
-        steps[2] = f"Найдено подходящих: {found_signals}"
-        steps_list = format_steps_list(steps, 3)
-        progress_text = progress_bars + "\n" + "\n".join(steps_list)
-        await progress_message.edit_text(progress_text)
-
-        # Этап 4 (100%) - финализация (быстро)
-        await asyncio.sleep(0.7)
-        progress_bars = format_progress_bars(4, 4, square_type)
-        steps[1] = f"Проанализировано: {processed_count}/8"
-        steps[2] = f"Найдено подходящих: {found_signals}"
-        steps_list = format_steps_list(steps, 4)
-        progress_text = progress_bars + "\n" + "\n".join(steps_list)
-        await progress_message.edit_text(progress_text)
-
-        await asyncio.sleep(1)  # Пауза 1 сек
-        await progress_message.delete()  # Удаляем сообщение с прогрессом
-
-        if not signals:
-            opposite_direction = 'шорт' if direction == 'long' else 'лонг'
-            result = f"❌ Подходящих пар не найдено на Bybit. Попробуйте через несколько минут или выберите 'Лучшее в {opposite_direction}'."
-            logger.info(f"No {direction} signals found")
-            return result
-
-        result = "\n" + "="*50 + "\n".join(signals)
-        logger.info(f"Found {len(signals)} {direction} signals")
+        return False, "❌ Ошибка: Bybit API временно недоступно. Попробуйте позже."
+
+    top = TopK(SCAN_MAX_SIGNALS, key=lambda result: result['risk_reward'])
+    found = 0
+
+    async def evaluate(symbol):
+        nonlocal found
+        result = await evaluate_pair(symbol, direction)
+        if result is not None:
+            found += 1
+            steps[2] = f"Найдено подходящих: {found}"
+            top.push(result)
         return result
 
+    async def on_progress(processed, total):
+        # Счетчик обновляется после каждой пары; в чат уходит только последнее значение
+        steps[1] = f"Проанализировано: {processed}/{total}"
+        text = format_progress(steps, 2, square_type)
+        if len(top):
+            # Предварительный рейтинг: лучшие из уже оцененных пар
+            text += "\n\n⏳ Лучшие на данный момент:" + format_signals(result['signal'] for result in top.ranked())
+        await emit(text)
+
+    symbols = [pair['symbol'] for pair in pairs]
+    await on_progress(0, len(symbols))
+    with SCAN_DURATION.labels('button').time():
+        _, processed_count = await scan_pairs(
+            symbols,
+            evaluate,
+            concurrency=SCAN_CONCURRENCY,
+            on_progress=on_progress
+        )
+    SCAN_PAIRS.labels('button').inc(processed_count)
+    signals = [result['signal'] for result in top.ranked()]
+
+    await emit(format_progress(steps, 3, square_type))
+
+    if not signals:
+        logger.info(f"No {direction} signals found")
+        return True, no_signals_message(direction)
+
+    logger.info(f"Found {found} {direction} signals, sending best {len(signals)}")
+    return True, format_signals(signals)
+
+async def get_best_signals(direction, update):
+    logger.info(f"Starting search for best {direction} signals")
+    started = time.perf_counter()
+
+    # Если есть свежий снимок фонового сканера, отвечаем мгновенно
+    snapshot = market_scanner.snapshot
+    if snapshot is not None and snapshot.age <= SNAPSHOT_MAX_AGE:
+        logger.info(f"Serving {direction} signals from snapshot v{snapshot.version}")
+        text = format_snapshot_signals(snapshot, direction)
+        HANDLER_LATENCY.labels('best_signals', 'snapshot').observe(time.perf_counter() - started)
+        return text
+
+    key = ('best', direction)
+    source = 'shared' if key in analysis_flights else 'computed'
+
+    # Прогресс у каждого пользователя свой; появляется, только если поиск идет долго.
+    # В нем же показываются предварительные сигналы, поэтому разметка как у итогового ответа
+    reporter = ProgressReporter(update.message, "🔄 Запуск поиска...", parse_mode='Markdown').start()
+    try:
+        # Одновременные нажатия одной кнопки разделяют одно сканирование
+        ok, text = await schedule(update, key, PRIORITY_SCAN, lambda: analysis_flights.do(
+            key,
+            lambda emit: scan_best_signals(direction, emit),
+            listener=reporter.update
+        ))
+    except (SchedulerBusy, DuplicateJob):
+        raise
     except Exception as e:
-        error_msg = f"❌ Произошла ошибка при поиске сигналов. Bybit API временно недоступно, попробуйте позже."
-        await progress_message.edit_text(error_msg)
         logger.error(f"Error during {direction} signals search: {e}")
-        return error_msg
+        return f"❌ Произошла ошибка при поиске сигналов. Bybit API временно недоступно, попробуйте позже."
+    finally:
+        await reporter.finish()
+        HANDLER_LATENCY.labels('best_signals', source).observe(time.perf_counter() - started)
+
+    return text
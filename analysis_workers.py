@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from config import SIGNAL_ENTRY_FACTOR, SIGNAL_STOP_FACTOR, SIGNAL_MIN_RISK_REWARD, ANALYSIS_WORKERS, ANALYSIS_SHARD_MIN
+import indicators
+from indicators import as_ohlcv
+from utils import format_signal
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Сколько последних баров каждого таймфрейма нужно правилам сигнала
+BARS_1D = 200
+BARS_4H = 30
+BARS_1H = 20
+
+
+def make_signal_result(symbol, direction, current_price, entry_price, stop_loss, take_profit, risk_reward, sma_50_1d, sma_200_1d, support, resistance):
+    """Формирует результат оценки пары с готовым текстом сигнала"""
+    stop_loss_pct = ((stop_loss - entry_price) / entry_price) * 100
+    take_profit_pct = ((take_profit - entry_price) / entry_price) * 100
+    cancel_price = support * 0.99 if direction == 'long' else resistance * 1.01
+
+    # Исправлено: используем заглавные буквы для отображения
+    display_direction = 'Long' if direction == 'long' else 'Short'
+
+    signal = format_signal(symbol, current_price, display_direction, entry_price, stop_loss, take_profit, stop_loss_pct, take_profit_pct, risk_reward, cancel_price, "", sma_50_1d, sma_200_1d, support, resistance)
+    return {'symbol': symbol, 'direction': direction, 'risk_reward': risk_reward, 'signal': signal, 'stale': False}
+
+
+class PairBatch:
+    """Пары для оценки в виде матриц символы × бары (NaN там, где баров нет).
+
+    Только последние нужные правилам бары каждого таймфрейма: такой пакет
+    передается в другой процесс как несколько непрерывных буферов float64,
+    а не как вложенные списки свечей.
+    """
+
+    __slots__ = ('symbols', 'close_1d', 'low_4h', 'high_4h', 'low_1h', 'high_1h', 'price')
+
+    def __init__(self, symbols, close_1d, low_4h, high_4h, low_1h, high_1h, price):
+        self.symbols = symbols
+        self.close_1d = close_1d
+        self.low_4h = low_4h
+        self.high_4h = high_4h
+        self.low_1h = low_1h
+        self.high_1h = high_1h
+        self.price = price
+
+    def __len__(self):
+        return len(self.symbols)
+
+    @classmethod
+    def pack(cls, loaded, last_price=None):
+        """Собирает пакет из (symbol, data_1d, data_4h, data_1h); last_price(symbol) - цена из потока или None"""
+        symbols = [item[0] for item in loaded]
+        columns = [(as_ohlcv(data_1d), as_ohlcv(data_4h), as_ohlcv(data_1h)) for _, data_1d, data_4h, data_1h in loaded]
+        price = np.array([
+            (last_price(symbol) if last_price is not None else None) or (c_1h.close[-1] if len(c_1h) else np.nan)
+            for symbol, (_, _, c_1h) in zip(symbols, columns)
+        ], dtype=np.float64)
+        return cls(
+            symbols,
+            indicators.right_aligned([c_1d.close for c_1d, _, _ in columns], BARS_1D),
+            indicators.right_aligned([c_4h.low for _, c_4h, _ in columns], BARS_4H),
+            indicators.right_aligned([c_4h.high for _, c_4h, _ in columns], BARS_4H),
+            indicators.right_aligned([c_1h.low for _, _, c_1h in columns], BARS_1H),
+            indicators.right_aligned([c_1h.high for _, _, c_1h in columns], BARS_1H),
+            price
+        )
+
+    def shard(self, count):
+        """Делит пакет на count частей примерно равного размера"""
+        bounds = np.linspace(0, len(self), count + 1).astype(int)
+        return [
+            PairBatch(self.symbols[start:end], *(getattr(self, name)[start:end] for name in self.__slots__[1:]))
+            for start, end in zip(bounds[:-1], bounds[1:]) if end > start
+        ]
+
+
+def evaluate_pairs(batch):
+    """Оценивает все пары пакета матричными вычислениями.
+
+    Правила те же, что в analysis.evaluate_pair, но SMA, уровни и
+    риск/прибыль считаются одним проходом по матрице. Возвращает сигналы в
+    любом направлении. Функция верхнего уровня без состояния, поэтому
+    выполняется и в процессах пула.
+    """
+    if not len(batch):
+        return []
+
+    sma_50 = indicators.batch_sma(batch.close_1d, 50)
+    sma_200 = indicators.batch_sma(batch.close_1d, 200)
+    support, resistance = indicators.batch_support_resistance(
+        batch.low_4h, batch.high_4h, batch.low_1h, batch.high_1h
+    )
+
+    is_long = sma_50 > sma_200
+    entry, stop, take, risk_reward = indicators.trade_levels(
+        is_long, support, resistance, SIGNAL_ENTRY_FACTOR, SIGNAL_STOP_FACTOR
+    )
+
+    with np.errstate(invalid='ignore'):
+        qualified = ~np.isnan(sma_50 + sma_200 + support + resistance) & (risk_reward >= SIGNAL_MIN_RISK_REWARD)
+
+    results = []
+    for i in np.flatnonzero(qualified):
+        direction = 'long' if is_long[i] else 'short'
+        results.append(make_signal_result(
+            batch.symbols[i], direction, float(batch.price[i]), float(entry[i]), float(stop[i]), float(take[i]),
+            float(risk_reward[i]), float(sma_50[i]), float(sma_200[i]), float(support[i]), float(resistance[i])
+        ))
+    return results
+
+
+class AnalysisPool:
+    """Оценка больших пакетов пар в пуле процессов.
+
+    Пакет делится на части по числу процессов, части считаются параллельно,
+    а результаты сливаются в один список, ранжированный по риск/прибыли.
+    Event loop бота при этом только собирает матрицы и ждет. Пакеты меньше
+    shard_min пар на процесс считаются на месте: передача в другой процесс
+    обошлась бы дороже самой оценки.
+    """
+
+    def __init__(self, workers=ANALYSIS_WORKERS, shard_min=ANALYSIS_SHARD_MIN):
+        self.workers = workers
+        self.shard_min = shard_min
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn: не копируем в дочерние процессы работающий event loop и потоки бота
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    async def evaluate(self, batch):
+        """Сигналы пакета PairBatch, от лучшего риск/прибыль к худшему"""
+        shards = min(self.workers, len(batch) // self.shard_min) if self.shard_min else self.workers
+        if shards <= 1:
+            results = evaluate_pairs(batch)
+        else:
+            loop = asyncio.get_running_loop()
+            executor = self._get_executor()
+            try:
+                parts = await asyncio.gather(*(
+                    loop.run_in_executor(executor, evaluate_pairs, part) for part in batch.shard(shards)
+                ))
+                results = [result for part in parts for result in part]
+            except BrokenProcessPool as e:
+                # Пул пересоздается при следующем сканировании
+                logger.error(f"Analysis pool failed, evaluating in process: {e}")
+                self.close()
+                results = evaluate_pairs(batch)
+        results.sort(key=lambda result: result['risk_reward'], reverse=True)
+        return results
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Пул процессов для оценки полного списка пар
+analysis_pool = AnalysisPool()
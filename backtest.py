@@ -0,0 +1,359 @@
+"""Офлайн-бэктест правил сигнала на исторических часовых свечах.
+
+Загрузка истории с Bybit (по файлу .npz на символ):
+    python backtest.py download --top 100 --days 1095 --data-dir backtest_data
+
+Прогон правил с перебором параметров на пуле процессов:
+    python backtest.py run --data-dir backtest_data --entry 1.003 1.005 --stop 0.97 0.98 --min-rr 1.5 2 3
+
+Правила те же, что у бота: тренд по SMA50/SMA200 дневных закрытий,
+поддержка и сопротивление по последним 30 свечам 4h и 20 свечам 1h, уровни
+входа и стопа из indicators.trade_levels. Все ряды восстанавливаются из
+часовых свечей, как их видел бы бот при закрытии каждого часа.
+"""
+import os
+import glob
+import json
+import time
+import asyncio
+import logging
+import argparse
+import itertools
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from config import SIGNAL_ENTRY_FACTOR, SIGNAL_STOP_FACTOR, SIGNAL_MIN_RISK_REWARD, SCAN_CONCURRENCY
+import indicators
+from candles import COLUMNS
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+HOUR_MS = 60 * 60 * 1000
+DAY_HOURS = 24
+BLOCK_HOURS = 4
+
+# Окно свечей 4h для уровней, как в indicators.support_resistance
+WINDOW_4H = 30
+
+# Сделки считаются блоками, чтобы окна сделок не занимали много памяти
+CHUNK_SIZE = 4096
+
+# Границы гистограммы R-множителей
+R_BINS = np.arange(-1.5, 6.01, 0.5)
+
+
+@dataclass(frozen=True)
+class RuleParams:
+    """Параметры правил сигнала для одного прогона"""
+    entry_factor: float = SIGNAL_ENTRY_FACTOR
+    stop_factor: float = SIGNAL_STOP_FACTOR
+    min_risk_reward: float = SIGNAL_MIN_RISK_REWARD
+
+
+def load_history(path):
+    """Читает часовые свечи символа из .npz"""
+    with np.load(path) as data:
+        return {name: data[name] for name in COLUMNS}
+
+
+def hourly_grid(history):
+    """Выравнивает свечи на непрерывную часовую сетку от начала суток.
+
+    Пропущенные часы заполняются плоской свечой по предыдущему закрытию, а
+    длина обрезается до целого числа 4-часовых блоков.
+    """
+    timestamp = history['timestamp']
+    if not len(timestamp):
+        return None
+
+    first_day = -(-int(timestamp[0]) // (DAY_HOURS * HOUR_MS)) * DAY_HOURS * HOUR_MS
+    start = np.searchsorted(timestamp, first_day)
+    timestamp = timestamp[start:]
+    if not len(timestamp):
+        return None
+
+    length = int((timestamp[-1] - first_day) // HOUR_MS) + 1
+    length -= length % BLOCK_HOURS
+    index = (timestamp - first_day) // HOUR_MS
+    keep = index < length
+    index = index[keep]
+
+    close = np.full(length, np.nan)
+    close[index] = history['close'][start:][keep]
+    present = ~np.isnan(close)
+    # Индекс последнего известного закрытия для каждого часа
+    last_known = np.maximum.accumulate(np.where(present, np.arange(length), 0))
+    filled_close = close[last_known]
+
+    grid = {'close': filled_close}
+    for name in ('open', 'high', 'low'):
+        column = filled_close.copy()
+        column[index] = history[name][start:][keep]
+        grid[name] = column
+    return grid
+
+
+def signal_features(grid):
+    """SMA50/SMA200 и уровни для каждого часа; NaN, где истории не хватает"""
+    close, high, low = grid['close'], grid['high'], grid['low']
+    length = len(close)
+    hours = np.arange(length)
+
+    # Дневная свеча текущих суток еще не закрыта: ее закрытие - текущий час
+    day = hours // DAY_HOURS
+    daily_close = close[DAY_HOURS - 1::DAY_HOURS]
+    daily_sum = np.concatenate(([0.0], np.cumsum(daily_close)))
+
+    def daily_sma(period):
+        values = np.full(length, np.nan)
+        valid = day >= period - 1
+        d = day[valid]
+        values[valid] = (daily_sum[d] - daily_sum[d - (period - 1)] + close[valid]) / period
+        return values
+
+    # Свеча 4h текущего блока еще не закрыта: ее экстремум - с начала блока
+    block = hours // BLOCK_HOURS
+    partial_low = np.minimum.accumulate(low.reshape(-1, BLOCK_HOURS), axis=1).ravel()
+    partial_high = np.maximum.accumulate(high.reshape(-1, BLOCK_HOURS), axis=1).ravel()
+    block_low = low.reshape(-1, BLOCK_HOURS).min(axis=1)
+    block_high = high.reshape(-1, BLOCK_HOURS).max(axis=1)
+
+    # Экстремумы WINDOW_4H - 1 закрытых блоков перед текущим (окно 1h целиком внутри)
+    previous = WINDOW_4H - 1
+    prior_low = np.full(len(block_low), np.nan)
+    prior_high = np.full(len(block_high), np.nan)
+    prior_low[previous:] = indicators.rolling_min(block_low, previous)[:len(block_low) - previous]
+    prior_high[previous:] = indicators.rolling_max(block_high, previous)[:len(block_high) - previous]
+
+    support = np.fmin(prior_low[block], partial_low)
+    resistance = np.fmax(prior_high[block], partial_high)
+    support[np.isnan(prior_low[block])] = np.nan
+    resistance[np.isnan(prior_high[block])] = np.nan
+
+    return {'sma_50': daily_sma(50), 'sma_200': daily_sma(200), 'support': support, 'resistance': resistance}
+
+
+def _windows(values, starts, width):
+    """Матрица сделки × бары: width баров от каждого starts (за концом ряда - NaN)"""
+    padded = np.concatenate((values, np.full(width, np.nan)))
+    return sliding_window_view(padded, width)[starts]
+
+
+def _first_true(mask):
+    """Номер первого True в каждой строке; ширина строки, если True нет"""
+    return np.where(mask.any(axis=1), mask.argmax(axis=1), mask.shape[1])
+
+
+def simulate_trades(grid, features, params, fill_bars=24, max_hold=168):
+    """Оценивает правила на каждом часе и разыгрывает сделки матричными операциями.
+
+    Сигнал - лимитная заявка по цене входа на fill_bars следующих часов.
+    После входа сделка закрывается по стопу, по цели или через max_hold
+    часов по закрытию; если стоп и цель задеты в одном часе, считаем стоп.
+    Одновременно открыта одна сделка на символ. Возвращает R-множители
+    сделок (результат в долях риска входа).
+    """
+    sma_50, sma_200 = features['sma_50'], features['sma_200']
+    support, resistance = features['support'], features['resistance']
+
+    is_long = sma_50 > sma_200
+    entry, stop, take, risk_reward = indicators.trade_levels(
+        is_long, support, resistance, params.entry_factor, params.stop_factor
+    )
+    with np.errstate(invalid='ignore'):
+        qualified = ~np.isnan(sma_50 + sma_200 + support + resistance) & (risk_reward >= params.min_risk_reward)
+    signals = np.flatnonzero(qualified)
+
+    # Шорт сводим к лонгу сменой знака цен: стоп и цель меняются местами сами
+    sign_of = np.where(is_long, 1.0, -1.0)
+    outcomes = []
+    for offset in range(0, len(signals), CHUNK_SIZE):
+        chunk = signals[offset:offset + CHUNK_SIZE]
+        sign = sign_of[chunk][:, None]
+        trade_entry = sign[:, 0] * entry[chunk]
+        trade_stop = sign[:, 0] * stop[chunk]
+        trade_take = sign[:, 0] * take[chunk]
+
+        # Вход: цена дошла до заявки в одном из следующих fill_bars часов
+        lows = np.where(sign > 0, _windows(grid['low'], chunk + 1, fill_bars), -_windows(grid['high'], chunk + 1, fill_bars))
+        with np.errstate(invalid='ignore'):
+            fill_offset = _first_true(lows <= trade_entry[:, None])
+        filled = fill_offset < fill_bars
+        chunk, sign = chunk[filled], sign[filled]
+        trade_entry, trade_stop, trade_take = trade_entry[filled], trade_stop[filled], trade_take[filled]
+        fill_at = chunk + 1 + fill_offset[filled]
+
+        # Гэп ниже заявки дает вход по открытию
+        opens = sign[:, 0] * np.concatenate((grid['open'], [np.nan]))[np.minimum(fill_at, len(grid['open']))]
+        fill_price = np.fmin(opens, trade_entry)
+
+        lows = np.where(sign > 0, _windows(grid['low'], fill_at, max_hold), -_windows(grid['high'], fill_at, max_hold))
+        highs = np.where(sign > 0, _windows(grid['high'], fill_at, max_hold), -_windows(grid['low'], fill_at, max_hold))
+        closes = sign * _windows(grid['close'], fill_at, max_hold)
+        with np.errstate(invalid='ignore'):
+            stop_at = _first_true(lows <= trade_stop[:, None])
+            take_at = _first_true(highs >= trade_take[:, None])
+        exit_at = np.minimum(np.minimum(stop_at, take_at), max_hold - 1)
+
+        exit_price = np.where(
+            stop_at <= take_at,
+            np.where(stop_at < max_hold, trade_stop, np.nan),
+            trade_take
+        )
+        timeout = (stop_at >= max_hold) & (take_at >= max_hold)
+        exit_price = np.where(timeout, closes[np.arange(len(closes)), max_hold - 1], exit_price)
+
+        risk = trade_entry - trade_stop
+        r_multiple = (exit_price - fill_price) / risk
+        # Сделки, не успевшие закрыться до конца истории, не учитываем
+        complete = ~np.isnan(r_multiple)
+        outcomes.append((chunk[complete], fill_at[complete] + exit_at[complete], r_multiple[complete]))
+
+    if not outcomes:
+        return np.empty(0)
+    signal_at = np.concatenate([item[0] for item in outcomes])
+    closed_at = np.concatenate([item[1] for item in outcomes])
+    r_multiples = np.concatenate([item[2] for item in outcomes])
+
+    # Одна позиция на символ: новый сигнал только после закрытия предыдущей сделки
+    taken = []
+    busy_until = -1
+    for i in range(len(signal_at)):
+        if signal_at[i] > busy_until:
+            taken.append(i)
+            busy_until = closed_at[i]
+    return r_multiples[taken]
+
+
+def backtest_file(path, grid_params, fill_bars, max_hold):
+    """Прогон одного символа по всем наборам параметров (выполняется в процессе пула)"""
+    grid = hourly_grid(load_history(path))
+    if grid is None:
+        return os.path.basename(path), {}
+    features = signal_features(grid)
+    results = {
+        params: simulate_trades(grid, features, params, fill_bars, max_hold).astype(np.float32)
+        for params in grid_params
+    }
+    return os.path.basename(path), results
+
+
+def summarize(r_multiples):
+    """Доля прибыльных сделок, ожидание и распределение R"""
+    if not len(r_multiples):
+        return {'trades': 0}
+    counts, _ = np.histogram(np.clip(r_multiples, R_BINS[0], R_BINS[-1] - 1e-9), bins=R_BINS)
+    percentiles = np.percentile(r_multiples, [5, 25, 50, 75, 95])
+    return {
+        'trades': int(len(r_multiples)),
+        'hit_rate': float((r_multiples > 0).mean()),
+        'expectancy': float(r_multiples.mean()),
+        'total_r': float(r_multiples.sum()),
+        'r_percentiles': dict(zip(('p5', 'p25', 'p50', 'p75', 'p95'), map(float, percentiles))),
+        'r_histogram': {f"{low:+.1f}": int(count) for low, count in zip(R_BINS[:-1], counts)}
+    }
+
+
+def run(paths, grid_params, fill_bars=24, max_hold=168, workers=None):
+    """Раскладывает символы по пулу процессов и собирает сводку по каждому набору параметров"""
+    started = time.monotonic()
+    collected = {params: [] for params in grid_params}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(backtest_file, path, grid_params, fill_bars, max_hold) for path in paths]
+        for future in futures:
+            name, results = future.result()
+            for params, r_multiples in results.items():
+                collected[params].append(r_multiples)
+
+    report = []
+    for params in grid_params:
+        r_multiples = np.concatenate(collected[params]) if collected[params] else np.empty(0)
+        report.append({'params': params.__dict__, **summarize(r_multiples.astype(np.float64))})
+    logger.info(f"Backtested {len(paths)} symbols x {len(grid_params)} parameter sets in {time.monotonic() - started:.1f}s")
+    return report
+
+
+async def download(symbols, days, data_dir, top=0, concurrency=SCAN_CONCURRENCY):
+    """Загружает часовую историю символов (и топ-top пар по объему) с Bybit в data_dir"""
+    from analysis import fetch_kline_history, get_top_pairs
+    from bybit_client import bybit_client
+    from scanner import scan_pairs
+
+    os.makedirs(data_dir, exist_ok=True)
+    symbols = list(symbols)
+    if top:
+        symbols += [pair['symbol'] for pair in await get_top_pairs(top, prefilter=False) if pair['symbol'] not in symbols]
+
+    async def save(symbol):
+        series = await fetch_kline_history(symbol, '1h', days * DAY_HOURS)
+        if series is None or not len(series):
+            return None
+        np.savez(
+            os.path.join(data_dir, f"{symbol}.npz"),
+            **{name: np.frombuffer(getattr(series, name), dtype=np.int64 if name == 'timestamp' else np.float64) for name in COLUMNS}
+        )
+        return symbol
+
+    try:
+        saved, _ = await scan_pairs(symbols, save, concurrency=concurrency)
+    finally:
+        await bybit_client.close()
+    logger.info(f"Saved {len(saved)}/{len(symbols)} symbols to {data_dir}")
+
+
+def format_report(report):
+    lines = [f"{'entry':>7} {'stop':>6} {'min_rr':>6} {'trades':>7} {'hit':>6} {'E[R]':>7} {'total R':>9} {'p50 R':>6}"]
+    for row in sorted(report, key=lambda row: row.get('expectancy', float('-inf')), reverse=True):
+        params = row['params']
+        if not row['trades']:
+            lines.append(f"{params['entry_factor']:>7} {params['stop_factor']:>6} {params['min_risk_reward']:>6} {0:>7}")
+            continue
+        lines.append(
+            f"{params['entry_factor']:>7} {params['stop_factor']:>6} {params['min_risk_reward']:>6} "
+            f"{row['trades']:>7} {row['hit_rate']:>6.1%} {row['expectancy']:>7.3f} "
+            f"{row['total_r']:>9.1f} {row['r_percentiles']['p50']:>6.2f}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load = commands.add_parser('download', help='загрузить часовые свечи с Bybit')
+    load.add_argument('--symbols', nargs='*', default=[])
+    load.add_argument('--top', type=int, default=0, help='добавить топ-N пар по объему')
+    load.add_argument('--days', type=int, default=365)
+    load.add_argument('--data-dir', default='backtest_data')
+
+    test = commands.add_parser('run', help='прогнать правила по сохраненной истории')
+    test.add_argument('--data-dir', default='backtest_data')
+    test.add_argument('--entry', type=float, nargs='+', default=[SIGNAL_ENTRY_FACTOR])
+    test.add_argument('--stop', type=float, nargs='+', default=[SIGNAL_STOP_FACTOR])
+    test.add_argument('--min-rr', type=float, nargs='+', default=[SIGNAL_MIN_RISK_REWARD])
+    test.add_argument('--fill-bars', type=int, default=24, help='сколько часов ждать входа по заявке')
+    test.add_argument('--max-hold', type=int, default=168, help='максимальная длительность сделки, часов')
+    test.add_argument('--workers', type=int, default=None)
+    test.add_argument('--json', help='сохранить полный отчет в файл')
+
+    args = parser.parse_args()
+    if args.command == 'download':
+        asyncio.run(download(args.symbols, args.days, args.data_dir, args.top))
+        return
+
+    paths = sorted(glob.glob(os.path.join(args.data_dir, '*.npz')))
+    if not paths:
+        parser.error(f"no history in {args.data_dir}, run download first")
+    grid_params = [RuleParams(*values) for values in itertools.product(args.entry, args.stop, args.min_rr)]
+    report = run(paths, grid_params, args.fill_bars, args.max_hold, args.workers)
+    print(format_report(report))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
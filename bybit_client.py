@@ -0,0 +1,227 @@
+import asyncio
+import time
+import random
+import logging
+import httpx
+from collections import deque
+from config import (
+    BYBIT_API_URL, BYBIT_TIMEOUT, BYBIT_MAX_CONNECTIONS, BYBIT_DEADLINE, BYBIT_HEDGE, BYBIT_HEDGE_MIN_DELAY
+)
+from rate_limit import rate_limiter
+from circuit_breaker import CircuitBreaker
+from tracing import span
+from metrics import BYBIT_REQUESTS, BYBIT_LATENCY, BYBIT_RETRIES, BYBIT_FAILURES, BYBIT_HEDGES, RATE_LIMIT_WAIT
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Улучшенные заголовки для обхода блокировки
+# (без 'br': httpx распаковывает brotli только при установленном пакете brotli)
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'application/json, text/plain, */*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+    'Sec-Fetch-Dest': 'empty',
+    'Sec-Fetch-Mode': 'cors',
+    'Sec-Fetch-Site': 'same-origin'
+}
+
+# Дубль запроса отправляется, когда ответ задерживается дольше этого квантиля
+HEDGE_QUANTILE = 0.95
+
+
+class LatencyWindow:
+    """Время последних ответов эндпоинта для оценки квантилей"""
+
+    __slots__ = ('samples', 'min_samples')
+
+    def __init__(self, size=200, min_samples=20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def quantile(self, q):
+        """Квантиль времени ответа или None, пока замеров мало"""
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class BybitClient:
+    """Асинхронный клиент Bybit API с пулом keep-alive соединений.
+
+    У каждого эндпоинта свой автомат отключения и окно времени ответов:
+    медленный запрос дублируется после p95 эндпоинта, а запросы к
+    отказавшему эндпоинту не отправляются до пробного.
+    """
+
+    def __init__(self, base_url=BYBIT_API_URL, timeout=BYBIT_TIMEOUT, max_connections=BYBIT_MAX_CONNECTIONS,
+                 deadline=BYBIT_DEADLINE, hedge=BYBIT_HEDGE, hedge_min_delay=BYBIT_HEDGE_MIN_DELAY):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self._client = None
+        self._breakers = {}
+        self._latency = {}
+
+    def _get_client(self):
+        """Лениво создает httpx.AsyncClient внутри работающего event loop"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=HEADERS,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+        return self._client
+
+    def _breaker(self, path):
+        breaker = self._breakers.get(path)
+        if breaker is None:
+            breaker = self._breakers[path] = CircuitBreaker(path)
+        return breaker
+
+    def _latencies(self, path):
+        window = self._latency.get(path)
+        if window is None:
+            window = self._latency[path] = LatencyWindow()
+        return window
+
+    async def _acquire(self, path):
+        # Ждем своей очереди в общем ограничителе вместо случайных пауз
+        waited = time.perf_counter()
+        with span('rate_limit.wait'):
+            await rate_limiter.acquire(path)
+        RATE_LIMIT_WAIT.labels(path).observe(time.perf_counter() - waited)
+
+    async def _send(self, client, path, params):
+        """Один HTTP-запрос с уже полученным разрешением ограничителя и учет ответа"""
+        started = time.perf_counter()
+        with BYBIT_LATENCY.labels(path).time():
+            response = await client.get(path, params=params)
+        self._latencies(path).add(time.perf_counter() - started)
+        BYBIT_REQUESTS.labels(path, str(response.status_code)).inc()
+        rate_limiter.observe(path, response.headers)
+        return response
+
+    async def _hedged(self, client, path, params):
+        """Запрос с дублем: если ответа нет дольше p95 эндпоинта, отправляется
+        такой же второй запрос, и используется ответ, пришедший первым.
+
+        Ожидание в ограничителе в задержку не входит, а дубль отправляется,
+        только если ограничитель пропускает его без очереди.
+        """
+        await self._acquire(path)
+        delay = self._latencies(path).quantile(HEDGE_QUANTILE) if self.hedge else None
+        first = asyncio.ensure_future(self._send(client, path, params))
+        if delay is None:
+            return await first
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=max(delay, self.hedge_min_delay))
+            if done:
+                return first.result()
+            if not rate_limiter.try_acquire(path):
+                # Ограничитель сдерживает запросы - дубль только добавил бы очередь
+                BYBIT_HEDGES.labels(path, 'throttled').inc()
+                return await first
+
+            BYBIT_HEDGES.labels(path, 'sent').inc()
+            with span('bybit.hedge', delay=round(delay, 3)):
+                second = asyncio.ensure_future(self._send(client, path, params))
+                pending.add(second)
+                error = None
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            if task is second:
+                                BYBIT_HEDGES.labels(path, 'won').inc()
+                            return task.result()
+                        error = task.exception()
+                raise error
+        finally:
+            # Проигравший запрос больше не нужен
+            for task in pending:
+                task.cancel()
+
+    async def get(self, path, params=None, max_retries=3, deadline=None):
+        """Делает GET-запрос с повторными попытками, возвращает httpx.Response или None.
+
+        Все попытки вместе с паузами укладываются в deadline секунд (по
+        умолчанию BYBIT_DEADLINE). Пока автомат эндпоинта разомкнут,
+        возвращает None сразу.
+        """
+        breaker = self._breaker(path)
+        if not breaker.allow():
+            BYBIT_REQUESTS.labels(path, 'circuit_open').inc()
+            logger.debug(f"Request to {path} rejected: circuit is open")
+            return None
+
+        client = self._get_client()
+        deadline_at = time.monotonic() + (deadline if deadline is not None else self.deadline)
+
+        reason = 'error'
+        for attempt in range(max_retries):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+            if attempt:
+                BYBIT_RETRIES.labels(path, reason).inc()
+            with span('bybit.attempt', path=path, attempt=attempt + 1) as attempt_span:
+                try:
+                    response = await asyncio.wait_for(self._hedged(client, path, params), remaining)
+                    attempt_span.set('status', response.status_code)
+
+                    if response.status_code == 200:
+                        breaker.record_success()
+                        return response
+                    elif response.status_code == 429:
+                        rate_limiter.penalize(path, response.headers)
+                        reason = '429'
+                        continue
+                    else:
+                        response.raise_for_status()
+
+                except (httpx.HTTPError, asyncio.TimeoutError) as e:
+                    if isinstance(e, asyncio.TimeoutError):
+                        BYBIT_REQUESTS.labels(path, 'deadline').inc()
+                        error = 'deadline exceeded'
+                    else:
+                        if not isinstance(e, httpx.HTTPStatusError):
+                            BYBIT_REQUESTS.labels(path, 'error').inc()
+                        error = str(e)
+                    reason = 'error'
+                    breaker.record_failure()
+                    attempt_span.set('error', error)
+                    logger.warning(f"Request to {path} failed on attempt {attempt + 1}: {error}")
+                    if attempt < max_retries - 1 and breaker.allow():
+                        # Экспоненциальная задержка с джиттером, но не дальше срока
+                        with span('bybit.backoff'):
+                            await asyncio.sleep(min(2 ** attempt + random.uniform(0, 1), max(deadline_at - time.monotonic(), 0)))
+                    else:
+                        break
+
+        BYBIT_FAILURES.labels(path).inc()
+        return None
+
+    async def close(self):
+        """Закрывает пул соединений"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+
+# Общий клиент на весь процесс
+bybit_client = BybitClient()
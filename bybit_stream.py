@@ -0,0 +1,214 @@
+import asyncio
+import json
+import time
+import logging
+import websockets
+from config import BYBIT_WS_URL
+from candles import candle_store, CandleSeries
+from kline_cache import BYBIT_INTERVALS, INTERVAL_MS
+from indicators import TrendState
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Bybit принимает не больше 10 топиков в одном запросе подписки на споте
+SUBSCRIBE_BATCH = 10
+# Bybit рекомендует ping каждые 20 секунд
+PING_INTERVAL = 20
+MAX_RECONNECT_DELAY = 30
+
+# Обратное соответствие: '60' -> '1h'
+STREAM_INTERVALS = {value: key for key, value in BYBIT_INTERVALS.items()}
+
+
+class BybitStream:
+    """Потоковое обновление свечей и цен из публичных топиков Bybit spot.
+
+    Подписывается на kline и tickers для отслеживаемых символов, поддерживает
+    ряды свечей в candle_store в актуальном состоянии, переподключается и
+    переподписывается при обрыве, а пропуски догружает через REST с помощью
+    backfill(symbol, interval). На каждой закрытой свече инкрементально
+    обновляет TrendState символа, из которого trend(symbol) отдает тренд и
+    уровни без пересчета по всему ряду.
+    """
+
+    def __init__(self, backfill, url=BYBIT_WS_URL, intervals=('1h', '4h', '1d'), store=candle_store):
+        self.backfill = backfill
+        self.url = url
+        self.intervals = intervals
+        self.store = store
+        self.symbols = set()
+        self._prices = {}
+        self._live = set()
+        self._trends = {}
+        self._ws = None
+        self._task = None
+        self._backfill_semaphore = asyncio.Semaphore(5)
+
+    def is_live(self, symbol, interval):
+        """Обновляется ли ряд свечей потоком без пропусков"""
+        return (symbol, interval) in self._live
+
+    def last_price(self, symbol):
+        """Последняя цена из топика tickers или None"""
+        return self._prices.get(symbol) if self._ws is not None else None
+
+    def trend(self, symbol):
+        """(sma_50, sma_200, support, resistance) по инкрементальному состоянию или None.
+
+        Незакрытая свеча каждого интервала берется из ряда в хранилище.
+        None, если какой-то ряд не живой или состояние отстает от ряда
+        (тогда значения надо считать по свечам).
+        """
+        trend = self._trends.get(symbol)
+        if trend is None:
+            return None
+        current = {}
+        for interval in ('1d', '4h', '1h'):
+            if not self.is_live(symbol, interval) or interval not in trend.last_closed:
+                return None
+            series = self.store.get(symbol, interval)
+            behind = series.last_timestamp - trend.last_closed[interval]
+            if behind == 0:
+                current[interval] = None
+            elif 0 < behind <= INTERVAL_MS[interval]:
+                current[interval] = (series.high[-1], series.low[-1], series.close[-1])
+            else:
+                return None
+        return trend.values(current)
+
+    def _topics(self, symbols):
+        topics = []
+        for symbol in sorted(symbols):
+            topics.extend(f"kline.{BYBIT_INTERVALS[interval]}.{symbol}" for interval in self.intervals)
+            topics.append(f"tickers.{symbol}")
+        return topics
+
+    def track(self, symbols):
+        """Добавляет символы в отслеживаемые и подписывается на них, если поток запущен"""
+        new_symbols = set(symbols) - self.symbols
+        if not new_symbols:
+            return
+        self.symbols |= new_symbols
+        if self._ws is not None:
+            asyncio.create_task(self._subscribe_and_backfill(self._ws, new_symbols))
+
+    async def _subscribe(self, ws, symbols):
+        topics = self._topics(symbols)
+        for i in range(0, len(topics), SUBSCRIBE_BATCH):
+            await ws.send(json.dumps({'op': 'subscribe', 'args': topics[i:i + SUBSCRIBE_BATCH]}))
+
+    async def _subscribe_and_backfill(self, ws, symbols):
+        try:
+            await self._subscribe(ws, symbols)
+        except websockets.ConnectionClosed:
+            return
+        await asyncio.gather(*(
+            self._backfill_series(symbol, interval)
+            for symbol in symbols
+            for interval in self.intervals
+        ))
+
+    async def _backfill_series(self, symbol, interval):
+        """Догружает пропущенные свечи через REST и помечает ряд живым"""
+        async with self._backfill_semaphore:
+            try:
+                klines = await self.backfill(symbol, interval)
+            except Exception as e:
+                logger.error(f"Backfill failed for {symbol} {interval}: {e}")
+                return
+        if klines and self._ws is not None:
+            # Ряд мог быть загружен заново с разрывом - состояние интервала строим с нуля
+            series = self.store.get(symbol, interval)
+            step = INTERVAL_MS[interval]
+            open_candle_start = int(time.time() * 1000) // step * step
+            trend = self._trends.setdefault(symbol, TrendState())
+            trend.reset(interval)
+            trend.seed(series, open_candle_start)
+            self._live.add((symbol, interval))
+
+    def _handle_message(self, message):
+        topic = message.get('topic')
+        if not topic:
+            if message.get('op') == 'subscribe' and not message.get('success'):
+                logger.error(f"Subscription failed: {message.get('ret_msg')}")
+            return
+
+        if topic.startswith('tickers.'):
+            data = message.get('data', {})
+            if 'lastPrice' in data:
+                self._prices[data['symbol']] = float(data['lastPrice'])
+            return
+
+        if topic.startswith('kline.'):
+            _, stream_interval, symbol = topic.split('.', 2)
+            interval = STREAM_INTERVALS.get(stream_interval)
+            if interval is None:
+                return
+            series = self.store.get(symbol, interval)
+            last_timestamp = series.last_timestamp or 0
+            update = CandleSeries(symbol, interval)
+            closed = []
+            for item in message.get('data', []):
+                # Опоздавшие сообщения о более старых свечах пропускаем
+                if int(item['start']) >= last_timestamp:
+                    update.append(item['start'], item['open'], item['high'], item['low'], item['close'], item['volume'])
+                    if item.get('confirm'):
+                        closed.append(len(update) - 1)
+            if series.merge(update):
+                trend = self._trends.get(symbol)
+                if trend is not None and closed and (symbol, interval) in self._live:
+                    # Вместе с закрытой свечой учитываем и те, чье подтверждение не дошло
+                    trend.seed(series, update.timestamp[closed[-1]] + 1)
+            else:
+                # Пропустили свечи: ряд не живой, пока не догрузим его через REST
+                logger.warning(f"Gap in {symbol} {interval} stream, backfilling")
+                self._live.discard((symbol, interval))
+                asyncio.create_task(self._backfill_series(symbol, interval))
+
+    async def _ping(self, ws):
+        while True:
+            await asyncio.sleep(PING_INTERVAL)
+            await ws.send(json.dumps({'op': 'ping'}))
+
+    async def _run(self):
+        delay = 1
+        while True:
+            try:
+                async with websockets.connect(self.url) as ws:
+                    logger.info(f"Connected to Bybit stream {self.url}")
+                    self._ws = ws
+                    delay = 1
+                    ping_task = asyncio.create_task(self._ping(ws))
+                    backfill_task = asyncio.create_task(self._subscribe_and_backfill(ws, set(self.symbols)))
+                    try:
+                        async for raw in ws:
+                            try:
+                                self._handle_message(json.loads(raw))
+                            except Exception as e:
+                                logger.error(f"Error handling stream message: {e}")
+                    finally:
+                        ping_task.cancel()
+                        backfill_task.cancel()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Bybit stream disconnected: {e}")
+            finally:
+                self._ws = None
+                self._live.clear()
+
+            logger.info(f"Reconnecting to Bybit stream in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def start(self):
+        """Запускает поток в текущем event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
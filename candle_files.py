@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from array import array
+import numpy as np
+from config import CANDLE_STORE_DIR, CANDLE_FLUSH_INTERVAL
+from kline_cache import INTERVAL_MS
+from candles import candle_store
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Запись файла свечей: те же колонки, что в CandleSeries, 48 байт на свечу
+RECORD = np.dtype([
+    ('timestamp', '<i8'), ('open', '<f8'), ('high', '<f8'),
+    ('low', '<f8'), ('close', '<f8'), ('volume', '<f8')
+])
+INDEX_FILE = 'index.json'
+
+
+class CandleFileStore:
+    """Закрытые свечи на диске: по файлу на (symbol, interval) и общий индекс.
+
+    Файл - массив записей RECORD от старых свечей к новым, в который только
+    дописываются новые закрытые свечи. Индекс хранит число записей, которым
+    можно доверять: хвост, не попавший в индекс (запись оборвалась при
+    остановке), отбрасывается при следующей записи. При старте индекс
+    читается целиком, а файлы открываются через mmap по мере обращения к
+    рядам, и догрузить по REST остается лишь разрыв с момента остановки.
+
+    Восстановление не нулевого копирования: колонки CandleSeries - растущие
+    array, а не представления numpy, поэтому хвост из max_length записей
+    один раз копируется из mmap в ряд при первом обращении к нему - до
+    48 байт на свечу, около 48 КБ на ряд при CANDLE_HISTORY_LIMIT=1000.
+    С диска читаются только страницы этого хвоста.
+    """
+
+    def __init__(self, store=candle_store, directory=CANDLE_STORE_DIR, flush_interval=CANDLE_FLUSH_INTERVAL):
+        self.store = store
+        self.directory = directory
+        self.flush_interval = flush_interval
+        # (symbol, interval) -> {'count', 'last', 'exhausted'}; запись идет в
+        # отдельном потоке, поэтому обращения к индексу - под _lock
+        self._index = {}
+        self._lock = threading.Lock()
+        self._task = None
+        self._writing = None
+        self.restored = 0
+
+    def _path(self, symbol, interval):
+        return os.path.join(self.directory, f"{symbol}_{interval}.candles")
+
+    def load(self):
+        """Читает индекс и подключает восстановление рядов к хранилищу свечей"""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, INDEX_FILE)
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    data = json.load(f)
+                self._index = {tuple(key.split(':')): entry for key, entry in data.items()}
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not load candle index {path}: {e}")
+                self._index = {}
+        self.store.loader = self.restore
+        logger.info(f"Candle files: {len(self._index)} series in {self.directory}")
+
+    def _entry(self, key):
+        with self._lock:
+            return self._index.get(key)
+
+    def restore(self, series):
+        """Заполняет новый ряд сохраненными свечами (вызывается хранилищем)"""
+        entry = self._entry((series.symbol, series.interval))
+        if not entry or not entry['count']:
+            return
+        try:
+            records = np.memmap(self._path(series.symbol, series.interval), dtype=RECORD, mode='r', shape=(entry['count'],))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not map candles {series.symbol} {series.interval}: {e}")
+            with self._lock:
+                self._index.pop((series.symbol, series.interval), None)
+            return
+
+        tail = records[-series.max_length:]
+        for name in RECORD.names:
+            # Колонка записи - срез с шагом 48 байт; tobytes собирает ее одним копированием
+            column = array(getattr(series, name).typecode)
+            column.frombytes(tail[name].tobytes())
+            setattr(series, name, column)
+        series.history_exhausted = entry['exhausted']
+        del records
+        self.restored += 1
+
+    def _pending(self, series, now_ms):
+        """Закрытые свечи ряда, которых еще нет в файле: (записи, переписать ли файл целиком)"""
+        step = INTERVAL_MS.get(series.interval)
+        if step is None or not len(series):
+            return None, False
+
+        timestamps = np.frombuffer(series.timestamp, dtype=np.int64)
+        closed = int(np.searchsorted(timestamps, now_ms - step, side='right'))
+        entry = self._entry((series.symbol, series.interval))
+        last = entry['last'] if entry and entry['count'] else None
+        start = 0 if last is None else int(np.searchsorted(timestamps, last, side='right'))
+        if start >= closed:
+            return None, False
+
+        # Разрыв между файлом и рядом (например, после долгой остановки) - файл пишется заново
+        rewrite = last is None or timestamps[start] - last > step
+        if rewrite:
+            start = 0
+        # Файл растет только до двойной длины ряда, потом переписывается
+        elif entry['count'] + closed - start > 2 * series.max_length:
+            rewrite = True
+            start = max(closed - series.max_length, 0)
+
+        records = np.empty(closed - start, dtype=RECORD)
+        for name in RECORD.names:
+            records[name] = np.frombuffer(getattr(series, name), dtype=RECORD[name].base)[start:closed]
+        return records, rewrite
+
+    def _write(self, key, records, rewrite):
+        path = self._path(*key)
+        entry = self._entry(key)
+        if rewrite or entry is None:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(records.tobytes())
+            os.replace(tmp_path, path)
+            return len(records)
+
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            # Отбрасываем оборванную запись, не попавшую в индекс
+            f.truncate(entry['count'] * RECORD.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(records.tobytes())
+        return entry['count'] + len(records)
+
+    def _save_index(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        with self._lock:
+            data = {f"{symbol}:{interval}": entry for (symbol, interval), entry in self._index.items()}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _flush_batch(self, batch):
+        for key, records, rewrite, exhausted in batch:
+            try:
+                count = self._write(key, records, rewrite)
+            except OSError as e:
+                logger.error(f"Could not write candles {key[0]} {key[1]}: {e}")
+                continue
+            with self._lock:
+                self._index[key] = {'count': count, 'last': int(records['timestamp'][-1]), 'exhausted': exhausted}
+        self._save_index()
+
+    async def flush(self):
+        """Дописывает на диск свечи, закрывшиеся после прошлой записи"""
+        if not self.directory:
+            return 0
+        if self._writing is not None:
+            # Предыдущая запись могла продолжаться в потоке после отмены ожидания
+            await asyncio.gather(self._writing, return_exceptions=True)
+        # Колонки копируются в event loop, запись в файлы идет в отдельном потоке
+        now_ms = int(time.time() * 1000)
+        batch = []
+        for series in self.store:
+            records, rewrite = self._pending(series, now_ms)
+            if records is not None:
+                batch.append(((series.symbol, series.interval), records, rewrite, series.history_exhausted))
+        if batch:
+            self._writing = asyncio.ensure_future(asyncio.to_thread(self._flush_batch, batch))
+            await asyncio.shield(self._writing)
+            logger.debug(f"Flushed candles for {len(batch)} series")
+        return len(batch)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Candle flush failed: {e}")
+
+    def start(self):
+        if self.directory and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+# Свечи на диске для быстрого старта после перезапуска
+candle_files = CandleFileStore()
@@ -0,0 +1,160 @@
+import logging
+from array import array
+from config import CANDLE_HISTORY_LIMIT
+from kline_cache import INTERVAL_MS
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Числовые колонки ряда: время открытия (мс) и OHLCV
+COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+
+
+class CandleSeries:
+    """Компактный ряд свечей одного символа и интервала, от старых к новым.
+
+    Цены хранятся уже разобранными в колонках array('d'), время - в
+    array('q'): около 48 байт на свечу вместо списка из 12 объектов со
+    строками. Ряд помнит время последней свечи, чтобы при обновлении
+    догружать только недостающие свечи; последняя свеча обычно еще не
+    закрыта и заменяется при следующем обновлении.
+    """
+
+    __slots__ = ('symbol', 'interval', 'max_length', 'history_exhausted', 'stale') + COLUMNS
+
+    def __init__(self, symbol, interval, max_length=CANDLE_HISTORY_LIMIT):
+        self.symbol = symbol
+        self.interval = interval
+        self.max_length = max_length
+        # True, если Bybit вернул меньше свечей, чем просили: старше истории нет
+        self.history_exhausted = False
+        # True у копии, отданной из сохраненных данных, когда Bybit недоступно
+        self.stale = False
+        self.timestamp = array('q')
+        self.open = array('d')
+        self.high = array('d')
+        self.low = array('d')
+        self.close = array('d')
+        self.volume = array('d')
+
+    @classmethod
+    def from_bybit(cls, symbol, interval, rows, max_length=CANDLE_HISTORY_LIMIT):
+        """Разбирает ответ Bybit [[start, open, high, low, close, volume, turnover], ...] за один проход.
+
+        Bybit отдает свечи от новых к старым, ряд хранит их от старых к новым.
+        """
+        series = cls(symbol, interval, max(max_length, len(rows)))
+        timestamp, open_, high, low, close, volume = (getattr(series, name) for name in COLUMNS)
+        for row in reversed(rows):
+            timestamp.append(int(row[0]))
+            open_.append(float(row[1]))
+            high.append(float(row[2]))
+            low.append(float(row[3]))
+            close.append(float(row[4]))
+            volume.append(float(row[5]))
+        return series
+
+    def append(self, timestamp, open_, high, low, close, volume):
+        """Добавляет свечу в конец ряда (значения могут быть строками Bybit)"""
+        self.timestamp.append(int(timestamp))
+        self.open.append(float(open_))
+        self.high.append(float(high))
+        self.low.append(float(low))
+        self.close.append(float(close))
+        self.volume.append(float(volume))
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    @property
+    def last_timestamp(self):
+        return self.timestamp[-1] if self.timestamp else None
+
+    def has_history(self, limit):
+        """Хватает ли накопленной истории, чтобы отдать limit свечей"""
+        return len(self) >= limit or (self.history_exhausted and len(self) > 0)
+
+    def replace(self, other, requested):
+        """Заменяет ряд целиком результатом полной загрузки"""
+        self.max_length = max(self.max_length, requested)
+        for name in COLUMNS:
+            column = getattr(other, name)
+            setattr(self, name, array(column.typecode, column))
+        self.history_exhausted = len(other) < requested
+        self._trim()
+
+    def merge(self, other):
+        """Добавляет свечи из другого ряда, заменяя незакрытую последнюю свечу.
+
+        Возвращает False, если между рядом и новыми свечами есть разрыв.
+        """
+        if not len(other):
+            return True
+
+        first_new = other.timestamp[0]
+        if len(self) and first_new - self.timestamp[-1] > INTERVAL_MS[self.interval]:
+            return False
+
+        # Отбрасываем свечи, которые перекрываются новыми данными
+        keep = len(self)
+        while keep and self.timestamp[keep - 1] >= first_new:
+            keep -= 1
+        for name in COLUMNS:
+            column = getattr(self, name)
+            del column[keep:]
+            column.extend(getattr(other, name))
+        self._trim()
+        return True
+
+    def _trim(self):
+        excess = len(self) - self.max_length
+        if excess > 0:
+            for name in COLUMNS:
+                del getattr(self, name)[:excess]
+
+    def tail(self, limit):
+        """Копия последних limit свечей.
+
+        Копию безопасно отдавать наружу и кэшировать: исходный ряд продолжает
+        расти, а массив, на который уже смотрит numpy, менять размер не может.
+        """
+        series = CandleSeries(self.symbol, self.interval, limit)
+        series.history_exhausted = self.history_exhausted
+        for name in COLUMNS:
+            setattr(series, name, getattr(self, name)[-limit:])
+        return series
+
+
+class CandleStore:
+    """Хранилище рядов свечей по (symbol, interval).
+
+    loader(series), если задан, заполняет новый ряд сохраненной историей.
+    """
+
+    def __init__(self, max_length=CANDLE_HISTORY_LIMIT):
+        self.max_length = max_length
+        self.loader = None
+        self._series = {}
+
+    def get(self, symbol, interval):
+        key = (symbol, interval)
+        series = self._series.get(key)
+        if series is None:
+            series = CandleSeries(symbol, interval, self.max_length)
+            if self.loader is not None:
+                self.loader(series)
+            self._series[key] = series
+        return series
+
+    def __len__(self):
+        return len(self._series)
+
+    def __iter__(self):
+        return iter(list(self._series.values()))
+
+    def clear(self):
+        self._series.clear()
+
+
+# Общее хранилище свечей на весь процесс
+candle_store = CandleStore()
@@ -0,0 +1,63 @@
+import time
+import logging
+from config import BYBIT_BREAKER_FAILURES, BYBIT_BREAKER_RESET
+from metrics import BYBIT_CIRCUIT_STATE
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Состояния автомата (значение - для метрики)
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """Автомат отключения запросов к одному эндпоинту Bybit.
+
+    После failures ошибок подряд автомат размыкается, и запросы сразу
+    получают отказ вместо ожидания таймаутов и повторов: вызывающий код
+    отдает последние сохраненные данные. Через reset_timeout секунд
+    пропускается один пробный запрос; успех замыкает автомат, ошибка
+    размыкает его снова. Если пробный запрос не завершился ни успехом, ни
+    ошибкой, следующий пропускается еще через reset_timeout.
+    """
+
+    __slots__ = ('name', 'failures', 'reset_timeout', 'state', '_errors', '_opened_at')
+
+    def __init__(self, name, failures=BYBIT_BREAKER_FAILURES, reset_timeout=BYBIT_BREAKER_RESET):
+        self.name = name
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._errors = 0
+        self._opened_at = 0.0
+
+    def allow(self):
+        """Можно ли отправить запрос сейчас"""
+        if self.state == CLOSED:
+            return True
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return False
+        # Пробный запрос; остальные ждут его результата еще reset_timeout
+        self._opened_at = time.monotonic()
+        self._set_state(HALF_OPEN)
+        return True
+
+    def record_success(self):
+        self._errors = 0
+        if self.state != CLOSED:
+            logger.info(f"Circuit {self.name} closed")
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        self._errors += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self._errors >= self.failures):
+            logger.warning(f"Circuit {self.name} opened after {self._errors} failures")
+            self._opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def _set_state(self, state):
+        self.state = state
+        BYBIT_CIRCUIT_STATE.labels(self.name).set(STATE_VALUES[state])
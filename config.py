@@ -8,10 +8,135 @@ logger = logging.getLogger(__name__)
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 
 # API URLs - переходим на Bybit
-BYBIT_API_URL = 'https://api.bybit.com'
+BYBIT_API_URL = os.getenv('BYBIT_API_URL', 'https://api.bybit.com')
+BYBIT_WS_URL = os.getenv('BYBIT_WS_URL', 'wss://stream.bybit.com/v5/public/spot')
 COINGECKO_API_URL = 'https://api.coingecko.com/api/v3'
 ALTERNATIVE_API_URL = 'https://api.alternative.me'
 
+# Источник рыночных данных: 'rest' (опрос) или 'stream' (WebSocket + REST для догрузки)
+MARKET_DATA_MODE = os.getenv('MARKET_DATA_MODE', 'rest')
+
+# Параметры HTTP-клиента Bybit
+BYBIT_TIMEOUT = float(os.getenv('BYBIT_TIMEOUT', 15))
+BYBIT_MAX_CONNECTIONS = int(os.getenv('BYBIT_MAX_CONNECTIONS', 20))
+# Срок на один запрос вместе с повторами (с); дубль медленного запроса
+# после p95 времени ответа эндпоинта, но не раньше BYBIT_HEDGE_MIN_DELAY
+BYBIT_DEADLINE = float(os.getenv('BYBIT_DEADLINE', 8))
+BYBIT_HEDGE = os.getenv('BYBIT_HEDGE', '1') == '1'
+BYBIT_HEDGE_MIN_DELAY = float(os.getenv('BYBIT_HEDGE_MIN_DELAY', 0.1))
+# Автомат отключения эндпоинта: ошибок подряд до размыкания и пауза до пробного запроса (с)
+BYBIT_BREAKER_FAILURES = int(os.getenv('BYBIT_BREAKER_FAILURES', 5))
+BYBIT_BREAKER_RESET = float(os.getenv('BYBIT_BREAKER_RESET', 30))
+
+# Ограничение запросов к Bybit: лимит по IP 600 запросов за 5 секунд (120/с),
+# держим запас. Значения - запросов в секунду и размер всплеска.
+BYBIT_RATE_LIMIT = float(os.getenv('BYBIT_RATE_LIMIT', 100))
+BYBIT_RATE_BURST = int(os.getenv('BYBIT_RATE_BURST', 20))
+BYBIT_ENDPOINT_RATE_LIMITS = {
+    '/v5/market/kline': (BYBIT_RATE_LIMIT, BYBIT_RATE_BURST),
+    '/v5/market/tickers': (5, 2),
+    '/v5/market/instruments-info': (5, 2)
+}
+
+# Параметры сканирования лучших сигналов
+SCAN_MAX_PAIRS = int(os.getenv('SCAN_MAX_PAIRS', 50))
+SCAN_CONCURRENCY = int(os.getenv('SCAN_CONCURRENCY', 10))
+SCAN_MAX_SIGNALS = int(os.getenv('SCAN_MAX_SIGNALS', 3))
+
+# Правила сигнала: вход = поддержка × SIGNAL_ENTRY_FACTOR, стоп = поддержка ×
+# SIGNAL_STOP_FACTOR (для шорта от сопротивления с зеркальными множителями
+# 2 - factor), сигнал годится при риск/прибыль >= SIGNAL_MIN_RISK_REWARD
+SIGNAL_ENTRY_FACTOR = float(os.getenv('SIGNAL_ENTRY_FACTOR', 1.005))
+SIGNAL_STOP_FACTOR = float(os.getenv('SIGNAL_STOP_FACTOR', 0.98))
+SIGNAL_MIN_RISK_REWARD = float(os.getenv('SIGNAL_MIN_RISK_REWARD', 2.0))
+
+# Фоновое сканирование: интервал свечей, пауза после закрытия (с) и
+# максимальный возраст снимка (с), при котором кнопки отвечают из него.
+# SNAPSHOT_MAX_PAIRS - сколько пар сканировать, 0 - все USDT пары после
+# предварительного отбора
+SNAPSHOT_INTERVAL = os.getenv('SNAPSHOT_INTERVAL', '1h')
+SNAPSHOT_DELAY = int(os.getenv('SNAPSHOT_DELAY', 30))
+SNAPSHOT_MAX_AGE = int(os.getenv('SNAPSHOT_MAX_AGE', 2 * 60 * 60))
+SNAPSHOT_MAX_PAIRS = int(os.getenv('SNAPSHOT_MAX_PAIRS', 0))
+
+# Максимальное число записей в кэше свечей и через сколько секунд обновлять
+# незакрытую текущую свечу записи (закрытые свечи хранятся до закрытия текущей)
+KLINE_CACHE_SIZE = int(os.getenv('KLINE_CACHE_SIZE', 2000))
+KLINE_OPEN_CANDLE_TTL = float(os.getenv('KLINE_OPEN_CANDLE_TTL', 30))
+
+# Сколько свечей хранить в памяти на каждый (symbol, interval)
+CANDLE_HISTORY_LIMIT = int(os.getenv('CANDLE_HISTORY_LIMIT', 1000))
+
+# Период фонового обновления списка инструментов, секунды
+INSTRUMENTS_REFRESH_INTERVAL = int(os.getenv('INSTRUMENTS_REFRESH_INTERVAL', 3600))
+
+# Прогресс в чате: показывать, только если ответ готовится дольше
+# PROGRESS_SHOW_AFTER секунд; правки одного чата не чаще PROGRESS_MIN_INTERVAL
+PROGRESS_SHOW_AFTER = float(os.getenv('PROGRESS_SHOW_AFTER', 1.0))
+PROGRESS_MIN_INTERVAL = float(os.getenv('PROGRESS_MIN_INTERVAL', 1.0))
+
+# Файл с подписками пользователей на оповещения
+SUBSCRIPTIONS_FILE = os.getenv('SUBSCRIPTIONS_FILE', 'subscriptions.json')
+
+# Лимиты Telegram на рассылку: сообщений в секунду на бота, минимальный
+# интервал между сообщениями одного чата (с) и одновременных отправок
+TELEGRAM_SEND_RATE = float(os.getenv('TELEGRAM_SEND_RATE', 30))
+TELEGRAM_CHAT_INTERVAL = float(os.getenv('TELEGRAM_CHAT_INTERVAL', 1.0))
+TELEGRAM_SEND_CONCURRENCY = int(os.getenv('TELEGRAM_SEND_CONCURRENCY', 10))
+
+# Период замера задержки event loop для метрик, секунды
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv('EVENT_LOOP_LAG_INTERVAL', 0.5))
+
+# Трассировка запросов: файл OTLP/JSON (по умолчанию не пишется: файл
+# растет без ограничений, для отладки - например, traces.jsonl), адрес
+# OTLP/HTTP коллектора (например, http://127.0.0.1:4318/v1/traces), порог
+# медленного запроса (с), доля сохраняемых обычных запросов и период записи (с).
+# Медленные запросы попадают в лог в любом случае
+TRACE_FILE = os.getenv('TRACE_FILE', '')
+TRACE_OTLP_ENDPOINT = os.getenv('TRACE_OTLP_ENDPOINT', '')
+TRACE_SLOW_THRESHOLD = float(os.getenv('TRACE_SLOW_THRESHOLD', 5.0))
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0.1))
+TRACE_FLUSH_INTERVAL = float(os.getenv('TRACE_FLUSH_INTERVAL', 2.0))
+
+# Режим получения обновлений Telegram: 'polling' или 'webhook'. Для webhook
+# нужен публичный HTTPS-адрес сервиса (WEBHOOK_URL), путь и секрет, который
+# Telegram присылает в заголовке X-Telegram-Bot-Api-Secret-Token
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+
+# HTTP-сервер бота (webhook, health, метрики) и число одновременно
+# обрабатываемых обновлений
+WEB_HOST = os.getenv('WEB_HOST', '0.0.0.0')
+WEB_PORT = int(os.getenv('PORT', 10000))
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 64))
+
+# Планировщик анализов: одновременно выполняемые задачи, предельное ожидание
+# в очереди (с), после которого пользователь получает ответ "бот занят", и
+# сколько задач один пользователь может держать в очереди
+SCHEDULER_WORKERS = int(os.getenv('SCHEDULER_WORKERS', 4))
+SCHEDULER_MAX_WAIT = float(os.getenv('SCHEDULER_MAX_WAIT', 15))
+SCHEDULER_MAX_USER_JOBS = int(os.getenv('SCHEDULER_MAX_USER_JOBS', 3))
+
+# Процессы для оценки полного списка пар при фоновом сканировании и
+# минимальный размер части пакета на процесс (меньшие пакеты считаются в
+# основном процессе). 0 или 1 процесс - без пула.
+ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', min(4, os.cpu_count() or 1)))
+ANALYSIS_SHARD_MIN = int(os.getenv('ANALYSIS_SHARD_MIN', 50))
+
+# Каталог с закрытыми свечами для быстрого старта после перезапуска (пусто -
+# не сохранять) и период дописывания новых закрытых свечей (с)
+CANDLE_STORE_DIR = os.getenv('CANDLE_STORE_DIR', 'candle_data')
+CANDLE_FLUSH_INTERVAL = float(os.getenv('CANDLE_FLUSH_INTERVAL', 60))
+
+# Предварительный отбор пар по снимку тикеров до загрузки свечей: минимальный
+# оборот за 24ч (USDT), максимальный спред (доля цены) и минимальная доля
+# нужного для риск/прибыли диапазона цены (оценка по 24ч, 1.0 - ровно нужный)
+PREFILTER_MIN_TURNOVER = float(os.getenv('PREFILTER_MIN_TURNOVER', 100000))
+PREFILTER_MAX_SPREAD = float(os.getenv('PREFILTER_MAX_SPREAD', 0.005))
+PREFILTER_MIN_SCORE = float(os.getenv('PREFILTER_MIN_SCORE', 0.5))
+
 # Логируем статус конфигурации (без показа самого токена)
 if TELEGRAM_TOKEN:
     logger.info("TELEGRAM_TOKEN loaded successfully")
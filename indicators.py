@@ -0,0 +1,432 @@
+import math
+import bisect
+from collections import deque
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from candles import CandleSeries
+
+
+class Ohlcv:
+    """Колонки свечей в виде массивов float64, от старых свечей к новым"""
+
+    __slots__ = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, timestamp, open_, high, low, close, volume):
+        self.timestamp = timestamp
+        self.open = open_
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    def __len__(self):
+        return len(self.close)
+
+    @classmethod
+    def from_klines(cls, klines):
+        """Разбирает строки свечей [timestamp, open, high, low, close, volume, ...] за один проход"""
+        table = np.array([kline[:6] for kline in klines], dtype=np.float64).reshape(-1, 6)
+        return cls(table[:, 0].astype(np.int64), table[:, 1], table[:, 2], table[:, 3], table[:, 4], table[:, 5])
+
+
+    @classmethod
+    def from_series(cls, series):
+        """Представляет колонки CandleSeries массивами numpy без копирования"""
+        return cls(
+            np.frombuffer(series.timestamp, dtype=np.int64),
+            np.frombuffer(series.open, dtype=np.float64),
+            np.frombuffer(series.high, dtype=np.float64),
+            np.frombuffer(series.low, dtype=np.float64),
+            np.frombuffer(series.close, dtype=np.float64),
+            np.frombuffer(series.volume, dtype=np.float64)
+        )
+
+
+def as_ohlcv(data):
+    """Возвращает колонки свечей, разбирая строки только для старого списочного формата"""
+    if isinstance(data, Ohlcv):
+        return data
+    if isinstance(data, CandleSeries):
+        return Ohlcv.from_series(data)
+    return Ohlcv.from_klines(data)
+
+
+def sma(values, period):
+    """Простая скользящая средняя по последним period значениям"""
+    if len(values) < period:
+        return None
+    return float(np.mean(values[-period:]))
+
+
+def rolling_sma(values, period):
+    """SMA для каждого окна ряда через кумулятивную сумму"""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < period:
+        return np.empty(0)
+    cumsum = np.cumsum(np.insert(values, 0, 0.0))
+    return (cumsum[period:] - cumsum[:-period]) / period
+
+
+def rsi(values, period=14):
+    """RSI по средним приростам и падениям за последние period изменений"""
+    if len(values) <= period:
+        return None
+    diffs = np.diff(values[-(period + 1):])
+    avg_gain = diffs[diffs > 0].sum() / period
+    avg_loss = -diffs[diffs < 0].sum() / period
+    if avg_loss == 0:
+        return 100.0 if avg_gain > 0 else 50.0
+    return float(100 - 100 / (1 + avg_gain / avg_loss))
+
+
+def rolling_min(values, window):
+    """Минимум в каждом окне ряда"""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < window:
+        return np.empty(0)
+    return sliding_window_view(values, window).min(axis=1)
+
+
+def rolling_max(values, window):
+    """Максимум в каждом окне ряда"""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < window:
+        return np.empty(0)
+    return sliding_window_view(values, window).max(axis=1)
+
+
+def support_resistance(low_4h, high_4h, low_1h, high_1h, window_4h=30, window_1h=20):
+    """Поддержка - минимум последних свечей 4h и 1h, сопротивление - максимум"""
+    if not len(low_4h) or not len(low_1h):
+        return None, None
+    support = min(low_4h[-window_4h:].min(), low_1h[-window_1h:].min())
+    resistance = max(high_4h[-window_4h:].max(), high_1h[-window_1h:].max())
+    return float(support), float(resistance)
+
+
+def right_aligned(columns, length):
+    """Собирает матрицу символы × бары, выравнивая ряды по последней свече.
+
+    Недостающие в начале бары заполняются NaN.
+    """
+    matrix = np.full((len(columns), length), np.nan)
+    for row, values in enumerate(columns):
+        tail = values[-length:]
+        if len(tail):
+            matrix[row, length - len(tail):] = tail
+    return matrix
+
+
+def batch_sma(matrix, period):
+    """SMA по последним period барам для каждой строки; NaN, если данных мало"""
+    if matrix.shape[1] < period:
+        return np.full(matrix.shape[0], np.nan)
+    return matrix[:, -period:].mean(axis=1)
+
+
+def batch_support_resistance(low_4h, high_4h, low_1h, high_1h, window_4h=30, window_1h=20):
+    """Поддержка и сопротивление для всех строк матриц за один проход"""
+    with np.errstate(all='ignore'):
+        support_4h = np.nanmin(low_4h[:, -window_4h:], axis=1, initial=np.inf)
+        support_1h = np.nanmin(low_1h[:, -window_1h:], axis=1, initial=np.inf)
+        resistance_4h = np.nanmax(high_4h[:, -window_4h:], axis=1, initial=-np.inf)
+        resistance_1h = np.nanmax(high_1h[:, -window_1h:], axis=1, initial=-np.inf)
+
+    support = np.minimum(support_4h, support_1h)
+    resistance = np.maximum(resistance_4h, resistance_1h)
+    # Как и в скалярной версии, без данных любого из таймфреймов уровней нет
+    missing = np.isinf(support_4h) | np.isinf(support_1h)
+    support[missing] = np.nan
+    resistance[missing] = np.nan
+    return support, resistance
+
+
+def trade_levels(is_long, support, resistance, entry_factor, stop_factor):
+    """Вход, стоп, цель и риск/прибыль сигнала для скаляров или массивов.
+
+    Лонг входит от поддержки и целится в сопротивление; шорт - наоборот, с
+    зеркальными множителями (1.005 -> 0.995, 0.98 -> 1.02).
+    """
+    entry = np.where(is_long, support * entry_factor, resistance * (2 - entry_factor))
+    stop = np.where(is_long, support * stop_factor, resistance * (2 - stop_factor))
+    take = np.where(is_long, resistance, support)
+    risk = np.abs(entry - stop)
+    risk_reward = np.divide(np.abs(take - entry), risk, out=np.zeros_like(risk), where=risk != 0)
+    return entry, stop, take, risk_reward
+
+
+def required_range(entry_factor, stop_factor, min_risk_reward):
+    """Наименьшее отношение сопротивление/поддержка, при котором сигнал проходит по риск/прибыли.
+
+    Для лонга R/S >= entry + rr * (entry - stop), для шорта зеркально;
+    берется меньшее из двух, так как направление заранее неизвестно.
+    """
+    long_ratio = entry_factor + min_risk_reward * (entry_factor - stop_factor)
+    short_ratio = 1 / ((2 - entry_factor) - min_risk_reward * (entry_factor - stop_factor))
+    return min(long_ratio, short_ratio)
+
+
+def range_score(high, low, required_ratio, horizon):
+    """Во сколько раз ожидаемый диапазон цены за horizon суток превышает нужный.
+
+    Диапазон оценивается по 24-часовому и растет как корень из времени, как
+    у случайного блуждания. Это грубая оценка для отсева заведомо
+    неподходящих пар, а не проверка правила.
+    """
+    with np.errstate(all='ignore'):
+        return np.log(high / low) * math.sqrt(horizon) / math.log(required_ratio)
+
+
+class RunningSMA:
+    """SMA с обновлением за O(1) на каждую закрытую свечу через скользящую сумму"""
+
+    def __init__(self, period):
+        self.period = period
+        self._window = deque()
+        self._sum = 0.0
+        self._updates = 0
+
+    def update(self, value):
+        self._window.append(value)
+        self._sum += value
+        if len(self._window) > self.period:
+            self._sum -= self._window.popleft()
+        # Периодически пересчитываем сумму, чтобы не копилась ошибка округления
+        self._updates += 1
+        if self._updates % self.period == 0:
+            self._sum = math.fsum(self._window)
+        return self.value
+
+    @property
+    def value(self):
+        if len(self._window) < self.period:
+            return None
+        return self._sum / self.period
+
+    def value_with(self, current):
+        """SMA последних period-1 закрытых значений и current (незакрытой свечи)"""
+        if current is None:
+            return self.value
+        if len(self._window) < self.period - 1:
+            return None
+        total = self._sum - (self._window[0] if len(self._window) == self.period else 0.0)
+        return (total + current) / self.period
+
+    def to_dict(self):
+        return {'period': self.period, 'window': list(self._window)}
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data['period'])
+        state._window = deque(data['window'])
+        state._sum = math.fsum(state._window)
+        return state
+
+
+class WilderRSI:
+    """RSI со сглаживанием Уайлдера, обновляется за O(1) на каждую закрытую свечу"""
+
+    def __init__(self, period=14):
+        self.period = period
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        self.previous = None
+        self.count = 0
+
+    def update(self, value):
+        if self.previous is not None:
+            diff = value - self.previous
+            gain = max(diff, 0.0)
+            loss = max(-diff, 0.0)
+            self.count += 1
+            if self.count <= self.period:
+                # Первые period изменений усредняем просто, дальше сглаживаем
+                self.avg_gain += gain / self.period
+                self.avg_loss += loss / self.period
+            else:
+                self.avg_gain = (self.avg_gain * (self.period - 1) + gain) / self.period
+                self.avg_loss = (self.avg_loss * (self.period - 1) + loss) / self.period
+        self.previous = value
+        return self.value
+
+    @property
+    def value(self):
+        if self.count < self.period:
+            return None
+        if self.avg_loss == 0:
+            return 100.0 if self.avg_gain > 0 else 50.0
+        return 100 - 100 / (1 + self.avg_gain / self.avg_loss)
+
+    def to_dict(self):
+        return {
+            'period': self.period,
+            'avg_gain': self.avg_gain,
+            'avg_loss': self.avg_loss,
+            'previous': self.previous,
+            'count': self.count
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data['period'])
+        state.avg_gain = data['avg_gain']
+        state.avg_loss = data['avg_loss']
+        state.previous = data['previous']
+        state.count = data['count']
+        return state
+
+
+class RollingExtreme:
+    """Минимум или максимум за последние window значений на монотонной очереди.
+
+    Обновление - амортизированно O(1): значения, которые уже не могут стать
+    экстремумом, выбрасываются из хвоста очереди.
+    """
+
+    def __init__(self, window, mode='min'):
+        if mode not in ('min', 'max'):
+            raise ValueError(f"Unsupported mode: {mode}")
+        self.window = window
+        self.mode = mode
+        self._queue = deque()
+        self._index = 0
+
+    def _dominates(self, new, old):
+        return new <= old if self.mode == 'min' else new >= old
+
+    def update(self, value):
+        while self._queue and self._dominates(value, self._queue[-1][1]):
+            self._queue.pop()
+        self._queue.append((self._index, value))
+        while self._queue[0][0] <= self._index - self.window:
+            self._queue.popleft()
+        self._index += 1
+        return self.value
+
+    @property
+    def value(self):
+        return self._queue[0][1] if self._queue else None
+
+    def value_with(self, current):
+        """Экстремум последних window-1 закрытых значений и current (незакрытой свечи)"""
+        if current is None:
+            return self.value
+        # Из окна выпадает не больше одного, самого старого значения
+        oldest = self._index - (self.window - 1)
+        value = next((value for index, value in self._queue if index >= oldest), None)
+        if value is None:
+            return current
+        return min(value, current) if self.mode == 'min' else max(value, current)
+
+    def to_dict(self):
+        return {'window': self.window, 'mode': self.mode, 'index': self._index, 'queue': [list(item) for item in self._queue]}
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data['window'], data['mode'])
+        state._index = data['index']
+        state._queue = deque(tuple(item) for item in data['queue'])
+        return state
+
+
+class TrendState:
+    """Инкрементальное состояние тренда и уровней одного символа.
+
+    По закрытым свечам 1d ведет SMA50/SMA200 и RSI(14), по 4h и 1h - скользящие
+    минимумы и максимумы окон, из которых support_resistance берет
+    поддержку и сопротивление. Каждая закрытая свеча обрабатывается за
+    O(1). Незакрытая текущая свеча в состояние не входит, а добавляется
+    при чтении в values(), как в расчете по свечам REST.
+    """
+
+    def __init__(self, window_4h=30, window_1h=20):
+        self.window_4h = window_4h
+        self.window_1h = window_1h
+        self.last_closed = {}
+        for interval in ('1d', '4h', '1h'):
+            self.reset(interval)
+
+    def reset(self, interval):
+        """Сбрасывает состояние интервала (перед повторным заполнением после разрыва)"""
+        # Время последней учтенной свечи по интервалам, чтобы не учесть свечу дважды
+        self.last_closed.pop(interval, None)
+        if interval == '1d':
+            self.sma_50 = RunningSMA(50)
+            self.sma_200 = RunningSMA(200)
+            self.rsi = WilderRSI(14)
+        elif interval == '4h':
+            self.low_4h = RollingExtreme(self.window_4h, 'min')
+            self.high_4h = RollingExtreme(self.window_4h, 'max')
+        elif interval == '1h':
+            self.low_1h = RollingExtreme(self.window_1h, 'min')
+            self.high_1h = RollingExtreme(self.window_1h, 'max')
+
+    def on_close(self, interval, timestamp, high, low, close):
+        """Учитывает закрытую свечу; повторы и старые свечи игнорируются"""
+        if timestamp <= self.last_closed.get(interval, -1):
+            return False
+        self.last_closed[interval] = timestamp
+        if interval == '1d':
+            self.sma_50.update(close)
+            self.sma_200.update(close)
+            self.rsi.update(close)
+        elif interval == '4h':
+            self.low_4h.update(low)
+            self.high_4h.update(high)
+        elif interval == '1h':
+            self.low_1h.update(low)
+            self.high_1h.update(high)
+        return True
+
+    def seed(self, series, closed_until):
+        """Учитывает еще не учтенные закрытые свечи CandleSeries (start < closed_until)"""
+        start = bisect.bisect_right(series.timestamp, self.last_closed.get(series.interval, -1))
+        end = bisect.bisect_left(series.timestamp, closed_until)
+        for i in range(start, end):
+            self.on_close(series.interval, series.timestamp[i], series.high[i], series.low[i], series.close[i])
+
+    def values(self, current):
+        """(sma_50, sma_200, support, resistance) с учетом незакрытых свечей.
+
+        current - {interval: (high, low, close) незакрытой свечи или None}.
+        Значения совпадают с sma и support_resistance по тем же свечам,
+        включая незакрытую; None там, где истории не хватает.
+        """
+        _, _, close_1d = current.get('1d') or (None, None, None)
+        high_4h, low_4h, _ = current.get('4h') or (None, None, None)
+        high_1h, low_1h, _ = current.get('1h') or (None, None, None)
+        sma_50 = self.sma_50.value_with(close_1d)
+        sma_200 = self.sma_200.value_with(close_1d)
+
+        lows = (self.low_4h.value_with(low_4h), self.low_1h.value_with(low_1h))
+        highs = (self.high_4h.value_with(high_4h), self.high_1h.value_with(high_1h))
+        if None in lows or None in highs:
+            return sma_50, sma_200, None, None
+        return sma_50, sma_200, min(lows), max(highs)
+
+    def to_dict(self):
+        return {
+            'window_4h': self.window_4h,
+            'window_1h': self.window_1h,
+            'sma_50': self.sma_50.to_dict(),
+            'sma_200': self.sma_200.to_dict(),
+            'rsi': self.rsi.to_dict(),
+            'low_4h': self.low_4h.to_dict(),
+            'high_4h': self.high_4h.to_dict(),
+            'low_1h': self.low_1h.to_dict(),
+            'high_1h': self.high_1h.to_dict(),
+            'last_closed': dict(self.last_closed)
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data['window_4h'], data['window_1h'])
+        state.sma_50 = RunningSMA.from_dict(data['sma_50'])
+        state.sma_200 = RunningSMA.from_dict(data['sma_200'])
+        state.rsi = WilderRSI.from_dict(data['rsi'])
+        state.low_4h = RollingExtreme.from_dict(data['low_4h'])
+        state.high_4h = RollingExtreme.from_dict(data['high_4h'])
+        state.low_1h = RollingExtreme.from_dict(data['low_1h'])
+        state.high_1h = RollingExtreme.from_dict(data['high_1h'])
+        state.last_closed = dict(data['last_closed'])
+        return state
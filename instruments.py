@@ -0,0 +1,108 @@
+import asyncio
+import time
+import logging
+from bybit_client import bybit_client
+from config import INSTRUMENTS_REFRESH_INTERVAL
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+
+class InstrumentRegistry:
+    """Реестр спотовых инструментов Bybit в памяти.
+
+    Загружает полный список одним постраничным запросом и обновляет его в
+    фоне, так что проверка тикера сводится к поиску в словаре.
+    """
+
+    def __init__(self, refresh_interval=INSTRUMENTS_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._instruments = {}
+        self.loaded_at = None
+        self._task = None
+
+    @property
+    def is_loaded(self):
+        return self.loaded_at is not None
+
+    def __contains__(self, symbol):
+        return symbol in self._instruments
+
+    def __len__(self):
+        return len(self._instruments)
+
+    def get(self, symbol):
+        """Возвращает параметры инструмента или None"""
+        return self._instruments.get(symbol)
+
+    def tick_size(self, symbol):
+        instrument = self._instruments.get(symbol)
+        return instrument['tick_size'] if instrument else None
+
+    def lot_size(self, symbol):
+        instrument = self._instruments.get(symbol)
+        return instrument['lot_size'] if instrument else None
+
+    async def load(self):
+        """Загружает полный список спотовых инструментов, возвращает успех"""
+        instruments = {}
+        cursor = None
+        try:
+            while True:
+                params = {'category': 'spot', 'limit': 1000}
+                if cursor:
+                    params['cursor'] = cursor
+
+                response = await bybit_client.get('/v5/market/instruments-info', params)
+                if response is None:
+                    logger.error("Failed to load instruments after all retries")
+                    return False
+
+                data = response.json()
+                if data.get('retCode') != 0:
+                    logger.error(f"Bybit API error while loading instruments: {data.get('retMsg')}")
+                    return False
+
+                result = data.get('result', {})
+                for item in result.get('list', []):
+                    if item.get('status', 'Trading') != 'Trading':
+                        continue
+                    instruments[item['symbol']] = {
+                        'base_coin': item.get('baseCoin'),
+                        'quote_coin': item.get('quoteCoin'),
+                        'tick_size': float(item.get('priceFilter', {}).get('tickSize') or 0),
+                        'lot_size': float(item.get('lotSizeFilter', {}).get('basePrecision') or 0),
+                        'min_order_qty': float(item.get('lotSizeFilter', {}).get('minOrderQty') or 0)
+                    }
+
+                cursor = result.get('nextPageCursor')
+                if not cursor:
+                    break
+        except Exception as e:
+            logger.error(f"Error loading instruments: {e}")
+            return False
+
+        self._instruments = instruments
+        self.loaded_at = time.time()
+        logger.info(f"Loaded {len(instruments)} spot instruments from Bybit")
+        return True
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.load()
+
+    def start(self):
+        """Запускает фоновое обновление реестра в текущем event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+# Общий реестр инструментов на весь процесс
+instrument_registry = InstrumentRegistry()
@@ -0,0 +1,125 @@
+import time
+import logging
+from collections import OrderedDict
+from config import KLINE_CACHE_SIZE, KLINE_OPEN_CANDLE_TTL
+from metrics import KLINE_CACHE
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Длительность свечи в миллисекундах для поддерживаемых интервалов
+INTERVAL_MS = {
+    '1h': 60 * 60 * 1000,
+    '4h': 4 * 60 * 60 * 1000,
+    '1d': 24 * 60 * 60 * 1000
+}
+
+# Обозначения интервалов в API Bybit (REST и WebSocket)
+BYBIT_INTERVALS = {
+    '1h': '60',
+    '4h': '240',
+    '1d': 'D'
+}
+
+
+def next_candle_close(interval, now_ms):
+    """Возвращает время закрытия текущей свечи (свечи Bybit выровнены по UTC)"""
+    step = INTERVAL_MS[interval]
+    return (now_ms // step + 1) * step
+
+
+class KlineCache:
+    """LRU-кэш свечей с истечением срока на закрытии текущей свечи.
+
+    Закрытые свечи записи действительны до закрытия текущей свечи. Если в
+    записи есть незакрытая свеча, ее цена и экстремумы еще меняются, поэтому
+    через open_candle_ttl секунд get перестает отдавать запись, а
+    get_history продолжает: вызывающий обновляет только последнюю свечу.
+    Ключ - (symbol, interval, limit). Закэшированные списки общие для всех
+    вызывающих, поэтому изменять их нельзя. Устаревшие записи остаются до
+    вытеснения: их отдает get_stale, когда Bybit недоступно.
+    """
+
+    def __init__(self, max_entries=2000, open_candle_ttl=KLINE_OPEN_CANDLE_TTL):
+        self.max_entries = max_entries
+        self.open_candle_ttl = open_candle_ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, symbol, interval, limit, now_ms=None):
+        """Возвращает свечи из кэша или None, если записи нет или она устарела"""
+        key = (symbol, interval, limit)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            KLINE_CACHE.labels('miss').inc()
+            return None
+
+        expires_at, refresh_at, klines = entry
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        if now_ms >= expires_at:
+            self.misses += 1
+            KLINE_CACHE.labels('expired').inc()
+            return None
+        if now_ms >= refresh_at:
+            self.misses += 1
+            KLINE_CACHE.labels('open').inc()
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        KLINE_CACHE.labels('hit').inc()
+        return klines
+
+    def get_history(self, symbol, interval, limit, now_ms=None):
+        """Свечи записи до закрытия текущей свечи, даже если незакрытую пора обновить"""
+        entry = self._entries.get((symbol, interval, limit))
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        if entry is None or now_ms >= entry[0]:
+            return None
+        self._entries.move_to_end((symbol, interval, limit))
+        return entry[2]
+
+    def get_stale(self, symbol, interval, limit):
+        """Последние сохраненные свечи независимо от срока или None"""
+        entry = self._entries.get((symbol, interval, limit))
+        if entry is None:
+            return None
+        KLINE_CACHE.labels('stale').inc()
+        return entry[2]
+
+    def put(self, symbol, interval, limit, klines, now_ms=None):
+        """Сохраняет свечи до закрытия текущей свечи интервала (незакрытую - на open_candle_ttl)"""
+        if interval not in INTERVAL_MS:
+            return
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        key = (symbol, interval, limit)
+        expires_at = next_candle_close(interval, now_ms)
+        refresh_at = expires_at
+        last_timestamp = getattr(klines, 'last_timestamp', None)
+        if last_timestamp is None or last_timestamp + INTERVAL_MS[interval] > now_ms:
+            refresh_at = min(expires_at, now_ms + int(self.open_candle_ttl * 1000))
+        self._entries[key] = (expires_at, refresh_at, klines)
+        self._entries.move_to_end(key)
+
+        # Вытесняем давно не использованные записи
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """Статистика кэша для логов и мониторинга"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+# Общий кэш свечей на весь процесс
+kline_cache = KlineCache(KLINE_CACHE_SIZE)
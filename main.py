@@ -1,14 +1,27 @@
-import os
+import signal
 import logging
 import asyncio
-from threading import Thread
-from flask import Flask
-from telegram import ReplyKeyboardMarkup
+import functools
+from telegram import ReplyKeyboardMarkup, Update
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler
 from telegram.ext.filters import TEXT, COMMAND
-from messages import WELCOME_MESSAGE, INSTRUCTION_MESSAGE
-from analysis import analyze_ticker, get_best_signals
-from config import TELEGRAM_TOKEN
+from messages import WELCOME_MESSAGE, INSTRUCTION_MESSAGE, BUSY_MESSAGE
+from analysis import analyze_ticker, get_best_signals, get_top_pairs, validate_ticker, market_scanner, market_stream
+from subscriptions import subscription_store, DIRECTIONS
+from send_queue import send_queue
+from alerts import alert_engine
+from bybit_client import bybit_client
+from instruments import instrument_registry
+from metrics import render as render_metrics, event_loop_monitor, telegram_call
+from tracing import trace, trace_exporter
+from webserver import web_server
+from scheduler import SchedulerBusy, DuplicateJob
+from analysis_workers import analysis_pool
+from candle_files import candle_files
+from config import (
+    TELEGRAM_TOKEN, MARKET_DATA_MODE, SCAN_MAX_PAIRS, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    CONCURRENT_UPDATES
+)
 
 # Настройка логирования для Render
 logging.basicConfig(
@@ -18,26 +31,52 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Flask приложение для health check
-app = Flask(__name__)
+# Готовность принимать запросы: реестр инструментов загружен, фоновые задачи запущены
+bot_state = {'ready': False}
 
-@app.route('/')
-def health_check():
+@web_server.route('/')
+async def health_check(request):
     return {'status': 'Bot is running', 'message': 'CryptoSignalBot is healthy'}, 200
 
-@app.route('/health')
-def health():
+@web_server.route('/health')
+async def health(request):
     return {'status': 'healthy'}, 200
 
-@app.route('/status')
-def status():
+@web_server.route('/ready')
+async def ready(request):
+    if not bot_state['ready']:
+        return {'status': 'starting'}, 503
+    return {'status': 'ready', 'mode': BOT_MODE}, 200
+
+@web_server.route('/status')
+async def status(request):
     return {'bot': 'active', 'service': 'telegram-crypto-bot'}, 200
 
-def run_flask():
-    """Запускает Flask сервер в отдельном потоке"""
-    port = int(os.environ.get('PORT', 10000))
-    logger.info(f"Starting Flask server on port {port}")
-    app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
+@web_server.route('/metrics')
+async def metrics(request):
+    body, content_type = render_metrics()
+    return body, 200, {'Content-Type': content_type}
+
+def add_webhook_route(application):
+    """Обновления Telegram кладутся в очередь приложения, ответ уходит сразу.
+
+    Неразбираемое обновление логируется и подтверждается ответом 200:
+    на ошибку Telegram доставлял бы его повторно.
+    """
+    @web_server.route(WEBHOOK_PATH, methods=('POST',))
+    async def telegram_webhook(request):
+        if WEBHOOK_SECRET and request.headers.get('x-telegram-bot-api-secret-token') != WEBHOOK_SECRET:
+            return {'error': 'forbidden'}, 403
+        try:
+            update = Update.de_json(request.json(), application.bot)
+        except Exception as e:
+            logger.warning(f"Dropping invalid webhook payload: {e}")
+            return {'ok': False}, 200
+        if update is None:
+            logger.warning("Dropping empty webhook payload")
+            return {'ok': False}, 200
+        await application.update_queue.put(update)
+        return {'ok': True}, 200
 
 # Фиксированная клавиатура внизу с эмодзи
 reply_keyboard = ReplyKeyboardMarkup(
@@ -65,6 +104,93 @@ async def instruction(update, context):
         reply_markup=reply_keyboard
     )
 
+def traced(handler):
+    """Каждый запрос пользователя получает свое дерево span'ов"""
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        user = update.effective_user
+        text = update.message.text if update.message else ''
+        with trace(handler.__name__, user_id=user.id if user else 0, text=text or ''):
+            return await handler(update, context)
+    return wrapper
+
+SUBSCRIBE_USAGE = (
+    "❌ Укажите тикер или направление, например:\n"
+    "/subscribe BTC - оповещения о сигналах по BTC\n"
+    "/subscribe long - обновления лучших сигналов в лонг"
+)
+
+def topic_label(topic):
+    """Название темы подписки для пользователя"""
+    if topic == 'long':
+        return "📈 Лучшее в лонг"
+    if topic == 'short':
+        return "📉 Лучшее в шорт"
+    return topic
+
+async def parse_topic(arg):
+    """Тема подписки из аргумента команды: направление или символ; None, если тикер не найден"""
+    if arg.lower() in DIRECTIONS:
+        return arg.lower()
+    ticker = arg.upper()
+    if ticker.endswith('USDT') and len(ticker) > 4:
+        ticker = ticker[:-4]
+    if not await validate_ticker(ticker):
+        return None
+    return f"{ticker}USDT"
+
+@traced
+async def subscribe(update, context):
+    chat_id = update.effective_chat.id
+    if not context.args:
+        await update.message.reply_text(SUBSCRIBE_USAGE, reply_markup=reply_keyboard)
+        return
+
+    topic = await parse_topic(context.args[0])
+    if topic is None:
+        await update.message.reply_text(
+            f"❌ Тикер {context.args[0].upper()} не найден на Bybit.",
+            reply_markup=reply_keyboard
+        )
+        return
+
+    if subscription_store.add(chat_id, topic):
+        logger.info(f"Chat {chat_id} subscribed to {topic}")
+        if MARKET_DATA_MODE == 'stream' and topic not in DIRECTIONS:
+            market_stream.track([topic])
+        text = f"🔔 Подписка оформлена: {topic_label(topic)}. Оповещение придет при новом сигнале после закрытия свечи."
+    else:
+        text = f"ℹ️ Вы уже подписаны: {topic_label(topic)}"
+    await update.message.reply_text(text, reply_markup=reply_keyboard)
+
+@traced
+async def unsubscribe(update, context):
+    chat_id = update.effective_chat.id
+    if not context.args:
+        removed = subscription_store.remove_chat(chat_id)
+        text = "🔕 Все подписки отменены." if removed else "ℹ️ У вас нет подписок."
+        await update.message.reply_text(text, reply_markup=reply_keyboard)
+        return
+
+    arg = context.args[0]
+    topic = arg.lower() if arg.lower() in DIRECTIONS else f"{arg.upper().removesuffix('USDT')}USDT"
+    if subscription_store.remove(chat_id, topic):
+        logger.info(f"Chat {chat_id} unsubscribed from {topic}")
+        text = f"🔕 Подписка отменена: {topic_label(topic)}"
+    else:
+        text = f"ℹ️ Вы не подписаны на {topic_label(topic)}"
+    await update.message.reply_text(text, reply_markup=reply_keyboard)
+
+@traced
+async def subscriptions(update, context):
+    topics = subscription_store.topics(update.effective_chat.id)
+    if not topics:
+        text = "ℹ️ У вас нет подписок. Например: /subscribe BTC или /subscribe long"
+    else:
+        text = "🔔 Ваши подписки:\n" + "\n".join(f"• {topic_label(topic)}" for topic in topics)
+    await update.message.reply_text(text, reply_markup=reply_keyboard)
+
+@traced
 async def handle_ticker(update, context):
     ticker = update.message.text
     user_id = update.effective_user.id
@@ -74,13 +200,13 @@ async def handle_ticker(update, context):
             logger.info(f"User {user_id} requested best long signals")
             signals = await get_best_signals('long', update)
             response = signals if signals else "❌ Подходящих пар не найдено. Попробуйте позже или выберите '📉 Лучшее в шорт'."
-            await update.message.reply_text(response, parse_mode='Markdown', reply_markup=reply_keyboard)
+            await telegram_call('send_message', update.message.reply_text, response, parse_mode='Markdown', reply_markup=reply_keyboard)
 
         elif ticker == "📉 Лучшее в шорт":
             logger.info(f"User {user_id} requested best short signals")
             signals = await get_best_signals('short', update)
             response = signals if signals else "❌ Подходящих пар не найдено. Попробуйте позже или выберите '📈 Лучшее в лонг'."
-            await update.message.reply_text(response, parse_mode='Markdown', reply_markup=reply_keyboard)
+            await telegram_call('send_message', update.message.reply_text, response, parse_mode='Markdown', reply_markup=reply_keyboard)
 
         elif ticker == "📋 Инструкция":
             await update.message.reply_text(INSTRUCTION_MESSAGE, parse_mode='Markdown', reply_markup=reply_keyboard)
@@ -98,8 +224,13 @@ async def handle_ticker(update, context):
 
             logger.info(f"User {user_id} analyzing ticker: {ticker}")
             signal = await analyze_ticker(ticker.upper(), update)
-            await update.message.reply_text(signal, parse_mode='Markdown', reply_markup=reply_keyboard)
-            
+            await telegram_call('send_message', update.message.reply_text, signal, parse_mode='Markdown', reply_markup=reply_keyboard)
+
+    except SchedulerBusy:
+        await telegram_call('send_message', update.message.reply_text, BUSY_MESSAGE, reply_markup=reply_keyboard)
+    except DuplicateJob:
+        # Ответ придет на первый такой же запрос
+        logger.info(f"Ignored duplicate request {ticker} from user {user_id}")
     except Exception as e:
         logger.error(f"Error handling ticker {ticker} for user {user_id}: {e}")
         await update.message.reply_text(
@@ -116,28 +247,105 @@ async def button_handler(update, context):
         parse_mode='Markdown'
     )
 
+async def on_startup(application):
+    """Загружает реестр инструментов и запускает фоновые задачи"""
+    event_loop_monitor.start()
+    trace_exporter.start()
+    await web_server.start()
+    # Ряды свечей восстанавливаются с диска, по REST догружается только разрыв
+    candle_files.load()
+    candle_files.start()
+    await instrument_registry.load()
+    instrument_registry.start()
+    subscription_store.load()
+
+    if MARKET_DATA_MODE == 'stream':
+        # Подписываемся на топ пар, чтобы кнопки и анализ читали свечи из потока
+        pairs = await get_top_pairs(SCAN_MAX_PAIRS)
+        market_stream.track(pair['symbol'] for pair in pairs)
+        market_stream.track(subscription_store.symbols())
+        market_stream.start()
+        logger.info(f"Bybit stream started for {len(market_stream.symbols)} symbols")
+
+    # Оповещения подписчиков считаются после каждого фонового сканирования
+    send_queue.start(application.bot)
+    market_scanner.add_listener(alert_engine.on_snapshot)
+    market_scanner.start()
+    bot_state['ready'] = True
+
+async def on_shutdown(application):
+    """Останавливает фоновые задачи и закрывает пул соединений с Bybit"""
+    bot_state['ready'] = False
+    await market_scanner.stop()
+    analysis_pool.close()
+    await send_queue.stop()
+    await market_stream.stop()
+    await candle_files.stop()
+    await instrument_registry.stop()
+    await bybit_client.close()
+    await event_loop_monitor.stop()
+    await trace_exporter.stop()
+    await web_server.stop()
+    logger.info("Bybit client closed")
+
+async def run_webhook(application):
+    """Webhook: обновления приходят на тот же HTTP-сервер, что health-check и метрики"""
+    add_webhook_route(application)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with application:
+        await on_startup(application)
+        try:
+            await application.bot.set_webhook(
+                WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=Update.ALL_TYPES
+            )
+            await application.start()
+            logger.info(f"Bot is running with webhook {WEBHOOK_PATH}...")
+            await stop.wait()
+            await application.stop()
+        finally:
+            await on_shutdown(application)
+
 def main():
     # Проверяем наличие токена
     if not TELEGRAM_TOKEN:
         logger.error("TELEGRAM_TOKEN not found in environment variables!")
         raise ValueError("TELEGRAM_TOKEN environment variable is required")
     
-    # Запускаем Flask сервер в отдельном потоке
-    flask_thread = Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-    logger.info("Flask health check server started")
-    
-    logger.info("Starting CryptoSignalBot...")
-    
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        logger.error("WEBHOOK_URL is required in webhook mode!")
+        raise ValueError("WEBHOOK_URL environment variable is required when BOT_MODE=webhook")
+
+    logger.info(f"Starting CryptoSignalBot in {BOT_MODE} mode...")
+
+    # Health-check и метрики отдает web_server в том же event loop, что и бот
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CommandHandler('instruction', instruction))
+    application.add_handler(CommandHandler('subscribe', subscribe))
+    application.add_handler(CommandHandler('unsubscribe', unsubscribe))
+    application.add_handler(CommandHandler('subscriptions', subscriptions))
     application.add_handler(MessageHandler(TEXT & ~COMMAND, handle_ticker))
     application.add_handler(CallbackQueryHandler(button_handler))
     
     try:
-        logger.info("Bot is running with polling...")
-        application.run_polling()
+        if BOT_MODE == 'webhook':
+            asyncio.run(run_webhook(application))
+        else:
+            logger.info("Bot is running with polling...")
+            application.run_polling()
     except Exception as e:
         logger.error(f"Error running bot: {e}")
         raise
@@ -29,6 +29,11 @@ INSTRUCTION_MESSAGE = """
 📈 "Лучшее в лонг" - сигналы на рост
 📉 "Лучшее в шорт" - сигналы на падение
 
+🔔 *Способ 3 - Подпишись на оповещения:*
+/subscribe BTC - новый сигнал по монете после закрытия свечи
+/subscribe long или /subscribe short - обновления лучших сигналов
+/subscriptions - твои подписки, /unsubscribe BTC - отписаться
+
 📊 *Что означают цифры в сигнале:*
 
 💲 *Текущая цена* - сколько стоит монета сейчас
@@ -42,4 +47,5 @@ INSTRUCTION_MESSAGE = """
 🚨 *ВАЖНО!* 
 Это только сигналы для анализа. Торговля = риск потерь!
 Решение принимаешь только ты сам 💪
-"""
\ No newline at end of file
+"""
+BUSY_MESSAGE = "⏳ Сейчас много запросов, бот не успеет ответить быстро. Попробуйте через минуту."
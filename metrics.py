@@ -0,0 +1,91 @@
+import asyncio
+import time
+import logging
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from config import EVENT_LOOP_LAG_INTERVAL
+from tracing import span
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Запросы к Bybit: от долей секунды до повторов с паузами
+BYBIT_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+# Ответы пользователю: от ответа из кэша до полного сканирования
+HANDLER_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+BYBIT_REQUESTS = Counter('bybit_requests_total', 'Ответы Bybit по эндпоинту и HTTP-статусу', ['endpoint', 'status'])
+BYBIT_LATENCY = Histogram('bybit_request_seconds', 'Время одного HTTP-запроса к Bybit', ['endpoint'], buckets=BYBIT_BUCKETS)
+BYBIT_RETRIES = Counter('bybit_retries_total', 'Повторные попытки запросов к Bybit', ['endpoint', 'reason'])
+BYBIT_FAILURES = Counter('bybit_failures_total', 'Запросы к Bybit, не удавшиеся после всех попыток', ['endpoint'])
+BYBIT_HEDGES = Counter('bybit_hedged_requests_total', 'Дубли медленных запросов к Bybit', ['endpoint', 'result'])
+BYBIT_CIRCUIT_STATE = Gauge('bybit_circuit_state', 'Автомат эндпоинта: 0 - замкнут, 1 - пробный запрос, 2 - разомкнут', ['endpoint'])
+RATE_LIMIT_WAIT = Histogram('bybit_rate_limit_wait_seconds', 'Ожидание в ограничителе запросов', ['endpoint'], buckets=BYBIT_BUCKETS)
+
+KLINE_CACHE = Counter('kline_cache_requests_total', 'Обращения к кэшу свечей', ['result'])
+
+ANALYSIS_STAGE = Histogram('analysis_stage_seconds', 'Время этапов анализа тикера', ['stage'], buckets=BYBIT_BUCKETS)
+HANDLER_LATENCY = Histogram('handler_seconds', 'Время ответа обработчика пользователю', ['handler', 'source'], buckets=HANDLER_BUCKETS)
+SCAN_DURATION = Histogram('scan_seconds', 'Длительность сканирования пар', ['kind'], buckets=HANDLER_BUCKETS)
+SCAN_PAIRS = Counter('scan_pairs_processed_total', 'Обработанные при сканировании пары', ['kind'])
+PREFILTER_PAIRS = Counter('prefilter_pairs_total', 'Пары после предварительного отбора по тикерам', ['result'])
+SNAPSHOT_CREATED = Gauge('signal_snapshot_created_timestamp_seconds', 'Время создания последнего снимка сигналов')
+
+SCHEDULER_WAIT = Histogram('scheduler_wait_seconds', 'Ожидание задачи в очереди планировщика', ['priority'], buckets=HANDLER_BUCKETS)
+SCHEDULER_SHED = Counter('scheduler_shed_total', 'Задачи, отклоненные из-за перегрузки', ['priority', 'stage'])
+SCHEDULER_QUEUE = Gauge('scheduler_queue_jobs', 'Задачи в очереди планировщика', ['priority'])
+
+TELEGRAM_LATENCY = Histogram('telegram_api_seconds', 'Время вызовов Telegram API', ['method'], buckets=BYBIT_BUCKETS)
+TELEGRAM_ERRORS = Counter('telegram_api_errors_total', 'Ошибки вызовов Telegram API', ['method', 'error'])
+
+EVENT_LOOP_LAG = Histogram(
+    'event_loop_lag_seconds', 'Опоздание пробуждения таймера в event loop',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+
+
+async def telegram_call(method, call, *args, **kwargs):
+    """Вызов Telegram API с замером времени и учетом ошибок"""
+    with span(f"telegram.{method}"), TELEGRAM_LATENCY.labels(method).time():
+        try:
+            return await call(*args, **kwargs)
+        except Exception as e:
+            TELEGRAM_ERRORS.labels(method, type(e).__name__).inc()
+            raise
+
+
+class EventLoopMonitor:
+    """Меряет, насколько позже запланированного просыпается таймер в event loop.
+
+    Большое опоздание значит, что цикл занят синхронной работой (разбор
+    ответов, расчеты) и все остальные корутины ждут.
+    """
+
+    def __init__(self, interval=EVENT_LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - started - self.interval
+            EVENT_LOOP_LAG.observe(max(lag, 0.0))
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+def render():
+    """Текст метрик в формате Prometheus и его Content-Type"""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+# Монитор задержек event loop на весь процесс
+event_loop_monitor = EventLoopMonitor()
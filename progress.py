@@ -0,0 +1,125 @@
+import asyncio
+import time
+import logging
+from telegram.error import BadRequest, RetryAfter
+from config import PROGRESS_SHOW_AFTER, PROGRESS_MIN_INTERVAL
+from metrics import telegram_call
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+
+class ChatThrottle:
+    """Минимальный интервал между правками сообщений в одном чате"""
+
+    def __init__(self, min_interval=PROGRESS_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._next_allowed = {}
+
+    def delay(self, chat_id):
+        """Сколько секунд ждать до следующей правки в чате"""
+        return max(self._next_allowed.get(chat_id, 0.0) - time.monotonic(), 0.0)
+
+    def mark(self, chat_id):
+        self._next_allowed[chat_id] = time.monotonic() + self.min_interval
+
+    def penalize(self, chat_id, seconds):
+        """Telegram попросил подождать (RetryAfter)"""
+        self._next_allowed[chat_id] = time.monotonic() + seconds
+
+
+# Общий на процесс лимит правок по чатам
+chat_throttle = ChatThrottle()
+
+
+class ProgressReporter:
+    """Прогресс одного запроса пользователя, управляемый событиями конвейера.
+
+    update(text) только запоминает последнее состояние; отдельная задача
+    показывает его не чаще, чем позволяет лимит правок в чате, пропуская
+    промежуточные состояния. Если результат готов быстрее show_after секунд,
+    сообщение с прогрессом вообще не отправляется. Прогресс никогда не
+    задерживает результат.
+    """
+
+    def __init__(self, message, initial_text, show_after=PROGRESS_SHOW_AFTER, throttle=chat_throttle, parse_mode=None):
+        self._reply_to = message
+        self.parse_mode = parse_mode
+        self._chat_id = message.chat_id
+        self.initial_text = initial_text
+        self.show_after = show_after
+        self.throttle = throttle
+        self._pending = None
+        self._shown = None
+        self._message = None
+        self._wakeup = asyncio.Event()
+        self._finished = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def update(self, text):
+        """Сообщает новое состояние прогресса (подходит как слушатель SingleFlight)"""
+        self._pending = text
+        self._wakeup.set()
+
+    async def _wait_or_finish(self, seconds):
+        """Ждет seconds секунд; возвращает True, если за это время работа завершилась"""
+        if seconds <= 0:
+            return self._finished.is_set()
+        try:
+            await asyncio.wait_for(self._finished.wait(), timeout=seconds)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _run(self):
+        # Быстрый результат: анимацию не показываем
+        if await self._wait_or_finish(self.show_after):
+            return
+        if await self._wait_or_finish(self.throttle.delay(self._chat_id)):
+            return
+
+        text = self._pending or self.initial_text
+        self._message = await telegram_call('send_message', self._reply_to.reply_text, text, parse_mode=self.parse_mode)
+        self._shown = text
+        self.throttle.mark(self._chat_id)
+
+        while not self._finished.is_set():
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if await self._wait_or_finish(self.throttle.delay(self._chat_id)):
+                return
+
+            # Показываем только последнее состояние, промежуточные пропускаем
+            text = self._pending
+            if not text or text == self._shown:
+                continue
+            try:
+                await telegram_call('edit_message_text', self._message.edit_text, text, parse_mode=self.parse_mode)
+                self._shown = text
+            except RetryAfter as e:
+                self.throttle.penalize(self._chat_id, e.retry_after)
+                self._wakeup.set()
+                continue
+            except BadRequest as e:
+                logger.debug(f"Progress edit skipped: {e}")
+            self.throttle.mark(self._chat_id)
+
+    async def finish(self):
+        """Останавливает прогресс и удаляет сообщение с ним, если оно было отправлено"""
+        self._finished.set()
+        self._wakeup.set()
+        if self._task is not None:
+            try:
+                await self._task
+            except Exception as e:
+                logger.warning(f"Progress reporter failed: {e}")
+        if self._message is not None:
+            try:
+                await telegram_call('delete_message', self._message.delete)
+            except Exception as e:
+                logger.debug(f"Could not delete progress message: {e}")
+            self._message = None
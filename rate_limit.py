@@ -0,0 +1,137 @@
+import asyncio
+import time
+import logging
+from config import BYBIT_RATE_LIMIT, BYBIT_RATE_BURST, BYBIT_ENDPOINT_RATE_LIMITS
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Корзина токенов с честной (FIFO) очередью ожидающих.
+
+    Ожидающие выстраиваются на asyncio.Lock, который будит их строго по
+    очереди, поэтому никто не обгоняет других и не спит наугад.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Ждет своей очереди и свободного токена"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def available(self):
+        """Есть ли токен прямо сейчас, без очереди ожидающих"""
+        if self._lock.locked() or time.monotonic() < self._blocked_until:
+            return False
+        self._refill()
+        return self.tokens >= 1
+
+    def block_for(self, seconds):
+        """Останавливает выдачу токенов на seconds секунд"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def limit_remaining(self, remaining):
+        """Не выдаем больше токенов, чем биржа готова принять до сброса окна"""
+        self._refill()
+        self.tokens = min(self.tokens, remaining)
+
+
+class RateLimiter:
+    """Общий на процесс ограничитель запросов к Bybit.
+
+    Каждый запрос проходит общую корзину (лимит по IP) и корзину своего
+    эндпоинта. Бюджеты подстраиваются по заголовкам X-Bapi-Limit-Status и
+    X-Bapi-Limit-Reset-Timestamp, а после 429 эндпоинт ждет до сброса окна.
+    """
+
+    def __init__(self, rate=BYBIT_RATE_LIMIT, burst=BYBIT_RATE_BURST, endpoint_limits=BYBIT_ENDPOINT_RATE_LIMITS):
+        self.global_bucket = TokenBucket(rate, burst)
+        self.endpoint_limits = endpoint_limits
+        self._default_rate = rate
+        self._default_burst = burst
+        self._buckets = {}
+
+    def bucket(self, endpoint):
+        bucket = self._buckets.get(endpoint)
+        if bucket is None:
+            rate, burst = self.endpoint_limits.get(endpoint, (self._default_rate, self._default_burst))
+            bucket = TokenBucket(rate, burst)
+            self._buckets[endpoint] = bucket
+        return bucket
+
+    async def acquire(self, endpoint):
+        """Ждет разрешения на запрос к эндпоинту"""
+        await self.bucket(endpoint).acquire()
+        await self.global_bucket.acquire()
+
+    def try_acquire(self, endpoint):
+        """Берет разрешение без ожидания; False, если пришлось бы встать в очередь"""
+        buckets = (self.bucket(endpoint), self.global_bucket)
+        if not all(bucket.available() for bucket in buckets):
+            return False
+        for bucket in buckets:
+            bucket.tokens -= 1
+        return True
+
+    def observe(self, endpoint, headers):
+        """Подстраивает бюджет эндпоинта по заголовкам ответа Bybit"""
+        remaining = headers.get('X-Bapi-Limit-Status')
+        if remaining is None:
+            return
+        try:
+            remaining = int(remaining)
+        except ValueError:
+            return
+
+        bucket = self.bucket(endpoint)
+        if remaining > 0:
+            bucket.limit_remaining(remaining)
+            return
+
+        # Бюджет исчерпан: ждем сброса окна
+        wait = self._seconds_until_reset(headers)
+        logger.warning(f"Bybit limit exhausted for {endpoint}, pausing {wait:.2f}s")
+        bucket.block_for(wait)
+
+    def penalize(self, endpoint, headers=None):
+        """Реакция на 429: эндпоинт ждет сброса окна (или секунду, если время сброса неизвестно)"""
+        wait = self._seconds_until_reset(headers or {})
+        logger.warning(f"Rate limit hit on {endpoint}, pausing {wait:.2f}s")
+        self.bucket(endpoint).block_for(wait)
+
+    @staticmethod
+    def _seconds_until_reset(headers, default=1.0):
+        reset = headers.get('X-Bapi-Limit-Reset-Timestamp')
+        if reset is None:
+            return default
+        try:
+            return min(max(int(reset) / 1000 - time.time(), 0.0), 60.0)
+        except ValueError:
+            return default
+
+
+# Общий ограничитель на весь процесс
+rate_limiter = RateLimiter()
@@ -0,0 +1,198 @@
+import asyncio
+import heapq
+import time
+import logging
+from dataclasses import dataclass
+from kline_cache import INTERVAL_MS, next_candle_close
+from tracing import trace
+from metrics import SCAN_DURATION, SCAN_PAIRS, SNAPSHOT_CREATED
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+
+async def scan_pairs(symbols, evaluate, concurrency=10, on_progress=None):
+    """Параллельно оценивает пары с ограничением одновременных задач.
+
+    evaluate(symbol) - корутина, возвращающая результат или None.
+    on_progress(processed, total) вызывается после каждой пары.
+    Возвращает (результаты в порядке symbols, число обработанных пар).
+    """
+    queue = asyncio.Queue()
+    for index, symbol in enumerate(symbols):
+        queue.put_nowait((index, symbol))
+
+    found = []
+    processed = 0
+
+    async def worker():
+        nonlocal processed
+        while not queue.empty():
+            index, symbol = queue.get_nowait()
+            try:
+                result = await evaluate(symbol)
+            except Exception as e:
+                logger.error(f"Error processing pair {symbol}: {e}")
+                result = None
+            processed += 1
+            if result is not None:
+                found.append((index, result))
+            if on_progress is not None:
+                await on_progress(processed, len(symbols))
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(symbols)))))
+
+    found.sort(key=lambda item: item[0])
+    results = [result for _, result in found]
+    logger.info(f"Scanned {processed}/{len(symbols)} pairs, found {len(results)}")
+    return results, processed
+
+
+class TopK:
+    """Ограниченный рейтинг: k лучших по key(item) среди всех добавленных элементов.
+
+    Хранит min-кучу из k элементов, худший из лучших всегда на вершине,
+    поэтому добавление стоит O(log k) при любом числе оцененных пар. При
+    равных ключах выше тот, кто добавлен раньше.
+    """
+
+    __slots__ = ('k', 'key', '_heap', '_count')
+
+    def __init__(self, k, key):
+        self.k = k
+        self.key = key
+        self._heap = []
+        self._count = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, item):
+        """Добавляет элемент; возвращает True, если он вошел в k лучших"""
+        entry = (self.key(item), -self._count, item)
+        self._count += 1
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+            return True
+        if self.k and entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+            return True
+        return False
+
+    def ranked(self):
+        """Элементы от лучшего к худшему"""
+        return [item for _, _, item in sorted(self._heap, key=lambda entry: entry[:2], reverse=True)]
+
+
+@dataclass(frozen=True)
+class SignalSnapshot:
+    """Неизменяемый снимок ранжированных сигналов после фонового сканирования"""
+    version: int
+    created_at: float
+    long: tuple
+    short: tuple
+    pairs_scanned: int
+    # Пары, посчитанные по сохраненным свечам, пока Bybit было недоступно
+    stale_pairs: int = 0
+
+    @property
+    def age(self):
+        """Возраст снимка в секундах"""
+        return time.time() - self.created_at
+
+    def best(self, direction, limit):
+        signals = self.long if direction == 'long' else self.short
+        return signals[:limit]
+
+
+class MarketScanner:
+    """Фоновый сканер рынка, пересчитывающий снимок после закрытия каждой свечи.
+
+    get_pairs(limit) возвращает список пар, fetch(symbol) - данные пары или
+    None, корутина evaluate_batch(loaded) - сигналы в любом направлении сразу
+    для всех загруженных пар. Сколько бы пользователей ни нажимали кнопки,
+    сканирование выполняется один раз за интервал. Слушатели, добавленные
+    через add_listener, получают каждый новый снимок.
+    """
+
+    def __init__(self, get_pairs, fetch, evaluate_batch, max_pairs, concurrency, interval='1h', delay=30):
+        self.get_pairs = get_pairs
+        self.fetch = fetch
+        self.evaluate_batch = evaluate_batch
+        self.max_pairs = max_pairs
+        self.concurrency = concurrency
+        self.interval = interval
+        self.delay = delay
+        self.snapshot = None
+        self._version = 0
+        self._task = None
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Добавляет корутину listener(snapshot), вызываемую после каждого сканирования"""
+        self._listeners.append(listener)
+
+    async def scan_once(self):
+        """Сканирует все пары и публикует новый снимок"""
+        started = time.monotonic()
+        pairs = await self.get_pairs(self.max_pairs)
+        if not pairs:
+            logger.error("Background scan skipped: no pairs available")
+            return self.snapshot
+
+        symbols = [pair['symbol'] for pair in pairs]
+        loaded, processed = await scan_pairs(symbols, self.fetch, concurrency=self.concurrency)
+        results = await self.evaluate_batch(loaded)
+
+        # Ранжируем кандидатов по соотношению риск/прибыль
+        ranked = sorted(results, key=lambda result: result['risk_reward'], reverse=True)
+        self._version += 1
+        self.snapshot = SignalSnapshot(
+            version=self._version,
+            created_at=time.time(),
+            long=tuple(result for result in ranked if result['direction'] == 'long'),
+            short=tuple(result for result in ranked if result['direction'] == 'short'),
+            pairs_scanned=processed,
+            stale_pairs=sum(any(getattr(data, 'stale', False) for data in item[1:]) for item in loaded)
+        )
+        SCAN_DURATION.labels('background').observe(time.monotonic() - started)
+        SCAN_PAIRS.labels('background').inc(processed)
+        SNAPSHOT_CREATED.set(self.snapshot.created_at)
+        logger.info(
+            f"Snapshot v{self._version}: {len(self.snapshot.long)} long, "
+            f"{len(self.snapshot.short)} short from {processed} pairs "
+            f"in {time.monotonic() - started:.1f}s"
+        )
+
+        for listener in self._listeners:
+            try:
+                await listener(self.snapshot)
+            except Exception as e:
+                logger.error(f"Snapshot listener failed: {e}")
+        return self.snapshot
+
+    async def _run(self):
+        while True:
+            try:
+                with trace('background_scan'):
+                    await self.scan_once()
+            except Exception as e:
+                logger.error(f"Background scan failed: {e}")
+
+            # Ждем закрытия следующей свечи и небольшую паузу на ее финализацию
+            now_ms = int(time.time() * 1000)
+            wait = (next_candle_close(self.interval, now_ms) - now_ms) / 1000 + self.delay
+            await asyncio.sleep(wait)
+
+    def start(self):
+        """Запускает фоновое сканирование в текущем event loop"""
+        if self.interval not in INTERVAL_MS:
+            raise ValueError(f"Unsupported scan interval: {self.interval}")
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
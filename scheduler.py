@@ -0,0 +1,190 @@
+import asyncio
+import time
+import logging
+from collections import OrderedDict, deque
+from config import SCHEDULER_WORKERS, SCHEDULER_MAX_WAIT, SCHEDULER_MAX_USER_JOBS
+from tracing import span
+from metrics import SCHEDULER_WAIT, SCHEDULER_SHED, SCHEDULER_QUEUE
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: меньше - важнее. Анализ одного тикера дешевый и
+# интерактивный, сканирование по кнопке тяжелое.
+PRIORITY_TICKER = 0
+PRIORITY_SCAN = 1
+PRIORITY_NAMES = {PRIORITY_TICKER: 'ticker', PRIORITY_SCAN: 'scan'}
+
+# Начальная оценка длительности задачи класса (с), дальше - скользящее среднее
+INITIAL_SERVICE_TIME = {PRIORITY_TICKER: 1.0, PRIORITY_SCAN: 10.0}
+
+
+class SchedulerBusy(Exception):
+    """Задача не принята или снята: ожидание в очереди превысило бы срок"""
+
+
+class DuplicateJob(Exception):
+    """Такой же запрос этого пользователя уже в очереди или выполняется"""
+
+
+class _Job:
+    __slots__ = ('user_id', 'priority', 'enqueued', 'future')
+
+    def __init__(self, user_id, priority, future):
+        self.user_id = user_id
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.future = future
+
+
+class JobScheduler:
+    """Очередь тяжелых запросов пользователей с ограниченным числом исполнителей.
+
+    Одновременно выполняется не больше workers задач. Свободный слот
+    получает задача самого важного класса, а внутри класса пользователи
+    обслуживаются по кругу, поэтому серия нажатий одного пользователя не
+    задерживает остальных. Повторный такой же запрос пользователя
+    отклоняется, пока первый не завершился. Если ожидание в очереди
+    превысило бы max_wait секунд, задача отклоняется сразу, а задача,
+    прождавшая max_wait, снимается из очереди, даже если слоты не
+    освобождаются.
+    """
+
+    def __init__(self, workers=SCHEDULER_WORKERS, max_wait=SCHEDULER_MAX_WAIT, max_user_jobs=SCHEDULER_MAX_USER_JOBS):
+        self.workers = workers
+        self.max_wait = max_wait
+        self.max_user_jobs = max_user_jobs
+        self.running = 0
+        # priority -> OrderedDict(user_id -> deque задач); порядок пользователей - круговой
+        self._queues = {priority: OrderedDict() for priority in PRIORITY_NAMES}
+        self._active = set()
+        self._user_jobs = {}
+        self._service_time = dict(INITIAL_SERVICE_TIME)
+
+    def queued(self, priority=None):
+        priorities = PRIORITY_NAMES if priority is None else (priority,)
+        return sum(len(jobs) for p in priorities for jobs in self._queues[p].values())
+
+    def estimated_wait(self, priority):
+        """Оценка ожидания новой задачи класса: работа впереди нее, деленная на исполнителей"""
+        if self.running < self.workers and not self.queued():
+            return 0.0
+        ahead = sum(self.queued(p) * self._service_time[p] for p in PRIORITY_NAMES if p <= priority)
+        return ahead / self.workers
+
+    async def run(self, user_id, key, priority, factory, queue=True):
+        """Выполняет factory() в свободном слоте и возвращает ее результат.
+
+        queue=False - задача без слота (например, ожидание уже идущего
+        общего вычисления), но с защитой от повторов.
+        """
+        job_key = (user_id, key)
+        if job_key in self._active:
+            raise DuplicateJob(key)
+        if not queue:
+            self._active.add(job_key)
+            try:
+                return await factory()
+            finally:
+                self._active.discard(job_key)
+
+        name = PRIORITY_NAMES[priority]
+        if self._user_jobs.get(user_id, 0) >= self.max_user_jobs or self.estimated_wait(priority) > self.max_wait:
+            SCHEDULER_SHED.labels(name, 'admission').inc()
+            logger.info(f"Rejected {name} job {key} from user {user_id}: scheduler is busy")
+            raise SchedulerBusy(key)
+
+        job = _Job(user_id, priority, asyncio.get_running_loop().create_future())
+        self._active.add(job_key)
+        self._user_jobs[user_id] = self._user_jobs.get(user_id, 0) + 1
+        try:
+            self._queues[priority].setdefault(user_id, deque()).append(job)
+            self._update_gauges()
+            self._dispatch()
+            with span('scheduler.wait', priority=name):
+                try:
+                    await asyncio.wait_for(asyncio.shield(job.future), self.max_wait)
+                except asyncio.TimeoutError:
+                    if not job.future.done():
+                        job.future.cancel()
+                        self._discard(job)
+                        SCHEDULER_SHED.labels(name, 'deadline').inc()
+                        logger.info(f"Dropped {name} job of user {user_id} after {self.max_wait:.1f}s in queue")
+                        raise SchedulerBusy(key) from None
+                    # Слот выдан (или задача снята) одновременно с истечением срока
+                    job.future.result()
+                except asyncio.CancelledError:
+                    if not job.future.done():
+                        job.future.cancel()
+                        self._discard(job)
+                    elif not job.future.cancelled() and job.future.exception() is None:
+                        # Слот был выдан одновременно с отменой
+                        self._release()
+                    raise
+
+            started = time.monotonic()
+            try:
+                return await factory()
+            finally:
+                elapsed = time.monotonic() - started
+                self._service_time[priority] = 0.8 * self._service_time[priority] + 0.2 * elapsed
+                self._release()
+        finally:
+            self._active.discard(job_key)
+            self._user_jobs[user_id] -= 1
+            if not self._user_jobs[user_id]:
+                del self._user_jobs[user_id]
+
+    def _discard(self, job):
+        users = self._queues[job.priority]
+        jobs = users.get(job.user_id)
+        if jobs and job in jobs:
+            jobs.remove(job)
+            if not jobs:
+                del users[job.user_id]
+        self._update_gauges()
+
+    def _release(self):
+        self.running -= 1
+        self._dispatch()
+
+    def _next_job(self):
+        """Следующая задача: самый важный класс, следующий по кругу пользователь"""
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            while users:
+                user_id, jobs = next(iter(users.items()))
+                job = jobs.popleft()
+                if jobs:
+                    users.move_to_end(user_id)
+                else:
+                    del users[user_id]
+                if not job.future.done():
+                    return job
+        return None
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self.running < self.workers:
+            job = self._next_job()
+            if job is None:
+                break
+            waited = now - job.enqueued
+            name = PRIORITY_NAMES[job.priority]
+            if waited > self.max_wait:
+                SCHEDULER_SHED.labels(name, 'deadline').inc()
+                logger.info(f"Dropped {name} job of user {job.user_id} after {waited:.1f}s in queue")
+                job.future.set_exception(SchedulerBusy(name))
+                continue
+            SCHEDULER_WAIT.labels(name).observe(waited)
+            self.running += 1
+            job.future.set_result(None)
+        self._update_gauges()
+
+    def _update_gauges(self):
+        for priority, name in PRIORITY_NAMES.items():
+            SCHEDULER_QUEUE.labels(name).set(self.queued(priority))
+
+
+# Планировщик анализов по запросам пользователей
+job_scheduler = JobScheduler()
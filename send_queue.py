@@ -0,0 +1,140 @@
+import asyncio
+import heapq
+import time
+import logging
+from collections import deque
+from telegram.error import Forbidden, RetryAfter, TelegramError
+from config import TELEGRAM_SEND_RATE, TELEGRAM_CHAT_INTERVAL, TELEGRAM_SEND_CONCURRENCY
+from rate_limit import TokenBucket
+from subscriptions import subscription_store
+from metrics import telegram_call
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+
+class SendQueue:
+    """Очередь исходящих сообщений с лимитами Telegram.
+
+    Общий лимит (около 30 сообщений в секунду на бота) соблюдает корзина
+    токенов, а сообщения одного чата уходят по очереди и не чаще раза в
+    chat_interval секунд. У каждого чата своя очередь, поэтому чат с
+    длинной очередью не задерживает остальных.
+    """
+
+    def __init__(self, rate=TELEGRAM_SEND_RATE, chat_interval=TELEGRAM_CHAT_INTERVAL,
+                 concurrency=TELEGRAM_SEND_CONCURRENCY, on_blocked=None):
+        self.chat_interval = chat_interval
+        self.on_blocked = on_blocked
+        self._bucket = TokenBucket(rate, rate)
+        self._slots = asyncio.Semaphore(concurrency)
+        self._chats = {}
+        self._ready = []
+        self._next_allowed = {}
+        self._sequence = 0
+        self._wakeup = asyncio.Event()
+        self._bot = None
+        self._task = None
+        self._sending = set()
+        self.sent = 0
+        self.failed = 0
+
+    def send(self, chat_id, text, **kwargs):
+        """Ставит сообщение в очередь чата"""
+        messages = self._chats.get(chat_id)
+        if messages is None:
+            messages = deque()
+            self._chats[chat_id] = messages
+            self._schedule(chat_id, self._next_allowed.get(chat_id, 0.0))
+        messages.append((text, kwargs))
+
+    def _schedule(self, chat_id, ready_at):
+        self._sequence += 1
+        heapq.heappush(self._ready, (ready_at, self._sequence, chat_id))
+        self._wakeup.set()
+
+    def __len__(self):
+        return sum(len(messages) for messages in self._chats.values())
+
+    async def _run(self):
+        while True:
+            if not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Ждем, пока чат с ближайшим временем станет доступен (или появится новый)
+            delay = self._ready[0][0] - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            await self._bucket.acquire()
+            await self._slots.acquire()
+            task = asyncio.create_task(self._deliver(chat_id))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _deliver(self, chat_id):
+        """Отправляет первое сообщение чата и ставит чат обратно в очередь"""
+        messages = self._chats.get(chat_id)
+        try:
+            if not messages:
+                return
+            text, kwargs = messages[0]
+            delay = self.chat_interval
+            try:
+                await telegram_call('send_message', self._bot.send_message, chat_id, text, **kwargs)
+                messages.popleft()
+                self.sent += 1
+            except RetryAfter as e:
+                # Сообщение остается первым в очереди чата
+                logger.warning(f"Telegram asked to retry chat {chat_id} after {e.retry_after}s")
+                delay = max(delay, float(e.retry_after))
+            except Forbidden:
+                logger.info(f"Chat {chat_id} blocked the bot, dropping its messages")
+                self.failed += len(messages)
+                messages.clear()
+                if self.on_blocked is not None:
+                    self.on_blocked(chat_id)
+            except TelegramError as e:
+                logger.error(f"Failed to send message to chat {chat_id}: {e}")
+                messages.popleft()
+                self.failed += 1
+            except Exception as e:
+                # Любая другая ошибка не должна навсегда остановить очередь чата
+                logger.error(f"Unexpected error sending message to chat {chat_id}: {e}")
+                messages.popleft()
+                self.failed += 1
+
+            next_allowed = time.monotonic() + delay
+            self._next_allowed[chat_id] = next_allowed
+            if messages:
+                self._schedule(chat_id, next_allowed)
+            else:
+                del self._chats[chat_id]
+        finally:
+            self._slots.release()
+
+    def start(self, bot):
+        """Запускает отправку сообщений через бота в текущем event loop"""
+        self._bot = bot
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, *self._sending, return_exceptions=True)
+            self._task = None
+        if len(self):
+            logger.warning(f"Send queue stopped with {len(self)} undelivered messages")
+
+
+# Общая очередь отправки; чаты, заблокировавшие бота, теряют подписки
+send_queue = SendQueue(on_blocked=subscription_store.remove_chat)
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from tracing import span
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """Одно выполняющееся вычисление и его слушатели"""
+
+    __slots__ = ('task', 'listeners', 'last_event')
+
+    def __init__(self):
+        self.task = None
+        self.listeners = []
+        self.last_event = None
+
+
+class SingleFlight:
+    """Объединяет одновременные одинаковые вычисления в одно.
+
+    Все, кто вызвал do() с одним ключом, пока вычисление идет, ждут один и
+    тот же результат. Вычисление получает emit(event) и может сообщать о
+    ходе работы: событие получают все слушатели, а подключившийся позже
+    сразу получает последнее событие.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.started = 0
+        self.shared = 0
+
+    def __contains__(self, key):
+        return key in self._flights
+
+    async def do(self, key, factory, listener=None):
+        """Запускает factory(emit) или присоединяется к уже идущему вычислению с тем же ключом"""
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if not shared:
+            flight = self._start(key, factory)
+        else:
+            self.shared += 1
+            logger.debug(f"Joined in-flight computation {key}")
+
+        if listener is not None:
+            flight.listeners.append(listener)
+            if flight.last_event is not None:
+                await self._notify(listener, flight.last_event)
+
+        try:
+            # shield: отмена одного ожидающего не отменяет общее вычисление;
+            # этапы общего вычисления попадают в трассировку того, кто его начал
+            with span('singleflight.wait', key=str(key), shared=shared):
+                return await asyncio.shield(flight.task)
+        finally:
+            if listener is not None and listener in flight.listeners:
+                flight.listeners.remove(listener)
+
+    def _start(self, key, factory):
+        flight = _Flight()
+        self._flights[key] = flight
+        self.started += 1
+
+        async def emit(event):
+            flight.last_event = event
+            if flight.listeners:
+                await asyncio.gather(*(self._notify(listener, event) for listener in list(flight.listeners)))
+
+        def finished(task):
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            # Забираем исключение, даже если все ожидающие уже ушли
+            if not task.cancelled():
+                task.exception()
+
+        flight.task = asyncio.ensure_future(factory(emit))
+        flight.task.add_done_callback(finished)
+        return flight
+
+    @staticmethod
+    async def _notify(listener, event):
+        try:
+            await listener(event)
+        except Exception as e:
+            logger.debug(f"Progress listener failed: {e}")
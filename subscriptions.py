@@ -0,0 +1,115 @@
+import os
+import json
+import logging
+from config import SUBSCRIPTIONS_FILE
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Темы-направления; все остальные темы - символы вида BTCUSDT
+DIRECTIONS = ('long', 'short')
+
+
+class SubscriptionStore:
+    """Подписки чатов с индексом по темам.
+
+    Тема - символ (BTCUSDT) или направление (long/short). Индекс тема -> чаты
+    позволяет движку оповещений считать сигнал один раз на тему, а не на
+    подписчика. Подписки сохраняются в JSON-файл и переживают перезапуск.
+    """
+
+    def __init__(self, path=SUBSCRIPTIONS_FILE):
+        self.path = path
+        self._by_topic = {}
+        self._by_chat = {}
+
+    def load(self):
+        """Загружает подписки из файла, если он есть"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load subscriptions from {self.path}: {e}")
+            return
+
+        for chat_id, topics in data.items():
+            for topic in topics:
+                self._index(int(chat_id), topic)
+        logger.info(f"Loaded {len(self._by_chat)} subscribed chats, {len(self._by_topic)} topics")
+
+    def save(self):
+        """Атомарно записывает подписки в файл"""
+        if not self.path:
+            return
+        data = {str(chat_id): sorted(topics) for chat_id, topics in self._by_chat.items()}
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Could not save subscriptions to {self.path}: {e}")
+
+    def _index(self, chat_id, topic):
+        chats = self._by_topic.setdefault(topic, set())
+        if chat_id in chats:
+            return False
+        chats.add(chat_id)
+        self._by_chat.setdefault(chat_id, set()).add(topic)
+        return True
+
+    def add(self, chat_id, topic):
+        """Подписывает чат на тему; False, если подписка уже была"""
+        added = self._index(chat_id, topic)
+        if added:
+            self.save()
+        return added
+
+    def remove(self, chat_id, topic):
+        """Отписывает чат от темы; False, если подписки не было"""
+        chats = self._by_topic.get(topic)
+        if not chats or chat_id not in chats:
+            return False
+        chats.discard(chat_id)
+        if not chats:
+            del self._by_topic[topic]
+        topics = self._by_chat[chat_id]
+        topics.discard(topic)
+        if not topics:
+            del self._by_chat[chat_id]
+        self.save()
+        return True
+
+    def remove_chat(self, chat_id):
+        """Удаляет все подписки чата (например, если бот заблокирован)"""
+        topics = self._by_chat.pop(chat_id, set())
+        for topic in topics:
+            chats = self._by_topic.get(topic)
+            if chats is not None:
+                chats.discard(chat_id)
+                if not chats:
+                    del self._by_topic[topic]
+        if topics:
+            self.save()
+        return len(topics)
+
+    def topics(self, chat_id):
+        """Темы, на которые подписан чат"""
+        return sorted(self._by_chat.get(chat_id, ()))
+
+    def subscribers(self, topic):
+        """Чаты, подписанные на тему"""
+        return tuple(self._by_topic.get(topic, ()))
+
+    def symbols(self):
+        """Символы, на которые есть хотя бы одна подписка"""
+        return [topic for topic in self._by_topic if topic not in DIRECTIONS]
+
+    def __len__(self):
+        return len(self._by_chat)
+
+
+# Общее хранилище подписок на весь процесс
+subscription_store = SubscriptionStore()
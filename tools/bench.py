@@ -0,0 +1,307 @@
+"""Бенчмарки бота против локального fake Bybit (tools/fake_bybit.py).
+
+Запуск с синтетическими данными, задержкой 50 мс и 1% ответов 429:
+    python tools/bench.py --latency 0.05 --rate-429 0.01 --output bench.json
+
+Сравнение с прошлым прогоном (код выхода 1 при регрессии p50 больше порога):
+    python tools/bench.py --output bench_new.json --compare bench.json --threshold 0.15
+
+Для каждого бенчмарка печатаются p50/p95/p99 (мс) и число запросов к Bybit
+на итерацию; JSON с результатами пригоден для сравнения между версиями.
+Сквозные сценарии проверяют ответ обработчика и обращения к Bybit: если
+итерация вернула ошибку вместо сигнала, прогон завершается с кодом 1 -
+иначе упавший обработчик выглядел бы как ускорение.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import platform
+import argparse
+import subprocess
+import httpx
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, port):
+    """Запускает fake Bybit в отдельном процессе и ждет, пока он начнет отвечать"""
+    command = [
+        sys.executable, os.path.join(ROOT, 'tools', 'fake_bybit.py'), 'serve',
+        '--port', str(port), '--latency', str(args.latency), '--jitter', str(args.jitter),
+        '--rate-429', str(args.rate_429), '--symbols', str(args.symbols)
+    ]
+    if args.payloads:
+        command += ['--payloads', args.payloads]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            httpx.get(f"{url}/__stats", timeout=1)
+            return process, url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("fake Bybit did not start")
+
+
+def summarize(samples, requests=0, throttled=0):
+    """Перцентили в миллисекундах и запросы к Bybit на итерацию"""
+    values = np.array(samples) * 1000
+    return {
+        'iterations': len(samples),
+        'p50_ms': round(float(np.percentile(values, 50)), 4),
+        'p95_ms': round(float(np.percentile(values, 95)), 4),
+        'p99_ms': round(float(np.percentile(values, 99)), 4),
+        'mean_ms': round(float(values.mean()), 4),
+        'requests_per_iteration': round(requests / len(samples), 2),
+        'throttled_per_iteration': round(throttled / len(samples), 2)
+    }
+
+
+class Bench:
+    def __init__(self, url, iterations):
+        self.url = url
+        self.iterations = iterations
+        self.results = {}
+        self.failures = []
+
+    def server_stats(self, reset=False):
+        if reset:
+            httpx.get(f"{self.url}/__reset")
+            return None
+        return httpx.get(f"{self.url}/__stats").json()
+
+    def report(self, name, samples):
+        stats = self.server_stats()
+        self.results[name] = summarize(samples, stats['total'], stats['throttled'])
+        row = self.results[name]
+        print(f"{name:<32} p50 {row['p50_ms']:>10.3f}  p95 {row['p95_ms']:>10.3f}  p99 {row['p99_ms']:>10.3f} ms"
+              f"  req/it {row['requests_per_iteration']:>6}  429/it {row['throttled_per_iteration']}", flush=True)
+
+    def micro(self, name, func, iterations=None):
+        """Синхронная функция: каждая итерация замеряется отдельно"""
+        self.server_stats(reset=True)
+        samples = []
+        for _ in range(iterations or self.iterations * 20):
+            started = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - started)
+        self.report(name, samples)
+
+    async def e2e(self, name, func, setup=None, iterations=None, check=None, expect_requests=False):
+        """Корутина целиком, с сетью; setup() перед итерацией не замеряется.
+
+        check(result) возвращает текст ошибки или None; expect_requests -
+        каждая итерация должна обратиться к fake Bybit. Нарушения
+        записываются в failures.
+        """
+        self.server_stats(reset=True)
+        samples = []
+        errors = []
+        for _ in range(iterations or self.iterations):
+            if setup is not None:
+                setup()
+            before = self.server_stats()['total'] if expect_requests else 0
+            started = time.perf_counter()
+            result = await func()
+            samples.append(time.perf_counter() - started)
+            problems = []
+            if check is not None and (error := check(result)):
+                problems.append(error)
+            if expect_requests and self.server_stats()['total'] == before:
+                problems.append('no requests to Bybit')
+            if problems:
+                errors.append('; '.join(problems))
+        self.report(name, samples)
+        if errors:
+            self.failures.append((name, errors[0]))
+            print(f"{name:<32} FAILED in {len(errors)} iterations: {errors[0]}", flush=True)
+
+
+class FakeMessage:
+    """Сообщение Telegram без сети: бенчмарк меряет только работу бота"""
+    chat_id = 1
+
+    async def reply_text(self, text, **kwargs):
+        return FakeMessage()
+
+    async def edit_text(self, text, **kwargs):
+        return self
+
+    async def delete(self):
+        return True
+
+
+class FakeUser:
+    id = 1
+
+
+class FakeUpdate:
+    def __init__(self):
+        self.message = FakeMessage()
+        self.effective_user = FakeUser()
+
+
+def expect_signal(text):
+    """Ответ обработчика должен содержать хотя бы один сигнал"""
+    if not isinstance(text, str) or '*Риск/Прибыль:*' not in text:
+        return f"no signal in reply: {str(text)[:120]!r}"
+    return None
+
+
+def expect_klines(klines):
+    return None if klines else 'no candles returned'
+
+
+async def run_benchmarks(bench, symbols):
+    # Модули бота импортируются после того, как BYBIT_API_URL указывает на fake Bybit
+    import analysis
+    import indicators
+    from candles import CandleSeries
+    from kline_cache import kline_cache
+    from candles import candle_store
+    from instruments import instrument_registry
+    from bybit_client import bybit_client
+
+    def cold():
+        kline_cache.clear()
+        candle_store.clear()
+        analysis.market_scanner.snapshot = None
+
+    await instrument_registry.load()
+    symbol = symbols[0]
+    ticker = symbol[:-4]
+
+    # Микробенчмарки на данных одного символа
+    rows = await analysis.fetch_kline_rows(symbol, '1h', 1000)
+    series = CandleSeries.from_bybit(symbol, '1h', rows)
+    columns = indicators.as_ohlcv(series)
+    daily = indicators.as_ohlcv(await analysis.fetch_klines(symbol, '1d', 200))
+    bench.micro('parse_klines_1000', lambda: CandleSeries.from_bybit(symbol, '1h', rows))
+    bench.micro('as_ohlcv_1000', lambda: indicators.as_ohlcv(series))
+    bench.micro('sma_200', lambda: indicators.sma(daily.close, 200))
+    bench.micro('rsi_14', lambda: indicators.rsi(columns.close, 14))
+    bench.micro('support_resistance', lambda: indicators.support_resistance(columns.low, columns.high, columns.low, columns.high))
+
+    loaded = [item for item in await asyncio.gather(*(analysis.fetch_pair_klines(s) for s in symbols[:50])) if item]
+    bench.micro('evaluate_batch_50', lambda: analysis.evaluate_batch(loaded), iterations=bench.iterations * 5)
+
+    # Сквозные сценарии через HTTP
+    await bench.e2e('get_klines_cold', lambda: analysis.get_klines(symbol, '1h', 50), setup=cold,
+                    check=expect_klines, expect_requests=True)
+    await bench.e2e('get_klines_incremental', lambda: analysis.get_klines(symbol, '1h', 50), setup=kline_cache.clear,
+                    check=expect_klines, expect_requests=True)
+    await bench.e2e('get_klines_cached', lambda: analysis.get_klines(symbol, '1h', 50), iterations=bench.iterations * 20,
+                    check=expect_klines)
+    await bench.e2e('analyze_ticker_cold', lambda: analysis.analyze_ticker(ticker, FakeUpdate()), setup=cold,
+                    check=expect_signal, expect_requests=True)
+    await bench.e2e('analyze_ticker_cached', lambda: analysis.analyze_ticker(ticker, FakeUpdate()), check=expect_signal)
+    await bench.e2e('get_best_signals_scan', lambda: analysis.get_best_signals('long', FakeUpdate()),
+                    setup=cold, iterations=max(bench.iterations // 5, 3), check=expect_signal, expect_requests=True)
+    await bench.e2e('background_scan_once', analysis.market_scanner.scan_once,
+                    setup=cold, iterations=max(bench.iterations // 5, 3),
+                    check=lambda snapshot: None if snapshot and snapshot.pairs_scanned else 'empty snapshot',
+                    expect_requests=True)
+
+    await bybit_client.close()
+
+
+def compare(results, baseline, threshold):
+    """Печатает изменение p50/p95 относительно прошлого прогона; True, если есть регрессия"""
+    regressed = False
+    print("\nComparison with baseline (p50 / p95):")
+    for name, row in results.items():
+        old = baseline.get('benchmarks', {}).get(name)
+        if not old:
+            continue
+        deltas = [(row[key] - old[key]) / old[key] if old[key] else 0.0 for key in ('p50_ms', 'p95_ms')]
+        flag = ''
+        if deltas[0] > threshold:
+            flag = '  REGRESSION'
+            regressed = True
+        print(f"{name:<32} {deltas[0]:>+8.1%} {deltas[1]:>+8.1%}{flag}")
+    return regressed
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='уже запущенный fake Bybit (иначе запускается свой)')
+    parser.add_argument('--payloads', help='каталог с записанными ответами Bybit')
+    parser.add_argument('--symbols', type=int, default=60)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.005)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--output', help='файл для JSON с результатами')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.10, help='допустимый рост p50')
+    parser.add_argument('--log-level', default='ERROR', help='уровень логов бота во время прогона')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+
+    process = None
+    url = args.url
+    if url is None:
+        process, url = start_server(args, free_port())
+    os.environ['BYBIT_API_URL'] = url
+    sys.path.insert(0, ROOT)
+
+    try:
+        symbols = [item['symbol'] for item in httpx.get(
+            f"{url}/v5/market/tickers", params={'category': 'spot'}).json()['result']['list']]
+        httpx.get(f"{url}/__reset")
+        bench = Bench(url, args.iterations)
+        asyncio.run(run_benchmarks(bench, symbols))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    output = {
+        'meta': {
+            'revision': git_revision(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'latency': args.latency,
+            'jitter': args.jitter,
+            'rate_429': args.rate_429,
+            'iterations': args.iterations
+        },
+        'benchmarks': bench.results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=2)
+
+    if bench.failures:
+        print(f"\n{len(bench.failures)} benchmarks produced wrong results: "
+              + ", ".join(name for name, _ in bench.failures))
+        sys.exit(1)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(bench.results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
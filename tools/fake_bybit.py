@@ -0,0 +1,266 @@
+"""Локальная замена REST API Bybit для бенчмарков и отладки.
+
+Запись ответов настоящего Bybit:
+    python tools/fake_bybit.py record payloads --symbols BTCUSDT ETHUSDT --limit 1000
+
+Запуск сервера (BYBIT_API_URL=http://127.0.0.1:8766):
+    python tools/fake_bybit.py serve --payloads payloads --latency 0.05 --jitter 0.02 --rate-429 0.01
+
+Без --payloads сервер отдает детерминированные синтетические свечи для
+--symbols пар. Эндпоинты: /v5/market/kline (limit, start, end),
+/v5/market/tickers, /v5/market/instruments-info. Служебные: GET /__stats -
+счетчики запросов и отданных 429, GET /__reset - обнулить счетчики.
+"""
+import os
+import json
+import math
+import time
+import zlib
+import random
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import httpx
+
+BYBIT_API_URL = 'https://api.bybit.com'
+INTERVAL_MS = {'60': 60 * 60 * 1000, '240': 4 * 60 * 60 * 1000, 'D': 24 * 60 * 60 * 1000}
+
+# Сколько свечей синтетической истории доступно по каждому интервалу
+SYNTHETIC_HISTORY = 1500
+
+
+def synthetic_candle(symbol, interval, start):
+    """Детерминированная свеча: одинаковая при любом запросе одного и того же времени"""
+    seed = zlib.crc32(f"{symbol}:{interval}:{start}".encode())
+    rnd = random.Random(seed)
+    phase = zlib.crc32(symbol.encode()) % 1000
+    base = 100 * (1 + 0.3 * math.sin(start / 2e10 + phase)) * (1 + 0.05 * math.sin(start / 1e9 + phase))
+    open_ = base * (1 + rnd.uniform(-0.01, 0.01))
+    close = base * (1 + rnd.uniform(-0.01, 0.01))
+    high = max(open_, close) * (1 + rnd.uniform(0, 0.02))
+    low = min(open_, close) * (1 - rnd.uniform(0, 0.02))
+    return [str(start), f"{open_:.4f}", f"{high:.4f}", f"{low:.4f}", f"{close:.4f}", "1000", f"{1000 * close:.2f}"]
+
+
+class FakeBybit:
+    """Ответы Bybit из записанных файлов или синтетические, с задержкой и 429"""
+
+    def __init__(self, payloads=None, symbols=60, latency=0.0, jitter=0.0, rate_429=0.0, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.klines = {}
+        self.tickers = None
+        self.instruments = None
+        if payloads:
+            self._load(payloads)
+        else:
+            self.symbols = [f"SYN{i}USDT" for i in range(symbols)]
+        self.reset()
+
+    def _load(self, path):
+        for name in os.listdir(path):
+            with open(os.path.join(path, name), encoding='utf-8') as f:
+                payload = json.load(f)
+            if name.startswith('kline_'):
+                _, symbol, interval = name[:-len('.json')].split('_')
+                self.klines[(symbol, interval)] = payload['result']['list']
+            elif name == 'tickers.json':
+                self.tickers = payload
+            elif name == 'instruments.json':
+                self.instruments = payload
+        self.symbols = sorted({symbol for symbol, _ in self.klines})
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+            self.throttled = 0
+
+    def stats(self):
+        with self._lock:
+            return {'requests': dict(self.requests), 'total': sum(self.requests.values()), 'throttled': self.throttled}
+
+    def handle(self, path, query):
+        """Возвращает (status, headers, body) на запрос"""
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            throttle = self.rate_429 and self._random.random() < self.rate_429
+            delay = max(self.latency + self._random.uniform(-self.jitter, self.jitter), 0.0)
+            if throttle:
+                self.throttled += 1
+        if delay:
+            time.sleep(delay)
+
+        reset_ms = int(time.time() * 1000) + 200
+        if throttle:
+            headers = {'X-Bapi-Limit-Status': '0', 'X-Bapi-Limit-Reset-Timestamp': str(reset_ms)}
+            return 429, headers, {'retCode': 10006, 'retMsg': 'Too many visits!'}
+
+        headers = {'X-Bapi-Limit-Status': '100', 'X-Bapi-Limit-Reset-Timestamp': str(reset_ms)}
+        if path == '/v5/market/kline':
+            body = self._kline(query)
+        elif path == '/v5/market/tickers':
+            body = self.tickers or self._synthetic_tickers()
+        elif path == '/v5/market/instruments-info':
+            body = self._instruments(query)
+        else:
+            return 404, {}, {'retCode': 10001, 'retMsg': 'Unknown path'}
+        return 200, headers, body
+
+    def _kline(self, query):
+        symbol = query.get('symbol', '')
+        interval = query.get('interval', '60')
+        limit = min(int(query.get('limit', 200)), 1000)
+        start = int(query['start']) if 'start' in query else None
+        end = int(query['end']) if 'end' in query else None
+
+        if self.klines:
+            rows = self.klines.get((symbol, interval))
+            if rows is None:
+                return {'retCode': 10001, 'retMsg': 'Not supported symbols'}
+        else:
+            if symbol not in self.symbols or interval not in INTERVAL_MS:
+                return {'retCode': 10001, 'retMsg': 'Not supported symbols'}
+            step = INTERVAL_MS[interval]
+            last = int(time.time() * 1000) // step * step
+            first = last - (SYNTHETIC_HISTORY - 1) * step
+            newest = last if end is None else min(last, end // step * step)
+            oldest = max(first, newest - (limit - 1) * step)
+            if start is not None:
+                oldest = max(oldest, -(-start // step) * step)
+            rows = [synthetic_candle(symbol, interval, ts) for ts in range(newest, oldest - 1, -step)]
+            return {'retCode': 0, 'retMsg': 'OK', 'result': {'symbol': symbol, 'category': 'spot', 'list': rows}}
+
+        # Записанные свечи идут от новых к старым
+        selected = [row for row in rows
+                    if (start is None or int(row[0]) >= start) and (end is None or int(row[0]) <= end)]
+        return {'retCode': 0, 'retMsg': 'OK', 'result': {'symbol': symbol, 'category': 'spot', 'list': selected[:limit]}}
+
+    def _synthetic_tickers(self):
+        items = []
+        for rank, symbol in enumerate(self.symbols):
+            last = synthetic_candle(symbol, '60', int(time.time() * 1000) // INTERVAL_MS['60'] * INTERVAL_MS['60'])
+            price = float(last[4])
+            items.append({
+                'symbol': symbol,
+                'lastPrice': f"{price:.4f}",
+                'highPrice24h': f"{price * 1.04:.4f}",
+                'lowPrice24h': f"{price * 0.96:.4f}",
+                'prevPrice24h': f"{price * 0.99:.4f}",
+                'price24hPcnt': '0.0101',
+                'volume24h': str(1_000_000 - rank * 1000),
+                'turnover24h': f"{price * (1_000_000 - rank * 1000):.2f}"
+            })
+        return {'retCode': 0, 'retMsg': 'OK', 'result': {'category': 'spot', 'list': items}}
+
+    def _instruments(self, query):
+        if self.instruments is not None:
+            items = self.instruments['result']['list']
+        else:
+            items = [{
+                'symbol': symbol,
+                'baseCoin': symbol[:-4],
+                'quoteCoin': 'USDT',
+                'status': 'Trading',
+                'priceFilter': {'tickSize': '0.0001'},
+                'lotSizeFilter': {'basePrecision': '0.01', 'minOrderQty': '0.01'}
+            } for symbol in self.symbols]
+        if 'symbol' in query:
+            items = [item for item in items if item['symbol'] == query['symbol']]
+        return {'retCode': 0, 'retMsg': 'OK', 'result': {'category': 'spot', 'list': items, 'nextPageCursor': ''}}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        fake = self.server.fake
+        if url.path == '/__stats':
+            status, headers, body = 200, {}, fake.stats()
+        elif url.path == '/__reset':
+            fake.reset()
+            status, headers, body = 200, {}, {'ok': True}
+        else:
+            status, headers, body = fake.handle(url.path, query)
+
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент отменил запрос (например, сканирование уже нашло сигналы)
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(fake, host='127.0.0.1', port=8766):
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.fake = fake
+    return server
+
+
+def record(path, symbols, limit, url=BYBIT_API_URL):
+    """Сохраняет ответы настоящего Bybit для последующего воспроизведения"""
+    os.makedirs(path, exist_ok=True)
+    with httpx.Client(base_url=url, timeout=15) as client:
+        def save(name, endpoint, params):
+            response = client.get(endpoint, params=params)
+            response.raise_for_status()
+            with open(os.path.join(path, name), 'w', encoding='utf-8') as f:
+                json.dump(response.json(), f)
+
+        save('tickers.json', '/v5/market/tickers', {'category': 'spot'})
+        save('instruments.json', '/v5/market/instruments-info', {'category': 'spot', 'limit': 1000})
+        for symbol in symbols:
+            for interval in INTERVAL_MS:
+                save(f"kline_{symbol}_{interval}.json", '/v5/market/kline',
+                     {'category': 'spot', 'symbol': symbol, 'interval': interval, 'limit': limit})
+    print(f"Recorded {len(symbols)} symbols to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = commands.add_parser('record')
+    record_parser.add_argument('path')
+    record_parser.add_argument('--symbols', nargs='+', default=['BTCUSDT', 'ETHUSDT'])
+    record_parser.add_argument('--limit', type=int, default=1000)
+
+    serve_parser = commands.add_parser('serve')
+    serve_parser.add_argument('--payloads', help='каталог с записанными ответами')
+    serve_parser.add_argument('--symbols', type=int, default=60, help='число синтетических пар')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8766)
+    serve_parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа, с')
+    serve_parser.add_argument('--jitter', type=float, default=0.0, help='разброс задержки, с')
+    serve_parser.add_argument('--rate-429', type=float, default=0.0, help='доля ответов 429')
+    serve_parser.add_argument('--seed', type=int, default=1)
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args.path, args.symbols, args.limit)
+        return
+
+    fake = FakeBybit(args.payloads, args.symbols, args.latency, args.jitter, args.rate_429, args.seed)
+    server = make_server(fake, args.host, args.port)
+    print(f"Serving fake Bybit ({len(fake.symbols)} symbols) on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""Локальная замена WebSocket Bybit: записывает и воспроизводит кадры.
+
+Запись кадров с настоящего Bybit:
+    python tools/ws_replay.py record frames.jsonl --symbols BTCUSDT ETHUSDT --seconds 120
+
+Воспроизведение для бота (BYBIT_WS_URL=ws://127.0.0.1:8765 MARKET_DATA_MODE=stream):
+    python tools/ws_replay.py serve frames.jsonl --port 8765 --speed 10
+
+Проверка переподключения потока на синтетических данных tools/fake_bybit.py
+(код выхода 1, если свечи потока после обрыва не совпали с REST):
+    python tools/ws_replay.py check
+
+Каждая строка файла: {"t": секунды от начала записи, "frame": сообщение Bybit}.
+Кадры идут по общим часам с первого подключения: пока клиент отключен,
+его кадры теряются, как на настоящей бирже.
+"""
+import os
+import sys
+import argparse
+import asyncio
+import json
+import math
+import logging
+import tempfile
+import threading
+import time
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BYBIT_WS_URL = 'wss://stream.bybit.com/v5/public/spot'
+
+
+def load_frames(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def record(path, symbols, intervals, seconds, url=BYBIT_WS_URL):
+    """Подписывается на топики Bybit и пишет все входящие кадры в файл"""
+    topics = [f"kline.{interval}.{symbol}" for symbol in symbols for interval in intervals]
+    topics += [f"tickers.{symbol}" for symbol in symbols]
+    started = time.monotonic()
+    count = 0
+    async with websockets.connect(url) as ws:
+        for i in range(0, len(topics), 10):
+            await ws.send(json.dumps({'op': 'subscribe', 'args': topics[i:i + 10]}))
+        with open(path, 'w', encoding='utf-8') as f:
+            while time.monotonic() - started < seconds:
+                try:
+                    raw = await asyncio.wait_for(ws.recv(), timeout=seconds)
+                except asyncio.TimeoutError:
+                    break
+                frame = json.loads(raw)
+                if 'topic' not in frame:
+                    continue
+                f.write(json.dumps({'t': round(time.monotonic() - started, 3), 'frame': frame}) + '\n')
+                count += 1
+    print(f"Recorded {count} frames to {path}")
+
+
+async def start_replay(frames, host, port, speed=1.0, loop=False, disconnect_after=None):
+    """Запускает WebSocket-сервер, рассылающий кадры подписанным клиентам с исходными паузами"""
+    clients = {}
+    replay_task = None
+
+    async def send(ws, frame):
+        client = clients.get(ws)
+        if client is None:
+            return
+        try:
+            await ws.send(json.dumps(frame))
+        except websockets.ConnectionClosed:
+            clients.pop(ws, None)
+            return
+        client['sent'] += 1
+        if disconnect_after and client['sent'] >= disconnect_after:
+            # Имитируем обрыв соединения для проверки переподключения
+            clients.pop(ws, None)
+            asyncio.create_task(ws.close())
+
+    async def replay():
+        while True:
+            previous = 0.0
+            for item in frames:
+                await asyncio.sleep(max(item['t'] - previous, 0) / speed)
+                previous = item['t']
+                topic = item['frame'].get('topic')
+                for ws, client in list(clients.items()):
+                    if topic in client['topics']:
+                        await send(ws, item['frame'])
+            if not loop:
+                return
+
+    async def handler(ws):
+        nonlocal replay_task
+        clients[ws] = {'topics': set(), 'sent': 0}
+        if replay_task is None:
+            replay_task = asyncio.create_task(replay())
+        try:
+            async for raw in ws:
+                message = json.loads(raw)
+                if message.get('op') == 'subscribe':
+                    if ws in clients:
+                        clients[ws]['topics'].update(message.get('args', []))
+                    await ws.send(json.dumps({'success': True, 'ret_msg': 'subscribe', 'op': 'subscribe'}))
+                elif message.get('op') == 'ping':
+                    await ws.send(json.dumps({'success': True, 'ret_msg': 'pong', 'op': 'ping'}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            clients.pop(ws, None)
+
+    return await websockets.serve(handler, host, port)
+
+
+async def serve(path, host, port, speed=1.0, loop=False, disconnect_after=None):
+    """Отдает записанные кадры подписанным клиентам"""
+    frames = load_frames(path)
+    await start_replay(frames, host, port, speed, loop, disconnect_after)
+    print(f"Replaying {len(frames)} frames on ws://{host}:{port}")
+    await asyncio.Future()
+
+
+def check_frames(symbol, now_ms):
+    """Кадры незакрытых свечей symbol для check.
+
+    0.3 и 0.6 с - промежуточные значения свечей 60/240/D и цена; 1.0 с -
+    итоговые значения, как их отдает fake Bybit по REST; дальше только
+    цены. Возвращает кадры и промежуточные цены закрытия по интервалам.
+    """
+    from fake_bybit import INTERVAL_MS, synthetic_candle
+
+    frames = []
+    partial = {}
+    for step, share in ((0.3, 0.3), (0.6, 0.6), (1.0, 1.0)):
+        for interval, interval_ms in INTERVAL_MS.items():
+            start = now_ms // interval_ms * interval_ms
+            _, open_, high, low, close, volume, turnover = (float(value) for value in synthetic_candle(symbol, interval, start))
+            if share < 1.0:
+                close = open_ + (close - open_) * share
+                high, low = max(open_, close), min(open_, close)
+                volume, turnover = volume * share, turnover * share
+                partial[interval] = close
+            frames.append({'t': step, 'frame': {
+                'topic': f"kline.{interval}.{symbol}",
+                'type': 'snapshot',
+                'ts': now_ms,
+                'data': [{
+                    'start': start, 'end': start + interval_ms - 1, 'interval': interval,
+                    'open': f"{open_:.4f}", 'close': f"{close:.4f}", 'high': f"{high:.4f}", 'low': f"{low:.4f}",
+                    'volume': f"{volume:.4f}", 'turnover': f"{turnover:.4f}", 'confirm': False, 'timestamp': now_ms
+                }]
+            }})
+        frames.append({'t': step, 'frame': {'topic': f"tickers.{symbol}", 'type': 'snapshot',
+                                            'data': {'symbol': symbol, 'lastPrice': f"{close:.4f}"}}})
+    for step in (3.0, 3.5):
+        frames.append({'t': step, 'frame': {'topic': f"tickers.{symbol}", 'type': 'snapshot',
+                                            'data': {'symbol': symbol, 'lastPrice': f"{close:.4f}"}}})
+    return frames, partial
+
+
+def same_candles(series, expected):
+    """Описание первого расхождения двух CandleSeries или None"""
+    if list(series.timestamp) != list(expected.timestamp):
+        return f"timestamps differ ({len(series)} vs {len(expected)} candles)"
+    for column in ('open', 'high', 'low', 'close', 'volume'):
+        for index, (value, other) in enumerate(zip(getattr(series, column), getattr(expected, column))):
+            if not math.isclose(value, other, rel_tol=1e-9):
+                return f"{column} of candle {series.timestamp[index]}: {value} vs {other}"
+    return None
+
+
+async def check(symbol='SYN0USDT', timeout=20.0):
+    """Обрыв посреди свечи: после переподключения и догрузки ряды совпадают с REST"""
+    from fake_bybit import FakeBybit, make_server
+
+    rest = make_server(FakeBybit(symbols=1), port=0)
+    threading.Thread(target=rest.serve_forever, daemon=True).start()
+    frames, partial = check_frames(symbol, int(time.time() * 1000))
+    ws_server = await start_replay(frames, '127.0.0.1', 0, disconnect_after=8)
+    ws_port = ws_server.sockets[0].getsockname()[1]
+
+    # Модули бота импортируются после того, как адреса указывают на заглушки
+    os.environ['BYBIT_API_URL'] = f"http://127.0.0.1:{rest.server_address[1]}"
+    os.environ['BYBIT_WS_URL'] = f"ws://127.0.0.1:{ws_port}"
+    os.environ['CANDLE_STORE_DIR'] = ''
+    sys.path.insert(0, ROOT)
+    import analysis
+    from candles import candle_store
+    from bybit_client import bybit_client
+
+    stream = analysis.market_stream
+    intervals = ('1h', '4h', '1d')
+    errors = []
+    stream.track([symbol])
+    stream.start()
+    try:
+        # Первое соединение обрывается после второго набора промежуточных кадров
+        started = time.monotonic()
+        while stream._ws is None or not all(stream.is_live(symbol, interval) for interval in intervals):
+            if time.monotonic() - started > timeout:
+                raise TimeoutError('stream did not become live')
+            await asyncio.sleep(0.05)
+        while stream._ws is not None:
+            if time.monotonic() - started > timeout:
+                raise TimeoutError('replay server did not disconnect the stream')
+            await asyncio.sleep(0.05)
+        for interval in intervals:
+            close = candle_store.get(symbol, interval).close[-1]
+            if not math.isclose(close, partial[analysis.BYBIT_INTERVALS[interval]], rel_tol=1e-6):
+                errors.append(f"{interval}: stream did not apply the partial candle before the disconnect")
+
+        # Итоговые кадры свечей уходят, пока клиента нет; их должна догрузить REST
+        while not all(stream.is_live(symbol, interval) for interval in intervals) or time.monotonic() - started < 4.0:
+            if time.monotonic() - started > timeout:
+                raise TimeoutError('stream did not reconnect')
+            await asyncio.sleep(0.05)
+
+        for interval in intervals:
+            expected = await analysis.fetch_klines(symbol, interval, len(candle_store.get(symbol, interval)))
+            error = same_candles(candle_store.get(symbol, interval), expected)
+            if error:
+                errors.append(f"{interval}: {error}")
+
+        data = {interval: await analysis.fetch_klines(symbol, interval, analysis.KLINE_LIMITS[interval]) for interval in intervals}
+        expected = (analysis.calculate_sma(data['1d'], 50), analysis.calculate_sma(data['1d'], 200),
+                    *analysis.get_support_resistance_levels(data['4h'], data['1h']))
+        trend = stream.trend(symbol)
+        if trend is None or not all(math.isclose(a, b, rel_tol=1e-9) for a, b in zip(trend, expected)):
+            errors.append(f"trend {trend} differs from REST {expected}")
+    finally:
+        await stream.stop()
+        await bybit_client.close()
+        ws_server.close()
+        rest.shutdown()
+
+    for error in errors:
+        print(f"FAILED {error}")
+    if not errors:
+        print(f"OK: {symbol} candles and trend after reconnect match REST")
+    return not errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = commands.add_parser('record')
+    record_parser.add_argument('path')
+    record_parser.add_argument('--symbols', nargs='+', default=['BTCUSDT'])
+    record_parser.add_argument('--intervals', nargs='+', default=['60', '240', 'D'])
+    record_parser.add_argument('--seconds', type=float, default=60)
+
+    serve_parser = commands.add_parser('serve')
+    serve_parser.add_argument('path')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.add_argument('--speed', type=float, default=1.0)
+    serve_parser.add_argument('--loop', action='store_true')
+    serve_parser.add_argument('--disconnect-after', type=int)
+
+    check_parser = commands.add_parser('check')
+    check_parser.add_argument('--symbol', default='SYN0USDT')
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        asyncio.run(record(args.path, args.symbols, args.intervals, args.seconds))
+    elif args.command == 'check':
+        logging.basicConfig(level=logging.WARNING)
+        if not asyncio.run(check(args.symbol)):
+            sys.exit(1)
+    else:
+        asyncio.run(serve(args.path, args.host, args.port, args.speed, args.loop, args.disconnect_after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+import asyncio
+import json
+import time
+import random
+import logging
+import contextvars
+from collections import deque
+import httpx
+from config import TRACE_FILE, TRACE_OTLP_ENDPOINT, TRACE_SLOW_THRESHOLD, TRACE_SAMPLE_RATE, TRACE_FLUSH_INTERVAL
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = 'cryptosignalbot'
+
+# Текущий span запроса; дочерние задачи (gather, create_task) наследуют его
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """Отрезок работы внутри запроса с атрибутами и дочерними отрезками"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent', 'name', 'attributes', 'start_ns', 'end_ns', 'error', 'children')
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent = parent
+        self.name = name
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self.children = []
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def duration(self):
+        """Длительность в секундах (для незавершенного span - до текущего момента)"""
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def walk(self, depth=0):
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+
+class _NoopSpan:
+    """Заглушка вне трассируемого запроса: ничего не пишет и почти ничего не стоит"""
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _SpanScope:
+    __slots__ = ('span', 'token', 'root')
+
+    def __init__(self, span, root=False):
+        self.span = span
+        self.token = None
+        self.root = root
+
+    def __enter__(self):
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        span = self.span
+        span.end_ns = time.time_ns()
+        if exc is not None and not isinstance(exc, (asyncio.CancelledError, GeneratorExit)):
+            span.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self.token)
+        if self.root:
+            trace_exporter.finish(span)
+        return False
+
+
+def span(name, **attributes):
+    """Дочерний span текущего запроса: with span('get_klines', symbol=...) as s:
+
+    Вне трассируемого запроса возвращает заглушку.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return _NOOP
+    child = Span(name, parent, attributes)
+    parent.children.append(child)
+    return _SpanScope(child)
+
+
+def trace(name, **attributes):
+    """Корневой span нового запроса; по завершении дерево уходит в экспорт"""
+    return _SpanScope(Span(name, None, attributes), root=True)
+
+
+def format_tree(root):
+    """Дерево span'ов в виде текста для лога медленных запросов"""
+    lines = []
+    for depth, item in root.walk():
+        offset_ms = (item.start_ns - root.start_ns) / 1e6
+        attributes = ' '.join(f"{key}={value}" for key, value in item.attributes.items())
+        error = f" ERROR {item.error}" if item.error else ''
+        lines.append(f"{'  ' * depth}{item.name} +{offset_ms:.1f}ms {item.duration * 1000:.1f}ms {attributes}{error}".rstrip())
+    return "\n".join(lines)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def to_otlp(root):
+    """Дерево span'ов в формате OTLP/JSON (ExportTraceServiceRequest)"""
+    spans = []
+    for _, item in root.walk():
+        spans.append({
+            'traceId': item.trace_id,
+            'spanId': item.span_id,
+            'parentSpanId': item.parent.span_id if item.parent is not None else '',
+            'name': item.name,
+            'kind': 1,
+            'startTimeUnixNano': str(item.start_ns),
+            'endTimeUnixNano': str(item.end_ns or time.time_ns()),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in item.attributes.items()],
+            'status': {'code': 2, 'message': item.error} if item.error else {'code': 1}
+        })
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': spans}]
+        }]
+    }
+
+
+class TraceExporter:
+    """Экспорт завершенных запросов: JSONL-файл и/или OTLP/HTTP коллектор.
+
+    Запросы дольше slow_threshold секунд всегда экспортируются и целиком
+    пишутся в лог; остальные - с вероятностью sample_rate. Запись идет
+    пачками в фоне, чтобы не задерживать ответы пользователям.
+    """
+
+    def __init__(self, path=TRACE_FILE, endpoint=TRACE_OTLP_ENDPOINT, slow_threshold=TRACE_SLOW_THRESHOLD,
+                 sample_rate=TRACE_SAMPLE_RATE, flush_interval=TRACE_FLUSH_INTERVAL, max_pending=1000):
+        self.path = path
+        self.endpoint = endpoint
+        self.slow_threshold = slow_threshold
+        self.sample_rate = sample_rate
+        self.flush_interval = flush_interval
+        self._pending = deque(maxlen=max_pending)
+        self._task = None
+        self._client = None
+
+    def finish(self, root):
+        """Вызывается по завершении корневого span"""
+        duration = root.duration
+        slow = self.slow_threshold and duration >= self.slow_threshold
+        if slow:
+            logger.warning(f"Slow request {root.name} took {duration:.2f}s:\n{format_tree(root)}")
+        if (self.path or self.endpoint) and (slow or random.random() < self.sample_rate):
+            self._pending.append(root)
+
+    async def flush(self):
+        """Отправляет накопленные деревья"""
+        if not self._pending:
+            return
+        batch = [to_otlp(self._pending.popleft()) for _ in range(len(self._pending))]
+        if self.path:
+            await asyncio.to_thread(self._write, batch)
+        if self.endpoint:
+            await self._post(batch)
+
+    def _write(self, batch):
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for item in batch:
+                    f.write(json.dumps(item) + '\n')
+        except OSError as e:
+            logger.error(f"Could not write traces to {self.path}: {e}")
+
+    async def _post(self, batch):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=5)
+        spans = [resource for item in batch for resource in item['resourceSpans']]
+        try:
+            response = await self._client.post(self.endpoint, json={'resourceSpans': spans})
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning(f"Could not export traces to {self.endpoint}: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Trace export failed: {e}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Экспорт трассировок на весь процесс
+trace_exporter = TraceExporter()
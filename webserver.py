@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qsl
+from config import WEB_HOST, WEB_PORT
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Тела запросов больше этого размера не принимаются (обновления Telegram намного меньше)
+MAX_BODY_SIZE = 1024 * 1024
+# Сколько ждать следующий запрос в keep-alive соединении
+KEEPALIVE_TIMEOUT = 75
+
+
+class Request:
+    __slots__ = ('method', 'path', 'query', 'headers', 'body')
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class WebServer:
+    """Небольшой HTTP/1.1 сервер на asyncio в event loop бота.
+
+    Обслуживает webhook Telegram, health-check и метрики, поэтому боту не
+    нужен отдельный поток с WSGI-сервером. Обработчик получает Request и
+    возвращает, как во Flask, (тело, статус) или (тело, статус, заголовки);
+    dict отдается как JSON.
+    """
+
+    def __init__(self, host=WEB_HOST, port=WEB_PORT):
+        self.host = host
+        self.port = port
+        self._routes = {}
+        self._server = None
+        self._connections = {}
+
+    def route(self, path, methods=('GET',)):
+        """Декоратор обработчика: @web_server.route('/health')"""
+        def decorator(handler):
+            for method in methods:
+                self._routes[(method, path)] = handler
+            return handler
+        return decorator
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        # Тела с Transfer-Encoding не разбираются: границу запроса задает только Content-Length
+        encoding = headers.get('transfer-encoding')
+        if encoding is not None:
+            raise ValueError(HTTPStatus.LENGTH_REQUIRED if encoding.lower() == 'chunked' else HTTPStatus.NOT_IMPLEMENTED)
+        length = int(headers.get('content-length', 0))
+        if length > MAX_BODY_SIZE:
+            raise ValueError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        body = await reader.readexactly(length) if length else b''
+        url = urlsplit(target)
+        return Request(method, url.path, dict(parse_qsl(url.query)), headers, body)
+
+    async def _dispatch(self, request):
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                return {'error': 'method not allowed'}, 405
+            return {'error': 'not found'}, 404
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"Error handling {request.method} {request.path}: {e}")
+            return {'error': 'internal error'}, 500
+
+    @staticmethod
+    def _encode(result, keep_alive):
+        body, status, headers = (*result, {})[:3] if isinstance(result, tuple) else (result, 200, {})
+        headers = dict(headers)
+        if isinstance(body, dict):
+            body = json.dumps(body).encode()
+            headers = {'Content-Type': 'application/json', **headers}
+        elif isinstance(body, str):
+            body = body.encode()
+        headers.setdefault('Content-Type', 'text/plain; charset=utf-8')
+        head = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        head.append(f"Content-Length: {len(body)}")
+        head.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        return ("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), KEEPALIVE_TIMEOUT)
+                except ValueError as e:
+                    status = e.args[0] if e.args and isinstance(e.args[0], HTTPStatus) else HTTPStatus.BAD_REQUEST
+                    writer.write(self._encode(({'error': status.phrase}, status.value), False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                writer.write(self._encode(await self._dispatch(request), keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"Web server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        # Закрытие сокета завершает чтение в обработчиках соединений
+        connections = list(self._connections.items())
+        for _, writer in connections:
+            writer.close()
+        await asyncio.gather(*(task for task, _ in connections), return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+
+# HTTP-сервер бота: webhook Telegram, health-check и метрики
+web_server = WebServer()